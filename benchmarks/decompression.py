@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-09'
+__description__ = \
+    """
+    decompression.py:
+    Compare the decompression backends of install_from_web.py extracting large synthetic tarballs
+    """
+
+import argparse
+import importlib
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT_PATH: Path = Path(__file__).resolve().parent.parent.joinpath('install_from_web.py')
+
+# Commands that compress a file to stdout, python is used for the stdlib formats without them
+COMPRESS_COMMANDS: dict = {
+    'gzip': (['pigz', '-c'], ['gzip', '-c']),
+    'bzip2': (['lbzip2', '-c'], ['pbzip2', '-c'], ['bzip2', '-c']),
+    'xz': (['xz', '-c', '-T0'],),
+    'zstd': (['zstd', '-c', '-q'],),
+}
+
+
+def load_installer():
+    """
+    Import install_from_web.py as a module, with its logger quiet, from its folder so the modules of its modes are found next to it
+    :return: The module
+    """
+    sys.path.insert(0, SCRIPT_PATH.parent.as_posix())
+    module = importlib.import_module('install_from_web')
+    module.logger = logging.getLogger('decompression')
+    module.logger.addHandler(logging.NullHandler())
+    module.logger.propagate = False
+
+    return module
+
+
+def make_tarball(folder: Path, size_mb: int) -> Path:
+    """
+    Make an uncompressed tarball of 4MB files, half random and half repetitive, like an app bundle's mix of
+    already compressed resources and text/code
+    :param folder: Folder to build in
+    :param size_mb: Size of the contents in MB
+    :return: Path to the tarball
+    """
+    contents: Path = folder.joinpath('Synthetic.app', 'Contents', 'Resources')
+    contents.mkdir(parents=True)
+    text: bytes = b''.join(f'<key>Item{index}</key><string>value {index % 97}</string>\n'.encode()
+                           for index in range(100000))
+    for index in range(max(size_mb // 4, 1)):
+        data: bytes = os.urandom(4 * 1024 ** 2) if index % 2 else (text * 50)[:4 * 1024 ** 2]
+        contents.joinpath(f'resource_{index:04}.bin').write_bytes(data)
+
+    tarball: Path = folder.joinpath('synthetic.tar')
+    with tarfile.open(tarball, 'w') as tar:
+        tar.add(folder.joinpath('Synthetic.app'), arcname='Synthetic.app')
+    shutil.rmtree(folder.joinpath('Synthetic.app'))
+
+    return tarball
+
+
+def compress(tarball: Path, compression: str) -> Path:
+    """
+    Compress the tarball with the fastest available tool, or python
+    :param tarball: Uncompressed tarball
+    :param compression: gzip, bzip2, xz or zstd
+    :return: Path to the compressed tarball, or None if it cannot be made
+    """
+    compressed: Path = tarball.with_name(f'{tarball.name}.{compression}')
+    for command in COMPRESS_COMMANDS[compression]:
+        if shutil.which(command[0]):
+            with open(compressed, 'wb') as file:
+                subprocess.run([*command, tarball], stdout=file, check=True)
+            return compressed
+
+    if compression == 'zstd':
+        return None
+
+    import bz2
+    import gzip
+    import lzma
+    opener = {'gzip': gzip.open, 'bzip2': bz2.open, 'xz': lzma.open}[compression]
+    with open(tarball, 'rb') as source, opener(compressed, 'wb') as destination:
+        shutil.copyfileobj(source, destination, 1024 ** 2)
+
+    return compressed
+
+
+def time_extraction(installer, compressed: Path, compression: str, backend: str, runs: int) -> float:
+    """
+    Time extracting a tarball the way install_from_web.py does
+    :param installer: The install_from_web module
+    :param compressed: Compressed tarball
+    :param compression: Its compression
+    :param backend: Backend to decompress with
+    :param runs: Number of runs
+    :return: Median seconds
+    """
+    times: list = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as unpack_path:
+            start: float = time.perf_counter()
+            with installer.open_decompressed(compressed, compression, backend) as stream, \
+                    tarfile.open(fileobj=stream, mode='r|') as tar:
+                tar.extractall(path=unpack_path)
+            times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def main():
+    installer = load_installer()
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(f'Making a {options.size} MB synthetic tarball ...')
+        tarball: Path = make_tarball(Path(folder), options.size)
+        size: int = tarball.stat().st_size
+
+        print(f'\n{"COMPRESSION":<12} {"BACKEND":<8} {"RATIO":>6} {"SECONDS":>8} {"MB/S":>8}')
+        for compression in options.formats:
+            compressed: Path = compress(tarball, compression)
+            if compressed is None:
+                print(f'{compression:<12} {"-":<8} no compressor available')
+                continue
+
+            ratio: float = compressed.stat().st_size / size
+            for backend in installer.decompression_backends(compression):
+                seconds: float = time_extraction(installer, compressed, compression, backend, options.runs)
+                print(f'{compression:<12} {backend:<8} {ratio:>6.2f} {seconds:>8.2f} {size / seconds / 1024 ** 2:>8.1f}')
+            compressed.unlink()
+
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument('--size', type=int, default=256,
+                        action='store', dest='size',
+                        help='size of the synthetic tarball in MB (default: 256)')
+    parser.add_argument('--runs', type=int, default=3,
+                        action='store', dest='runs',
+                        help='number of extractions per backend, the median is reported (default: 3)')
+    parser.add_argument('--format', default=None,
+                        choices=tuple(COMPRESS_COMMANDS),
+                        action='append', dest='formats',
+                        help='compression to compare, repeatable (default: all)')
+
+    options = parser.parse_args()
+    options.formats = options.formats or list(COMPRESS_COMMANDS)
+
+    sys.exit(main())
@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-23'
+__description__ = \
+    """
+    pipeline.py:
+    Run the whole install_from_web.py pipeline against a local artifact server, with stub macOS tools so it runs
+    anywhere, and check each file type and config shape against a budget
+    """
+
+import argparse
+import email.utils
+import hashlib
+import http.server
+import importlib
+import io
+import json
+import os
+import plistlib
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+SCRIPT_PATH: Path = Path(__file__).resolve().parent.parent.joinpath('install_from_web.py')
+BUDGET_PATH: Path = Path(__file__).resolve().parent.joinpath('pipeline_budget.json')
+
+# Extension of each file type, dmg and pkg are tarballs the stub hdiutil, pkgutil and installer understand
+FILE_TYPES: dict = {
+    'zip': 'zip',
+    'tar.gz': 'tar.gz',
+    'tar.xz': 'tar.xz',
+    'dmg': 'dmg',
+    'pkg': 'pkg',
+}
+
+# How the config finds and fetches the download
+SHAPES: tuple = ('direct', 'redirect', 'page', 'json', 'appcast', 'throttled', 'cached', 'unchanged', 'delta',
+                 'delta_large')
+
+# Older releases listed before the one installed, in the page, json feed and appcast
+OLDER_RELEASES: int = 2000
+
+# Stand in for the macOS tools, one script installed under each name, it acts on the name it is run as
+STUB_TOOLS: tuple = ('hdiutil', 'pkgutil', 'installer', 'ditto', 'security', 'sudo')
+STUB_SOURCE: str = '''
+import os
+import shutil
+import ssl
+import sys
+import tarfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+tool, args = Path(sys.argv[0]).name, sys.argv[1:]
+receipts = Path(os.environ.get('BENCH_RECEIPTS', '.'))
+
+if tool == 'sudo':
+    stub = Path(sys.argv[0]).with_name(Path(args[0]).name)
+    command = [stub.as_posix() if stub.is_file() else args[0], *args[1:]]
+    os.execvp(command[0], command)
+
+elif tool == 'hdiutil' and args[0] == 'attach':
+    mount_point = Path(args[args.index('-mountpoint') + 1])
+    mount_point.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(args[-1]) as image:
+        image.extractall(mount_point)
+
+elif tool == 'hdiutil' and args[0] == 'detach':
+    shutil.rmtree(args[1], ignore_errors=True)
+
+elif tool == 'pkgutil' and args[0] == '--expand':
+    with tarfile.open(args[1]) as package:
+        package.extractall(args[2])
+
+elif tool == 'pkgutil' and args[0] == '--pkg-info':
+    receipt = receipts.joinpath(args[1])
+    if not receipt.is_file():
+        print(f"No receipt for '{args[1]}' found at '/'.", file=sys.stderr)
+        sys.exit(1)
+    print(f'package-id: {args[1]}\\nversion: {receipt.read_text()}')
+
+elif tool == 'installer':
+    target = Path(args[args.index('-target') + 1])
+    with tarfile.open(args[args.index('-pkg') + 1]) as package:
+        info = ET.fromstring(package.extractfile('PackageInfo').read())
+        with tarfile.open(fileobj=package.extractfile('Payload'), mode='r|gz') as payload:
+            payload.extractall(target)
+    receipts.mkdir(parents=True, exist_ok=True)
+    receipts.joinpath(info.get('identifier')).write_text(info.get('version'))
+    print('installer: The install was successful.')
+
+elif tool == 'ditto':
+    shutil.copytree(args[-2], args[-1], symlinks=True, dirs_exist_ok=True)
+
+elif tool == 'security':
+    paths = ssl.get_default_verify_paths()
+    shutil.copyfile(paths.cafile or paths.openssl_cafile, args[args.index('-o') + 1])
+
+else:
+    print(f'{tool}: unsupported arguments {args}', file=sys.stderr)
+    sys.exit(1)
+'''
+
+
+def load_installer():
+    """
+    Import install_from_web.py as a module, from its folder so the modules of its modes are found next to it
+    :return: The module
+    """
+    sys.path.insert(0, SCRIPT_PATH.parent.as_posix())
+    module = importlib.import_module('install_from_web')
+
+    return module
+
+
+def make_app(folder: Path, version: str, size_mb: int, small_files: int, grow: int = 0) -> Path:
+    """
+    Make a synthetic app bundle of 1MB resources, half random and half repetitive, and many small files
+    The resources are the same in every version except the first, so an older version can seed a delta download
+    :param folder: Folder to build in
+    :param version: Version of the app
+    :param size_mb: Size of the resources in MB
+    :param small_files: Number of small (2KB) files
+    :param grow: Bytes added to the first resource, moving everything after it off the block boundaries
+    :return: Path to the app
+    """
+    app_path: Path = folder.joinpath(version, 'Bench.app')
+    contents: Path = app_path.joinpath('Contents')
+    contents.joinpath('MacOS').mkdir(parents=True)
+    contents.joinpath('Resources', 'Strings').mkdir(parents=True)
+
+    contents.joinpath('Info.plist').write_bytes(plistlib.dumps({
+        'CFBundleIdentifier': 'com.example.bench',
+        'CFBundleName': 'Bench',
+        'CFBundleShortVersionString': version,
+        'CFBundleVersion': version
+    }))
+    executable: Path = contents.joinpath('MacOS', 'Bench')
+    executable.write_text('#!/bin/sh\necho Bench\n')
+    executable.chmod(0o755)
+
+    text: bytes = b''.join(f'<key>Item{index}</key><string>value {index % 97}</string>\n'.encode()
+                           for index in range(25000))
+    for index in range(max(size_mb, 1)):
+        seed: str = f'{index}-{version}' if index == 0 else str(index)
+        size: int = 1024 ** 2 + (grow if index == 0 else 0)
+        data: bytes = random.Random(seed).randbytes(size) if index % 2 == 0 else (text * 2)[:1024 ** 2]
+        contents.joinpath('Resources', f'resource_{index:03}.bin').write_bytes(data)
+    for index in range(small_files):
+        contents.joinpath('Resources', 'Strings', f'string_{index:04}.strings').write_bytes(text[:2048])
+
+    return app_path
+
+
+def make_artifact(app_path: Path, www: Path, file_type: str, version: str) -> Path:
+    """
+    Package the app as a download
+    :param app_path: App to package
+    :param www: Folder the server serves the downloads from
+    :param file_type: Key of FILE_TYPES
+    :param version: Version of the app
+    :return: Path to the download
+    """
+    artifact: Path = www.joinpath(f'Bench-{version}.{FILE_TYPES[file_type]}')
+
+    if file_type == 'zip':
+        with zipfile.ZipFile(artifact, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            for path in sorted(app_path.rglob('*')):
+                zip_ref.write(path, path.relative_to(app_path.parent).as_posix())
+
+    elif file_type == 'tar.gz':
+        with tarfile.open(artifact, 'w:gz') as tar:
+            tar.add(app_path, arcname=app_path.name)
+
+    elif file_type == 'tar.xz':
+        with tarfile.open(artifact, 'w:xz', preset=1) as tar:
+            tar.add(app_path, arcname=app_path.name)
+
+    elif file_type == 'dmg':
+        with tarfile.open(artifact, 'w') as tar:
+            tar.add(app_path, arcname=app_path.name)
+
+    else:
+        payload: Path = artifact.with_name(f'{artifact.name}.payload')
+        with tarfile.open(payload, 'w:gz') as tar:
+            tar.add(app_path, arcname=f'Applications/{app_path.name}')
+        package_info: Path = artifact.with_name(f'{artifact.name}.info')
+        package_info.write_text(f'<pkg-info identifier="com.example.bench" version="{version}"/>\n')
+        with tarfile.open(artifact, 'w') as tar:
+            tar.add(package_info, arcname='PackageInfo')
+            tar.add(payload, arcname='Payload')
+        payload.unlink()
+        package_info.unlink()
+
+    return artifact
+
+
+def make_pages(base_url: str) -> dict:
+    """
+    Make the page, json feed and appcasts the download is found in, the installed release is listed last
+    :param base_url: Url of the server
+    :return: Dictionary of path to (body, content type)
+    """
+    pages: dict = {}
+    releases: list = [f'1.{index}' for index in range(OLDER_RELEASES)]
+
+    links: list = [f'<li><a href="{base_url}/files/Other-{version}.zip">Other {version}</a></li>' for version in releases]
+    links.extend(f'<li><a href="{base_url}/files/Bench-2.0.{extension}">Bench 2.0</a></li>'
+                 for extension in FILE_TYPES.values())
+    pages['/page.html'] = (f'<html><body><ul>{"".join(links)}</ul></body></html>'.encode(), 'text/html')
+
+    feed: list = [{'name': f'Bench {version}', 'version': version, 'url': f'{base_url}/files/Bench-{version}.zip'}
+                  for version in releases]
+    feed.extend({'name': 'Bench 2.0', 'version': '2.0', 'url': f'{base_url}/files/Bench-2.0.{extension}'}
+                for extension in FILE_TYPES.values())
+    pages['/releases.json'] = (json.dumps({'releases': feed}).encode(), 'application/json')
+
+    for extension in FILE_TYPES.values():
+        items: list = [f'<item><title>{version}</title><enclosure url="{base_url}/files/Bench-{version}.{extension}" '
+                       f'sparkle:shortVersionString="{version}" length="0" type="application/octet-stream"/></item>'
+                       for version in releases]
+        items.append(f'<item><title>2.0</title><enclosure url="{base_url}/files/Bench-2.0.{extension}" '
+                     f'sparkle:shortVersionString="2.0" type="application/octet-stream"/></item>')
+        pages[f'/appcast-{extension}.xml'] = (
+            '<?xml version="1.0" encoding="utf-8"?><rss version="2.0" '
+            'xmlns:sparkle="http://www.andymatuschak.org/xml-namespaces/sparkle">'
+            f'<channel><title>Bench</title>{"".join(items)}</channel></rss>'.encode(), 'application/rss+xml')
+
+    return pages
+
+
+class BenchHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve the downloads and pages, with ETags, ranges, redirect chains (/redirect/<hops>/...) and throttled links
+    (/throttle/...)
+    """
+    protocol_version: str = 'HTTP/1.1'
+    www: Path = None
+    pages: dict = {}
+    throttle: float = 0
+    requests: int = 0
+    lock: threading.Lock = threading.Lock()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        self.respond(head=True)
+
+    def do_GET(self) -> None:
+        self.respond(head=False)
+
+    def respond(self, head: bool) -> None:
+        """
+        Send a download or page
+        :param head: Send the headers only
+        """
+        with self.lock:
+            BenchHandler.requests += 1
+
+        path: str = urlparse(self.path).path
+        redirect: Optional[re.Match] = re.fullmatch(r'/redirect/(\d+)(/.*)', path)
+        if redirect:
+            hops: int = int(redirect.group(1)) - 1
+            self.send_response(302)
+            self.send_header('Location', f'/redirect/{hops}{redirect.group(2)}' if hops else redirect.group(2))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        rate: float = 0
+        if path.startswith('/throttle/'):
+            path, rate = path[len('/throttle'):], self.throttle
+
+        file_path: Path = self.www.joinpath(path[len('/files/'):]) if path.startswith('/files/') else None
+        if path in self.pages:
+            body, content_type = self.pages[path]
+            size, modified = len(body), 0
+            etag: str = f'"{hashlib.md5(body).hexdigest()}"'
+        elif file_path is not None and file_path.is_file():
+            body, content_type = None, 'application/octet-stream'
+            stat: os.stat_result = file_path.stat()
+            size, modified = stat.st_size, stat.st_mtime
+            etag: str = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        else:
+            self.send_error(404)
+            return
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start, end = 0, size - 1
+        byte_range: Optional[re.Match] = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range') or '')
+        if byte_range and byte_range.group(1):
+            start, end = int(byte_range.group(1)), min(int(byte_range.group(2) or end), end)
+        elif byte_range and byte_range.group(2):
+            start = max(size - int(byte_range.group(2)), 0)
+        self.send_response(206 if byte_range else 200)
+        if byte_range:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(modified, usegmt=True))
+        self.end_headers()
+        if head:
+            return
+
+        chunk_size: int = 64 * 1024 if rate else 1024 ** 2
+        sent: int = 0
+        started: float = time.perf_counter()
+        try:
+            with open(file_path, 'rb') if body is None else io.BytesIO(body) as file:
+                file.seek(start)
+                while sent < end - start + 1:
+                    chunk: bytes = file.read(min(chunk_size, end - start + 1 - sent))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if rate:
+                        time.sleep(max(sent / rate - (time.perf_counter() - started), 0))
+        except (ConnectionError, TimeoutError):
+            pass
+
+
+def case_configs(shape: str, file_type: str, base_url: str, state: Path) -> tuple:
+    """
+    Make the config of a case, and the configs run before it to seed its cache or history
+    :param shape: One of SHAPES
+    :param file_type: Key of FILE_TYPES
+    :param base_url: Url of the server
+    :param state: Folder of the run, with its install paths, cache and history
+    :return: List of seed configs and the config
+    """
+    extension: str = FILE_TYPES[file_type]
+    download_url: str = f'{base_url}/files/Bench-2.0.{extension}'
+    config: dict = {
+        'name': 'Bench',
+        'url': download_url,
+        'app_install_path': state.joinpath('Applications').as_posix(),
+        'pkg_install_path': state.joinpath('root').as_posix(),
+        'reinstall': True
+    }
+    if file_type in ('dmg', 'pkg'):
+        config['file_type'] = file_type
+    seeds: list = []
+
+    if shape == 'redirect':
+        config['url'] = f'{base_url}/redirect/3/files/Bench-2.0.{extension}'
+    elif shape == 'page':
+        config.update(url=f'{base_url}/page.html', regex=rf'http://[^"]+/Bench-2\.0\.{re.escape(extension)}')
+    elif shape == 'json':
+        config.update(url=f'{base_url}/releases.json', json_path='releases[*]', json_url='url',
+                      json_filter={'url': rf'.*/Bench-2\.0\.{re.escape(extension)}'})
+    elif shape == 'appcast':
+        config.update(url=f'{base_url}/appcast-{extension}.xml', appcast=True)
+    elif shape == 'throttled':
+        config['url'] = f'{base_url}/throttle/files/Bench-2.0.{extension}'
+    elif shape == 'cached':
+        config['cache_dir'] = state.joinpath('cache').as_posix()
+        seeds.append(dict(config))
+    elif shape == 'unchanged':
+        config.update(history_file=state.joinpath('history.db').as_posix(), skip_unchanged=True, reinstall=False)
+        seeds.append(dict(config))
+    elif shape in ('delta', 'delta_large'):
+        prefix: str = 'Bench-large-' if shape == 'delta_large' else 'Bench-'
+        config.update(url=f'{base_url}/files/{prefix}2.0.{extension}', cache_dir=state.joinpath('cache').as_posix(),
+                      delta=True, blockmap_url='{url}.blockmap.json')
+        seeds.append({**config, 'url': f'{base_url}/files/{prefix}1.9.{extension}', 'delta': False})
+
+    return seeds, config
+
+
+def run_child(config: dict, stub_bin: Path, state: Path, strace_file: Optional[Path] = None) -> dict:
+    """
+    Run a config in a new process, as the script would
+    :param config: Config of the job
+    :param stub_bin: Folder of the stub tools, put first on the PATH
+    :param state: Folder of the run
+    :param strace_file: Count the syscalls of the job and its tools with strace into this file
+    :return: Metrics of the job with its return_code, wall time, peak RSS and syscalls
+    """
+    spec: dict = {'config': config, 'stub_bin': stub_bin.as_posix(),
+                  'defaults': {'copy_method': options.copy_method}}
+    command: list = [sys.executable, Path(__file__).resolve().as_posix(), '--job', json.dumps(spec)]
+    if strace_file is not None:
+        command = ['strace', '-f', '-c', '-o', strace_file.as_posix(), *command]
+    env: dict = {**os.environ, 'PATH': f'{stub_bin}{os.pathsep}{os.environ.get("PATH", "")}',
+                 'BENCH_RECEIPTS': state.joinpath('receipts').as_posix()}
+
+    log_path: Path = state.joinpath('job.log')
+    with open(log_path, 'ab') as log:
+        start_time: float = time.perf_counter()
+        process: subprocess.Popen = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=log, env=env)
+        stdout: bytes = process.stdout.read()
+        process.stdout.close()
+        _, status, usage = os.wait4(process.pid, 0)
+        wall: float = time.perf_counter() - start_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    lines: list = stdout.decode(errors='replace').strip().splitlines()
+    try:
+        result: dict = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        result: dict = {'return_code': process.returncode or 1, 'phases': {},
+                        'error': log_path.read_text(errors='replace')[-2000:]}
+
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    result['wall'] = wall
+    result['peak_mb'] = usage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    if strace_file is not None:
+        totals: list = [line.split() for line in strace_file.read_text().splitlines() if line.endswith(' total')]
+        result['syscalls'] = int(totals[-1][3]) if totals else None
+
+    return result
+
+
+def run_job(spec: dict) -> int:
+    """
+    Run a config through the installer, in this process, with the macOS tools it runs replaced by the stubs
+    The metrics of the job are printed as the last line of json
+    :param spec: Config, defaults and stub folder from run_child
+    :return: 0
+    """
+    installer = load_installer()
+    stub_bin: Path = Path(spec['stub_bin'])
+
+    class StubSystem(installer.System):
+        """
+        The real system, with the macOS tools, run by their absolute paths, pointing at the stubs
+        """
+
+        def popen(self, args, *popen_args, **kwargs):
+            if isinstance(args, (list, tuple)) and stub_bin.joinpath(Path(args[0]).name).is_file():
+                args = [stub_bin.joinpath(Path(args[0]).name).as_posix(), *args[1:]]
+            return super().popen(args, *popen_args, **kwargs)
+
+    runner = installer.Runner()
+    job = installer.UpdateJob.from_config(spec['config'], spec['defaults'], StubSystem())
+    return_code: int = runner.run(job)
+
+    # Read and write syscalls of this process, Linux only
+    syscalls: Optional[int] = None
+    if Path('/proc/self/io').is_file():
+        io_counters: dict = dict(line.split(': ') for line in Path('/proc/self/io').read_text().splitlines())
+        syscalls = int(io_counters['syscr']) + int(io_counters['syscw'])
+
+    print(json.dumps({**runner.results[job.name].as_dict(), 'return_code': return_code, 'syscalls': syscalls},
+                     default=str))
+    return 0
+
+
+def main() -> int:
+    load_installer()
+    from install_from_web_delta import make_blockmap
+
+    with tempfile.TemporaryDirectory() as folder:
+        folder: Path = Path(folder)
+        www: Path = folder.joinpath('www')
+        www.mkdir()
+        stub_bin: Path = folder.joinpath('bin')
+        stub_bin.mkdir()
+        for tool in STUB_TOOLS:
+            stub_bin.joinpath(tool).write_text(f'#!{sys.executable}\n{STUB_SOURCE}')
+            stub_bin.joinpath(tool).chmod(0o755)
+
+        print(f'Making a {options.size} MB synthetic app with {options.small_files} small files ...')
+        versions: tuple = ('1.9', '2.0') if 'delta' in options.shapes else ('2.0',)
+        for version in versions:
+            app_path: Path = make_app(folder.joinpath('apps'), version, options.size, options.small_files)
+            for file_type in options.file_types:
+                artifact: Path = make_artifact(app_path, www, file_type, version)
+                if version == '2.0':
+                    www.joinpath(f'{artifact.name}.blockmap.json').write_text(
+                        json.dumps(make_blockmap(artifact)))
+
+        # A release size app whose newer version moves every block after its first resource, so the older one is
+        # only found by rolling
+        if 'delta_large' in options.shapes:
+            print(f'Making a {options.delta_size} MB synthetic app for delta_large ...')
+            for version in ('1.9', '2.0'):
+                app_path: Path = make_app(folder.joinpath('large-apps'), version, options.delta_size,
+                                          options.small_files, grow=4099 if version == '2.0' else 0)
+                for file_type in options.file_types:
+                    artifact: Path = make_artifact(app_path, www, file_type, f'large-{version}')
+                    if version == '2.0':
+                        www.joinpath(f'{artifact.name}.blockmap.json').write_text(
+                            json.dumps(make_blockmap(artifact)))
+                shutil.rmtree(app_path)
+
+        server: http.server.ThreadingHTTPServer = http.server.ThreadingHTTPServer(('127.0.0.1', 0), BenchHandler)
+        server.daemon_threads = True
+        base_url: str = f'http://127.0.0.1:{server.server_address[1]}'
+        BenchHandler.www = www
+        BenchHandler.pages = make_pages(base_url)
+        BenchHandler.throttle = options.throttle * 1024 ** 2
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        strace: bool = options.strace and shutil.which('strace') is not None
+        if options.strace and not strace:
+            print('strace is not available, counting the read and write syscalls of the job only')
+
+        results: dict = {}
+        print(f'\n{"CASE":<18} {"CODE":>4} {"SECONDS":>8} {"JOB":>7} {"DL MB/S":>8} {"PEAK MB":>8} '
+              f'{"SYSCALLS":>9} {"REQUESTS":>8}')
+        for file_type in options.file_types:
+            for shape in options.shapes:
+                case: str = f'{file_type}/{shape}'
+                runs: list = []
+                for _ in range(options.runs):
+                    with tempfile.TemporaryDirectory(dir=folder) as state:
+                        seeds, config = case_configs(shape, file_type, base_url, Path(state))
+                        for seed in seeds:
+                            run_child(seed, stub_bin, Path(state))
+                        BenchHandler.requests = 0
+                        runs.append({**run_child(config, stub_bin, Path(state)), 'requests': BenchHandler.requests})
+
+                if strace:
+                    with tempfile.TemporaryDirectory(dir=folder) as state:
+                        seeds, config = case_configs(shape, file_type, base_url, Path(state))
+                        for seed in seeds:
+                            run_child(seed, stub_bin, Path(state))
+                        syscalls: Optional[int] = run_child(config, stub_bin, Path(state),
+                                                            Path(state).joinpath('strace.txt'))['syscalls']
+                else:
+                    syscalls: Optional[int] = runs[-1].get('syscalls')
+
+                download_rates: list = [run['download_bytes'] / run['phases']['download'] for run in runs
+                                        if run.get('download_bytes') and run['phases'].get('download')]
+                phases: dict = {phase: statistics.median(run['phases'][phase] for run in runs if phase in run['phases'])
+                                for phase in dict.fromkeys(phase for run in runs for phase in run['phases'])}
+                results[case] = {
+                    'return_code': max(run['return_code'] for run in runs),
+                    'seconds': statistics.median(run['wall'] for run in runs),
+                    'job_seconds': statistics.median(run.get('duration') or 0 for run in runs),
+                    'download_mb_per_second': statistics.median(download_rates) / 1024 ** 2 if download_rates else None,
+                    'peak_mb': max(run['peak_mb'] for run in runs),
+                    'syscalls': syscalls,
+                    'requests': runs[-1]['requests'],
+                    'phases': phases
+                }
+
+                result: dict = results[case]
+                rate: str = f'{result["download_mb_per_second"]:.1f}' if result['download_mb_per_second'] else '-'
+                print(f'{case:<18} {result["return_code"]:>4} {result["seconds"]:>8.2f} {result["job_seconds"]:>7.2f} '
+                      f'{rate:>8} {result["peak_mb"]:>8.1f} {result["syscalls"] or "-":>9} {result["requests"]:>8}')
+                print('    ' + '  '.join(f'{phase} {seconds * 1000:.0f}ms' for phase, seconds in phases.items()))
+                for run in runs:
+                    if run.get('error'):
+                        print(f'    {run["error"].strip().splitlines()[-1]}')
+
+        server.shutdown()
+
+    if options.write_budget:
+        budget: dict = json.loads(options.budget.read_text()) if options.budget.is_file() else {}
+        for case, result in results.items():
+            budget.setdefault('cases', {})[case] = {
+                'seconds': round(result['seconds'] * options.headroom + options.slack, 3),
+                'peak_mb': round(result['peak_mb'] * options.headroom, 1)
+            }
+        options.budget.write_text(json.dumps(budget, indent=2) + '\n')
+        print(f'\nBudget written to {options.budget}')
+        return 0
+
+    failures: list = [f'{case} exited with {result["return_code"]}' for case, result in results.items()
+                      if result['return_code']]
+    if options.budget.is_file():
+        budget: dict = json.loads(options.budget.read_text()).get('cases', {})
+        for case, result in results.items():
+            if result['seconds'] > budget.get(case, {}).get('seconds', float('inf')):
+                failures.append(f'{case} took {result["seconds"]:.2f}s, over the budget of {budget[case]["seconds"]}s')
+            if result['peak_mb'] > budget.get(case, {}).get('peak_mb', float('inf')):
+                failures.append(f'{case} peaked at {result["peak_mb"]:.1f} MB, '
+                                f'over the budget of {budget[case]["peak_mb"]} MB')
+    else:
+        print(f'\nNo budget at {options.budget}, use --write-budget to create one')
+
+    print()
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if not failures:
+        print('Within budget')
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument('--type', default=None,
+                        choices=tuple(FILE_TYPES),
+                        action='append', dest='file_types',
+                        help='file type to run, repeatable (default: all)')
+    parser.add_argument('--shape', default=None,
+                        choices=SHAPES,
+                        action='append', dest='shapes',
+                        help='config shape to run, repeatable (default: all)\n'
+                             'direct: the download url, redirect: through 3 redirects, '
+                             'page: found with a regex in a large page, json: found in a large json feed, '
+                             'appcast: found in a large appcast, throttled: served at --throttle, '
+                             'cached: revalidated in the cache with its ETag, '
+                             'unchanged: skipped after a HEAD request with --skip-unchanged, '
+                             'delta: rebuilt from an older release with range requests, '
+                             'delta_large: the same at --delta-size with every block moved')
+    parser.add_argument('--size', type=int, default=16,
+                        action='store', dest='size',
+                        help='size of the app resources in MB (default: 16)')
+    parser.add_argument('--delta-size', type=int, default=256,
+                        action='store', dest='delta_size',
+                        help='size of the app resources of the delta_large case in MB (default: 256)')
+    parser.add_argument('--small-files', type=int, default=500,
+                        action='store', dest='small_files',
+                        help='number of small files in the app (default: 500)')
+    parser.add_argument('--runs', type=int, default=3,
+                        action='store', dest='runs',
+                        help='number of runs per case, the median is reported (default: 3)')
+    parser.add_argument('--throttle', type=float, default=32,
+                        action='store', dest='throttle',
+                        help='rate of the throttled links in MB/s (default: 32)')
+    parser.add_argument('--copy-method', default='ditto',
+                        choices=('shutil', 'ditto', 'cp', 'rsync'),
+                        action='store', dest='copy_method',
+                        help='copy method of the jobs, ditto is the stub (default: ditto)')
+    parser.add_argument('--strace', default=False,
+                        action='store_true', dest='strace',
+                        help='count every syscall of the job and its tools with strace, in an extra run per case\n'
+                             'without it only the read and write syscalls of the job are counted, on Linux')
+    parser.add_argument('--budget', type=Path, default=BUDGET_PATH,
+                        action='store', dest='budget',
+                        help=f'budget file (default: {BUDGET_PATH.name})')
+    parser.add_argument('--write-budget', default=False,
+                        action='store_true', dest='write_budget',
+                        help='write the current measurements, with headroom, as the budget')
+    parser.add_argument('--headroom', type=float, default=1.5,
+                        action='store', dest='headroom',
+                        help='multiplier applied when writing the budget (default: 1.5)')
+    parser.add_argument('--slack', type=float, default=0.5,
+                        action='store', dest='slack',
+                        help='seconds added to each case when writing the budget, for the noise of short cases '
+                             '(default: 0.5)')
+    parser.add_argument('--job', default=None,
+                        action='store', dest='job',
+                        help=argparse.SUPPRESS)
+
+    options = parser.parse_args()
+    if options.job is not None:
+        sys.exit(run_job(json.loads(options.job)))
+    options.file_types = options.file_types or list(FILE_TYPES)
+    options.shapes = options.shapes or list(SHAPES)
+
+    sys.exit(main())
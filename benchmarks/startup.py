@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-02'
+__description__ = \
+    """
+    startup.py: 
+    Measure the start up cost of install_from_web.py on its early exit path and check it against a budget
+    """
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT_PATH: Path = Path(__file__).resolve().parent.parent.joinpath('install_from_web.py')
+BUDGET_PATH: Path = Path(__file__).resolve().parent.joinpath('startup_budget.json')
+
+
+def early_exit_command(command: list, blocking_file: str) -> list:
+    """
+    Build the command for a run that exits at the blocking file check
+    :param command: Command to start the installer
+    :param blocking_file: Path that exists, so the run is blocked
+    :return: Full command
+    """
+    return [*command, '--url', 'https://localhost/installer.dmg', '--blocking-file', blocking_file]
+
+
+def import_breakdown(blocking_file: str) -> tuple:
+    """
+    Run the script with -X importtime and parse the result
+    :param blocking_file: Path that exists, so the run is blocked
+    :return: Total import time in microseconds, dict of top level module cumulative times, set of all modules
+    """
+    cmd: list = early_exit_command([sys.executable, '-X', 'importtime', SCRIPT_PATH.as_posix()], blocking_file)
+    result: subprocess.CompletedProcess = subprocess.run(cmd, capture_output=True, text=True,
+                                                         env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'})
+
+    top_level: dict = {}
+    modules: set = set()
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)', line)
+        if not match:
+            continue
+        modules.add(match.group(4))
+        # Top level imports are indented by a single space
+        if len(match.group(3)) == 1:
+            top_level[match.group(4)] = int(match.group(2))
+
+    return sum(top_level.values()), top_level, modules
+
+
+def compile_time(runs: int) -> float:
+    """
+    Time compiling the script, paid on every run from source as the bytecode of __main__ is never cached
+    :param runs: Number of compiles
+    :return: Fastest compile in milliseconds
+    """
+    source: str = SCRIPT_PATH.read_text()
+    times: list = []
+    for _ in range(runs):
+        start_time: float = time.perf_counter()
+        compile(source, SCRIPT_PATH.as_posix(), 'exec')
+        times.append((time.perf_counter() - start_time) * 1000)
+    return min(times)
+
+
+def wall_clock(command: list, blocking_file: str, runs: int) -> list:
+    """
+    Time complete runs of the early exit path
+    :param command: Command to start the installer
+    :param blocking_file: Path that exists, so the run is blocked
+    :param runs: Number of runs
+    :return: Run times in milliseconds
+    """
+    times: list = []
+    for _ in range(runs):
+        start_time: float = time.perf_counter()
+        subprocess.run(early_exit_command(command, blocking_file), capture_output=True)
+        times.append((time.perf_counter() - start_time) * 1000)
+    return times
+
+
+def main() -> int:
+    blocking_file: str = tempfile.gettempdir()
+    command: list = options.command.split() if options.command else [sys.executable, SCRIPT_PATH.as_posix()]
+
+    print(f'Startup benchmark of: {" ".join(command)}')
+
+    total_import, top_level, modules = import_breakdown(blocking_file)
+    print(f'\nImport time (-X importtime, top level, cumulative): {total_import / 1000:.1f} ms')
+    for module, microseconds in sorted(top_level.items(), key=lambda item: -item[1])[:options.top]:
+        print(f'  {module:<30} {microseconds / 1000:>8.2f} ms')
+
+    compile_ms: float = compile_time(options.runs)
+    print(f'\nCompile time of the script: {compile_ms:.1f} ms')
+
+    times: list = wall_clock(command, blocking_file, options.runs)
+    print(f'\nWall clock over {options.runs} run(s): '
+          f'min {min(times):.1f} ms, median {statistics.median(times):.1f} ms, max {max(times):.1f} ms')
+
+    if options.write_budget:
+        budget: dict = json.loads(options.budget.read_text()) if options.budget.is_file() else {}
+        budget['import_ms'] = round(total_import / 1000 * options.headroom, 1)
+        budget['compile_ms'] = round(compile_ms * options.headroom, 1)
+        budget['wall_ms'] = round(statistics.median(times) * options.headroom, 1)
+        budget.setdefault('forbidden_modules', [])
+        options.budget.write_text(json.dumps(budget, indent=2) + '\n')
+        print(f'\nBudget written to {options.budget}')
+        return 0
+
+    if not options.budget.is_file():
+        print(f'\nNo budget at {options.budget}, use --write-budget to create one')
+        return 0
+
+    budget: dict = json.loads(options.budget.read_text())
+    failures: list = []
+    if total_import / 1000 > budget.get('import_ms', float('inf')):
+        failures.append(f'import time {total_import / 1000:.1f} ms is over the budget of {budget["import_ms"]} ms')
+    if compile_ms > budget.get('compile_ms', float('inf')):
+        failures.append(f'compile time {compile_ms:.1f} ms is over the budget of {budget["compile_ms"]} ms')
+    if statistics.median(times) > budget.get('wall_ms', float('inf')):
+        failures.append(f'wall clock {statistics.median(times):.1f} ms is over the budget of {budget["wall_ms"]} ms')
+    for module in sorted(modules.intersection(budget.get('forbidden_modules', []))):
+        failures.append(f'{module} is imported on the early exit path')
+
+    print()
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if not failures:
+        print('Within budget')
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument('--runs', type=int, default=10,
+                        action='store', dest='runs',
+                        help='number of timed runs (default: 10)')
+    parser.add_argument('--top', type=int, default=15,
+                        action='store', dest='top',
+                        help='number of top level imports to show (default: 15)')
+    parser.add_argument('--command', default=None,
+                        action='store', dest='command',
+                        help='time this command instead of the script, import breakdown is always of the script\n'
+                             'Example: dist/install_from_web')
+    parser.add_argument('--budget', type=Path, default=BUDGET_PATH,
+                        action='store', dest='budget',
+                        help=f'budget file (default: {BUDGET_PATH.name})')
+    parser.add_argument('--write-budget', default=False,
+                        action='store_true', dest='write_budget',
+                        help='write the current measurements, with headroom, as the budget')
+    parser.add_argument('--headroom', type=float, default=1.5,
+                        action='store', dest='headroom',
+                        help='multiplier applied when writing the budget (default: 1.5)')
+
+    options = parser.parse_args()
+
+    sys.exit(main())
@@ -16,27 +16,93 @@ __description__ = \
 
 import argparse
 import atexit
+import contextlib
+import contextvars
+import functools
 import json
-import logging.config
-import mimetypes
+import logging
 import os
-import plistlib
-import pprint
 import re
-import shutil
-import ssl
 import subprocess
 import sys
-import tarfile
-import tempfile
+import threading
 import time
-import urllib.request
-import xml.etree.ElementTree as ET
-import zipfile
 from pathlib import Path
 from typing import Optional, Any
 from urllib.parse import urlparse
-from xml.etree.ElementTree import ElementTree
+
+# Heavier modules (ssl, urllib.request, tarfile, zipfile, plistlib, xml.etree, ...) are imported where they are
+# first used, so runs that exit early (blocking app/file, required file) never load them
+# Rarely used modes (delta, serve, feeds, manifest, report, plan, daemon) are in install_from_web_<mode>.py next to
+# this script, imported on first use, so their bytecode is cached instead of compiled with the script on every run.
+# They import what they share from install_from_web, which is this module when it is run as a script
+if __name__ == '__main__':
+    sys.modules.setdefault('install_from_web', sys.modules[__name__])
+
+# Size of the blocks read from the network when saving downloads
+DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
+
+# HTTP statuses worth trying a request again for
+RETRY_STATUSES: tuple = (408, 425, 429, 500, 502, 503, 504)
+
+# Size of the blocks in a block map for delta downloads
+BLOCKMAP_BLOCK_SIZE: int = 64 * 1024
+
+# Most Range requests for a delta download, the closest ranges are merged beyond this
+DELTA_MAX_RANGES: int = 64
+
+# Bytes and seconds a delta download rolls through an older release a byte at a time looking for moved blocks
+DELTA_ROLL_LIMIT: int = 8 * 1024 ** 2
+DELTA_ROLL_TIMEOUT: float = 5
+
+# Fraction of the new file an older release has to provide, below it the download is fetched in full
+DELTA_MIN_REUSE: float = 0.1
+
+# Seconds each phase may take by default, 0 turns a timeout off (--timeout)
+# connect and read are per request (read is the longest wait for data), download is all attempts of a download
+PHASE_TIMEOUTS: dict = {
+    'connect': 30,
+    'read': 120,
+    'download': 3600,
+    'mount': 300,
+    'expand': 600,
+    'install': 1800,
+    'copy': 900,
+}
+
+# Seconds past its timeout the watchdog gives a phase before killing its processes, and again before interrupting it
+WATCHDOG_GRACE: float = 30
+
+# Exit code of a run that timed out
+TIMEOUT_CODE: int = 11
+
+# Hash of the files in an installed app's manifest
+MANIFEST_HASH: str = 'sha256'
+
+# Extended attribute Gatekeeper checks downloaded apps for, cleared before launching with --run
+QUARANTINE_XATTR: str = 'com.apple.quarantine'
+
+# Apps of a multi-app download (--bundle) copied at the same time
+BUNDLE_WORKERS: int = 4
+
+# Seconds the exported root certificates and the ssl context built from them are used before being reloaded
+SSL_CONTEXT_TTL: int = 60 * 60
+
+# Size the --log file is rotated at and the rotated files kept
+LOG_MAX_SIZE: int = 10 * 1024 ** 2
+LOG_BACKUPS: int = 5
+
+# Checksum algorithms by the length of their hex digest
+CHECKSUM_ALGORITHMS: dict = {64: 'sha256', 128: 'sha512'}
+
+# Compressed tarball signatures and the backends that decompress them, fastest first (benchmarks/decompression.py)
+# Tools decompress to stdout, ['python'] is the standard library, which beats a single threaded gzip
+COMPRESSIONS: dict = {
+    'gzip': (b'\x1f\x8b', (['pigz', '-dc'], ['python'], ['gzip', '-dc'])),
+    'bzip2': (b'BZh', (['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc'], ['python'])),
+    'xz': (b'\xfd7zXZ\x00', (['xz', '-dc', '-T0'], ['python'])),
+    'zstd': (b'\x28\xb5\x2f\xfd', (['zstd', '-dc'], ['python'])),
+}
 
 
 class ColourFormat(logging.Formatter):
@@ -53,6 +119,7 @@ class ColourFormat(logging.Formatter):
         levels: tuple, tuple (level number start, colour, attribute
         """
         self.levels = {}
+        self.colours: dict = {}
         set_levels: dict = {10: 90, 20: 92, 30: 93, 40: 91, 50: (41, 97)}
         set_levels.update(levels)
 
@@ -69,31 +136,522 @@ class ColourFormat(logging.Formatter):
         Override the formatMessage method to add colour
         """
         no_colour: str = u'\x1b[0m'
-        for level in self.levels:
-            colour: str = self.levels[level] if record.levelno >= level else colour
+        colour: Optional[str] = self.colours.get(record.levelno)
+        if colour is None:
+            colour = next((self.levels[level] for level in reversed(self.levels) if record.levelno >= level), '')
+            self.colours[record.levelno] = colour
 
         return f'{colour}{super().formatMessage(record, **kwargs)}{no_colour}'
 
 
-class CustomRedirectHandler(urllib.request.HTTPRedirectHandler):
-    def __init__(self):
+class JsonFormat(logging.Formatter):
+    """
+    Format logging events as json lines, with the config and phase they were logged in, for log shippers
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Format a record as a line of json
+        :param record: The record
+        :return: The json
+        """
+        entry: dict = {
+            'time': f'{time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))}.{int(record.msecs):03}Z',
+            'level': record.levelname,
+            'config': getattr(record, 'config', None),
+            'phase': getattr(record, 'phase', None),
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class LogWriter(logging.Handler):
+    """
+    Hand logging events to a background thread that writes them with the real handlers, so the download and unpack
+    loops never wait on the terminal or the log file
+    The config and phase are added to each event as it is logged, the writer thread has no context of its own
+    Built on a plain queue rather than logging.handlers.QueueHandler, which pulls in sockets and pickle at start up
+    """
+
+    def __init__(self, *handlers: logging.Handler) -> None:
+        """
+        Initialise the writer, its thread is started with the first event
+        handlers: (logging.Handler) Handlers the events are written with
+        """
+        import queue
+
         super().__init__()
-        self.final_url = None  # Store the final redirected URL
-        self.last_url = None  # Store the last URL (for Referer)
+        self.handlers: tuple = handlers
+        self.records: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread: Optional[threading.Thread] = None
+        self.closed: bool = False
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        Queue an event, with its message and exception formatted now, as their objects can change after
+        :param record: The record
+        """
+        try:
+            run_metrics: RunMetrics = metrics.get()
+            record.config = run_metrics.name
+            record.phase = run_metrics.running[0] if run_metrics.running else None
+        except LookupError:
+            record.config = record.phase = None
+
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        # Once closed there is no thread to write with, events logged at exit are written straight away
+        if self.closed:
+            self.write_record(record)
+            return
+
+        # Daemon, so a run exits without waiting for it, logging.shutdown closes it and writes what is left
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.write, name='log-writer', daemon=True)
+            self.thread.start()
+        self.records.put(record)
+
+    def write(self) -> None:
+        """
+        Write the queued events until the writer is closed
+        """
+        while (record := self.records.get()) is not None:
+            self.write_record(record)
+
+    def write_record(self, record: logging.LogRecord) -> None:
+        """
+        Write an event with each handler that takes its level
+        :param record: The record
+        """
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def close(self) -> None:
+        """
+        Write the events left in the queue and close the handlers, later events are written without the thread
+        """
+        # Under the handler lock, so an event is either queued before the end of the queue or written directly
+        with self.lock:
+            self.closed = True
+            if self.thread is not None and self.thread.is_alive():
+                self.records.put(None)
+        if self.thread is not None:
+            self.thread.join()
+        for handler in self.handlers:
+            handler.flush()
+        super().close()
+
+
+@functools.lru_cache(maxsize=None)
+def redirect_handler_class() -> type:
+    """
+    Create the redirect handler class on first use, so urllib.request is only loaded when something is fetched
+    :return: CustomRedirectHandler class
+    """
+    import urllib.request
+
+    class CustomRedirectHandler(urllib.request.HTTPRedirectHandler):
+        def __init__(self):
+            super().__init__()
+            self.final_url = None  # Store the final redirected URL
+            self.last_url = None  # Store the last URL (for Referer)
+            self.redirects = 0  # Number of redirects followed
+
+        def redirect_request(self, req, fp, code, msg, headers, new_url):
+            logger.warning(f'Redirecting to: {new_url}')
+            self.final_url = new_url  # Update the final URL
+            self.redirects += 1
+
+            # Set the Referer header to the previous URL
+            if self.last_url:
+                req.add_header('Referer', self.last_url)
+                logger.debug(f'Setting Referer: {self.last_url}')
+
+            # Update last_url for next redirect
+            self.last_url = req.full_url
+
+            return super().redirect_request(req, fp, code, msg, headers, new_url)
+
+    return CustomRedirectHandler
+
+
+class RunMetrics:
+    """
+    Collect per-phase timings and counters for a single run
+    """
+
+    def __init__(self, name: str) -> None:
+        """
+        Initialise the metrics
+        name: (str) Name of the config being run
+        """
+        self.name: str = name
+        self.started: float = time.time()
+        self.duration: Optional[float] = None
+        self.phases: dict = {}
+        self.counters: dict = {}
+        self.last_phase: Optional[str] = None
+        self.failed_phase: Optional[str] = None
+        self.result_code: Optional[int] = None
+        # Phase running now and its perf_counter start, for the watchdog
+        self.running: Optional[tuple] = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        Time a phase of the run, repeated phases are summed
+        :param name: Name of the phase
+        """
+        self.last_phase = name
+        start_time: float = time.perf_counter()
+        outer_phase: Optional[tuple] = self.running
+        self.running = (name, start_time)
+        try:
+            yield self
+        finally:
+            self.running = outer_phase
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start_time
+
+    def count(self, key: str, value: Any) -> None:
+        """
+        Set a counter for the run
+        :param key: Name of the counter
+        :param value: Value of the counter
+        """
+        self.counters[key] = value
+
+    def finish(self, result_code: int) -> None:
+        """
+        Mark the run as complete, a failed run is attributed to the last phase entered
+        :param result_code: Exit code of the run
+        """
+        self.result_code = result_code
+        self.failed_phase = self.last_phase if result_code else None
+        self.duration = time.time() - self.started
+
+    def as_dict(self) -> dict:
+        """
+        Get the metrics as a dictionary
+        :return: Metrics ready for json
+        """
+        return {
+            'config': self.name,
+            'started': self.started,
+            'duration': self.duration,
+            'result_code': self.result_code,
+            'failed_phase': self.failed_phase,
+            'phases': {phase: round(seconds, 6) for phase, seconds in self.phases.items()},
+            **self.counters
+        }
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket limiting a rate in bytes per second
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        """
+        Initialise the bucket full
+        rate: (float) Bytes per second
+        capacity: (float) Largest burst in bytes, default: one second at the rate
+        """
+        self.rate: float = rate
+        self.capacity: float = capacity or rate
+        self.tokens: float = self.capacity
+        self.updated: float = time.monotonic()
+        self.lock: threading.Lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        """
+        Take tokens, sleeping until the rate allows it
+        The bucket can go into debt so large reads are paid back over time
+        :param amount: Number of bytes
+        """
+        with self.lock:
+            now: float = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait: float = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ContextProxy:
+    """
+    A module global whose value belongs to the context (thread or task) it is set in, so jobs running at the same
+    time in one process each see their own options, logger and metrics
+    """
+
+    def __init__(self, name: str, *default: Any) -> None:
+        """
+        Initialise the proxy
+        name: (str) Name of the global
+        default: (Any) Value when none is set in the context, without one an unset global raises LookupError
+        """
+        variable: contextvars.ContextVar = contextvars.ContextVar(name, default=default[0]) if default else \
+            contextvars.ContextVar(name)
+        object.__setattr__(self, '_variable', variable)
+
+    def get(self) -> Any:
+        """
+        Get the value in the current context
+        :return: The value
+        """
+        return self._variable.get()
+
+    def set(self, value: Any) -> contextvars.Token:
+        """
+        Set the value in the current context
+        :param value: The value
+        :return: Token to reset it with
+        """
+        return self._variable.set(value)
+
+    def reset(self, token: contextvars.Token) -> None:
+        """
+        Put back the value from before a set
+        :param token: Token from the set
+        """
+        self._variable.reset(token)
+
+    def __getattr__(self, name: str) -> Any:
+        # An unset global has no attributes, so hasattr, doctest and inspect see an AttributeError
+        try:
+            value: Any = self._variable.get()
+        except LookupError:
+            raise AttributeError(f'{self._variable.name} is not set in this context, so has no {name}') from None
+        return getattr(value, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._variable.get(), name, value)
+
+    def __repr__(self) -> str:
+        return repr(self._variable.get(None))
+
+
+class PhaseTimeout(Exception):
+    """
+    A phase of a run took longer than its timeout, or was stopped by the watchdog
+    """
+
+    def __init__(self, phase: Optional[str] = None, seconds: Optional[float] = None) -> None:
+        """
+        Initialise the error
+        phase: (str) Timeout that ran out, as in PHASE_TIMEOUTS, None when raised by the watchdog
+        seconds: (float) The timeout
+        """
+        super().__init__(f'{phase} timed out after {seconds:g}s' if phase else 'stopped by the watchdog')
+        self.phase: Optional[str] = phase
+        self.seconds: Optional[float] = seconds
+
+
+class System:
+    """
+    The layers a job reaches the outside world through: the network, temporary files, the filesystem and processes
+    Subclass it to run jobs against fakes in tests, or through an embedding application
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialise the system
+        """
+        # Processes started through popen, for the watchdog to kill
+        self.processes: set = set()
+        self.processes_lock: threading.Lock = threading.Lock()
+
+    def opener(self, user_agent: Optional[str] = None) -> tuple:
+        """
+        Create the url opener of a job
+        :param user_agent: User agent to send, defaults to the one in the options
+        :return: The opener and its redirect handler
+        """
+        return create_opener(user_agent)
+
+    def temp_dir(self) -> 'tempfile.TemporaryDirectory':
+        """
+        Create the temporary folder a download is saved and unpacked in
+        :return: The temporary directory
+        """
+        import tempfile
+
+        return tempfile.TemporaryDirectory()
+
+    def copytree(self, source: Path, destination: Path, copy_function: Any = None, ignore: Any = None) -> None:
+        """
+        Copy an app bundle, keeping its metadata
+        :param source: App to copy
+        :param destination: Path of the copy
+        :param copy_function: Function copying each file, shutil.copy2 by default
+        :param ignore: Called with each folder and its names before they are copied, as the ignore of shutil.copytree
+        """
+        import shutil
+
+        shutil.copytree(source, destination, copy_function=copy_function or shutil.copy2, ignore=ignore,
+                        dirs_exist_ok=True)
+
+    def rmtree(self, path: Path) -> None:
+        """
+        Remove a directory and its contents
+        :param path: Directory to remove
+        """
+        import shutil
+
+        shutil.rmtree(path)
+
+    def run(self, args: Any, input: Any = None, capture_output: bool = False, timeout: Optional[float] = None,
+            check: bool = False, **kwargs: Any) -> subprocess.CompletedProcess:
+        """
+        Run a command, as subprocess.run, started through popen so the watchdog can kill it
+        :return: The completed process
+        """
+        if capture_output:
+            kwargs['stdout'] = kwargs['stderr'] = subprocess.PIPE
+        if input is not None:
+            kwargs['stdin'] = subprocess.PIPE
+
+        with self.popen(args, **kwargs) as process:
+            try:
+                stdout, stderr = process.communicate(input, timeout=timeout)
+            except BaseException:
+                process.kill()
+                raise
+
+        completed: subprocess.CompletedProcess = subprocess.CompletedProcess(process.args, process.returncode,
+                                                                             stdout, stderr)
+        if check:
+            completed.check_returncode()
+        return completed
+
+    def popen(self, *args: Any, **kwargs: Any) -> subprocess.Popen:
+        """
+        Start a command, as subprocess.Popen
+        :return: The process
+        """
+        process: subprocess.Popen = subprocess.Popen(*args, **kwargs)
+        with self.processes_lock:
+            self.processes = {running for running in self.processes if running.returncode is None}
+            self.processes.add(process)
+        return process
+
+    def kill(self) -> int:
+        """
+        Kill the processes of the job that are still running
+        :return: Number of processes killed
+        """
+        with self.processes_lock:
+            running: list = [process for process in self.processes if process.poll() is None]
+        for process in running:
+            process.kill()
+        return len(running)
+
+
+# Options, logger and metrics of the job running in the current context, set by the Runner
+options: argparse.Namespace = ContextProxy('options')
+logger: logging.Logger = ContextProxy('logger')
+metrics: RunMetrics = ContextProxy('metrics')
+
+# Layers the job in the current context reaches the outside world through
+system: System = ContextProxy('system', System())
+
+# Cleanups of the job in the current context, run when it ends
+job_cleanup: contextvars.ContextVar = contextvars.ContextVar('job_cleanup', default=None)
+
+
+def at_job_exit(callback: Any) -> None:
+    """
+    Clean up when the job in the current context ends, or at exit outside of a job
+    :param callback: Function to call
+    """
+    cleanup: Optional[contextlib.ExitStack] = job_cleanup.get()
+    if cleanup is None:
+        atexit.register(callback)
+    else:
+        cleanup.callback(callback)
 
-    def redirect_request(self, req, fp, code, msg, headers, new_url):
-        logger.warning(f'Redirecting to: {new_url}')
-        self.final_url = new_url  # Update the final URL
 
-        # Set the Referer header to the previous URL
-        if self.last_url:
-            req.add_header('Referer', self.last_url)
-            logger.debug(f'Setting Referer: {self.last_url}')
+class Watchdog:
+    """
+    Watch the phases of a run from a thread, for hangs the phase timeouts do not catch (a tool stuck without a
+    timeout, a copy, name resolution, ...). A phase still running WATCHDOG_GRACE past its limit has the processes of
+    the job killed, and one still running WATCHDOG_GRACE after that is interrupted with a PhaseTimeout
+    """
 
-        # Update last_url for next redirect
-        self.last_url = req.full_url
+    def __init__(self, run_metrics: RunMetrics, job_system: System, limit: float, interval: float = 1.0) -> None:
+        """
+        Initialise the watchdog
+        run_metrics: (RunMetrics) Metrics of the run, their running phase is watched
+        job_system: (System) System of the job, its processes are killed
+        limit: (float) Seconds a phase without a timeout of its own may run
+        interval: (float) Seconds between checks
+        """
+        self.run_metrics: RunMetrics = run_metrics
+        self.system: System = job_system
+        self.limit: float = limit
+        self.interval: float = interval
+        self.stopped: threading.Event = threading.Event()
+        self.thread_id: Optional[int] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'Watchdog':
+        self.thread_id = threading.get_ident()
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self.watch,),
+                                       name='watchdog', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def phase_limit(self, phase: str) -> float:
+        """
+        Get the seconds a phase may run
+        :param phase: Name of the phase
+        :return: The timeout of the phase, or the watchdog limit if it has none
+        """
+        return (phase_timeout(phase) if phase in PHASE_TIMEOUTS else None) or self.limit
 
-        return super().redirect_request(req, fp, code, msg, headers, new_url)
+    def watch(self) -> None:
+        """
+        Check the running phase until the run ends
+        """
+        import ctypes
+
+        handled: Optional[tuple] = None
+        actions: int = 0
+        while not self.stopped.wait(self.interval):
+            running: Optional[tuple] = self.run_metrics.running
+            if running is None:
+                continue
+            if running != handled:
+                handled, actions = running, 0
+
+            phase, start_time = running
+            limit: float = self.phase_limit(phase)
+            elapsed: float = time.perf_counter() - start_time
+            if actions == 0 and elapsed >= limit + WATCHDOG_GRACE:
+                self.run_metrics.count('timeout', phase)
+                killed: int = self.system.kill()
+                logger.critical(f'Watchdog: {phase} has run for {elapsed:.0f}s, over its {limit:g}s limit, '
+                                f'killed {killed} process(es)')
+                actions = 1
+            elif actions == 1 and elapsed >= limit + 2 * WATCHDOG_GRACE:
+                logger.critical(f'Watchdog: {phase} is still running, interrupting it')
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self.thread_id),
+                                                           ctypes.py_object(PhaseTimeout))
+                actions = 2
 
 
 def main():
@@ -125,56 +683,1168 @@ def main():
             logger.warning(f'"{required_file_path}" is missing and the install/update will not run')
             return 0
 
-    # Folder/files for saved contents
-    temp_folder: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
-    installer_file: str = get_filename(options.url)
-    installer_path: Path = Path(temp_folder.name).joinpath(installer_file)
-    unpack_path: Path = Path(temp_folder.name).joinpath('contents')
-    unpack_path.mkdir(exist_ok=True)
+    # Check the installed app against its manifest instead of installing
+    if options.verify or options.repair:
+        from install_from_web_manifest import verify_app
+        return verify_app(options.repair)
+
+    # Folder/files for saved contents
+    temp_folder: 'tempfile.TemporaryDirectory' = system.temp_dir()
+    unpack_path: Path = Path(temp_folder.name).joinpath('contents')
+    unpack_path.mkdir(exist_ok=True)
+
+    # Register cleanup at the end of the job
+    at_job_exit(temp_folder.cleanup)
+
+    # Create an opener with redirect handling and SSL context
+    opener, redirect_handler = system.opener()
+
+    # Find the download, trying the alternate urls when the url fails
+    source_urls: list = [options.url, *(options.alternate_urls or [])]
+    alternate_downloads: list = []
+    if any((options.appcast, options.json_path, options.resolve, options.regex, options.code)):
+        for source_url in source_urls:
+            download_url, release, return_code = find_download(opener, source_url)
+            if download_url is not None:
+                break
+            if source_url != source_urls[-1]:
+                logger.warning(f'Unable to find the download in {source_url}, trying the alternate url')
+        if download_url is None:
+            return return_code
+    else:
+        download_url, release = options.url, {}
+        alternate_downloads = source_urls[1:]
+
+    if release:
+        if release.get('signature'):
+            metrics.count('appcast_signature', release['signature'])
+        if release.get('size'):
+            metrics.count('expected_bytes', release['size'])
+
+        # Skip the download when the installed app is already this version
+        installed_version: Optional[str] = installed_app_version(options) if release['version'] else None
+        if installed_version and not options.reinstall:
+            if not is_newer_version(release['version'], installed_version, options.allow_downgrade):
+                logger.info(f'Installed version {installed_version} is current with {release["version"]}')
+                metrics.count('installed_version', installed_version)
+                metrics.count('new_version', release['version'])
+                return 0
+
+        # Use the checksum from the feed unless one is configured
+        if release['checksum'] and not (options.checksum or options.checksum_url):
+            if urlparse(release['checksum']).scheme in ('http', 'https'):
+                options.checksum_url = release['checksum']
+            else:
+                try:
+                    options.checksum = parse_checksum(release['checksum'])
+                except ValueError as err:
+                    logger.warning(f'Ignoring the checksum in the feed: {err}')
+
+    # Download the install/app
+    parsed_json_url: urlparse = urlparse(download_url)
+    if not all([parsed_json_url.scheme, parsed_json_url.netloc]):
+        logger.critical(f'url "{download_url}" does not appear to be valid')
+        return 4
+
+    # Skip the download when nothing changed since the last successful run
+    if options.history_file is not None and options.skip_unchanged and not options.reinstall:
+        if download_unchanged(opener, download_url):
+            return 0
+
+    # Get the checksum to verify the download against
+    checksum, return_code = expected_checksum(opener, download_url)
+    if return_code:
+        return return_code
+
+    installer_path, return_code = download_installer(opener, redirect_handler, download_url,
+                                                     Path(temp_folder.name), checksum, alternate_downloads)
+    if installer_path is None:
+        return return_code
+    installer_file: str = installer_path.name
+    if release.get('size') and installer_path.stat().st_size != release['size']:
+        logger.warning(f'Download is {installer_path.stat().st_size} bytes, the feed expected {release["size"]}')
+
+    # Get file type
+    with metrics.phase('detect_type'):
+        if options.file_type is not None:
+            file_type: Optional[str] = options.file_type
+            logger.info(f'Using provided file type: {file_type}')
+        else:
+            logger.info('Getting file type from mime types')
+            import mimetypes
+            mime_type, _ = mimetypes.guess_type(installer_file)
+
+            if not mime_type:
+                file_type: Optional[str] = None
+            elif 'x-apple-diskimage' in mime_type:
+                file_type: Optional[str] = 'dmg'
+            elif 'x-tar' in mime_type:
+                file_type: Optional[str] = 'tar.gz'
+            elif 'x-xar' in mime_type:
+                file_type: Optional[str] = 'pkg'
+            elif 'zip' in mime_type:
+                file_type: Optional[str] = 'zip'
+            else:
+                logger.warning(f'Unknown file type: {mime_type}')
+                file_type: Optional[str] = None
+
+        if file_type is None:
+            # Detect from signatures
+            logger.info('Getting file type from signature')
+            file_type: Optional[str] = detect_mime_type(installer_path)
+
+        if file_type is None and '.' in installer_file:
+            # Essentially the same as mimetype, but last ditch
+            file_type: Optional[str] = installer_file.split('.')[-1]
+
+    metrics.count('file_type', file_type)
+    if file_type is None:
+        logger.critical(
+            'Unable to get file type from options, mime or extension, use -t, --dmg, --pkg, --tar, or --zip')
+        return 7
+
+    logger.info(f'File type is: {file_type}')
+
+    # Unpack
+    if file_type.startswith(('tar', 'tgz', 'gz', 'bz2', 'xz', 'zst')):
+        import tarfile
+        try:
+            logger.info(f'Unpacking TAR {installer_path.stem} ...')
+            compression: Optional[str] = detect_compression(installer_path)
+            metrics.count('compression', compression)
+            with metrics.phase('unpack'), \
+                    open_decompressed(installer_path, compression, options.decompressor) as stream, \
+                    tarfile.open(fileobj=stream, mode='r|') as tar:
+                tar.extractall(path=unpack_path)
+            logger.info(f'TAR unpacked to {unpack_path}')
+        except (tarfile.TarError, OSError, EOFError) as err:
+            logger.critical(err)
+            return 8
+
+    elif file_type == 'zip':
+        import zipfile
+        try:
+            logger.info(f'Unpacking ZIP {installer_path.stem} ...')
+            with metrics.phase('unpack'), zipfile.ZipFile(installer_path, 'r') as zip_ref:
+                for zip_info in zip_ref.infolist():
+                    extracted_path: Path = Path(unpack_path, zip_info.filename)
+
+                    # Detect if this should be a symlink
+                    if zip_info.external_attr >> 28 == 0xA:  # Symlink in POSIX (0xA)
+                        symlink_target: str = zip_ref.read(zip_info.filename).decode()
+                        logger.debug(f'Creating symlink {extracted_path} -> {symlink_target}')
+                        extracted_path.parent.mkdir(parents=True, exist_ok=True)
+                        os.symlink(symlink_target, extracted_path)
+                    else:
+                        zip_ref.extract(zip_info, unpack_path)
+                        # Apply permissions if this is an executable
+                        perm: int = zip_info.external_attr >> 16
+                        if perm:
+                            logger.debug(f'Setting permissions for {extracted_path}: {oct(perm)}')
+                            os.chmod(extracted_path, perm)
+            logger.info(f'ZIP unpacked to {unpack_path}')
+        except zipfile.BadZipFile as err:
+            logger.critical(f'Error extracting ZIP: {err}')
+            return 8
+
+    elif file_type == 'dmg':
+        with metrics.phase('unpack'):
+            mount_dmg(installer_path, unpack_path)
+
+    elif file_type == 'pkg':
+        install_pkg(installer_path, unpack_path)
+        return 0
+
+    # Get the installer/app, the first app or the apps matching --bundle
+    if options.bundles:
+        app_paths: list = find_app_paths(unpack_path, options.bundles)
+    else:
+        app_paths: list = [app_path for app_path in [find_app_path(unpack_path)] if app_path is not None]
+    pkg_path: Path = find_app_path(unpack_path, '*.pkg', False)
+    if len(app_paths) == 1:
+        bundle: dict = install_bundle(app_paths[0], options.app_install_path)
+        metrics.count('installed_version', bundle['installed_version'])
+        metrics.count('new_version', bundle['new_version'])
+
+    elif app_paths:
+        bundles: dict = install_bundles(app_paths, options.app_install_path)
+        metrics.count('bundles', bundles)
+        for name, bundle in bundles.items():
+            logger.info(f'{name}: {bundle["result"]}, {bundle["new_version"]} (installed {bundle["installed_version"]})')
+
+    elif pkg_path is not None:
+        logger.info(f'Installing {pkg_path} to {options.pkg_install_path}')
+        install_pkg(pkg_path, unpack_path)
+    else:
+        logger.critical('No app or pkg found in installer')
+        return 2
+
+    logger.info('Done')
+    return 0
+
+
+def find_download(opener: 'urllib.request.OpenerDirector', url: str) -> tuple:
+    """
+    Find the download url from the url of a config, a release feed (appcast or json) or a page
+    :param opener: Opener to fetch with
+    :param url: Url of the feed/page
+    :return: The download url, the release ({} if not from a feed) and 0, or None, {} and an exit code
+    """
+    # Find the download in a release feed, a Sparkle appcast or json
+    if options.appcast or options.json_path is not None:
+        from install_from_web_feeds import resolve_appcast_release, resolve_json_release
+        with metrics.phase('resolve'):
+            if options.appcast:
+                release, return_code = resolve_appcast_release(opener, url, options)
+            else:
+                release, return_code = resolve_json_release(opener, url, options)
+        if release is None:
+            return None, {}, return_code
+        return release['url'], release, 0
+
+    # If regex of code get the html/text
+    html: Optional[str] = None
+    if any((options.resolve, options.regex, options.code)):
+        try:
+            with metrics.phase('page_fetch'):
+                html = fetch_page(opener, url, options.user_agent)
+            metrics.count('page_bytes', len(html))
+        except Exception as err:
+            logger.error(f'Error fetching page: {err}')
+            if timed_out(err):
+                metrics.count('timeout', 'page_fetch')
+                return None, {}, TIMEOUT_CODE
+            return None, {}, 5
+
+    # Find the download in the page
+    with metrics.phase('resolve'):
+        download_url, return_code = resolve_download_url(url, html, options.regex, options.code, options.resolve)
+    return download_url, {}, return_code
+
+
+def download_unchanged(opener: 'urllib.request.OpenerDirector', download_url: str) -> bool:
+    """
+    Check with a HEAD request if the download is the same as in the last successful run of the config
+    The same url with the same ETag, or the same Last-Modified and size, is unchanged
+    A config with an app_name is never unchanged when the app is no longer installed
+    :param opener: Opener to request with
+    :param download_url: Url of the installer
+    :return: True if the download is unchanged
+    """
+    from install_from_web_report import RunHistory
+
+    last_run: Optional[dict] = RunHistory(Path(options.history_file)).last_success(metrics.name)
+    if last_run is None or last_run['url'] != download_url:
+        return False
+    if getattr(options, 'app_name', None) and installed_app_version(options) is None:
+        return False
+
+    try:
+        with metrics.phase('check_unchanged'):
+            head: dict = head_request(opener, download_url, options.user_agent)
+    except Exception as err:
+        logger.warning(f'Unable to check if the download changed: {err}')
+        return False
+
+    if last_run['etag'] and head['etag']:
+        unchanged: bool = head['etag'] == last_run['etag']
+    else:
+        unchanged: bool = bool(last_run['last_modified']) and head['last_modified'] == last_run['last_modified'] \
+                          and head['size'] == last_run['size']
+    if not unchanged:
+        return False
+
+    logger.info(f'Download unchanged since the last successful run {time.ctime(last_run["started"])}, skipping')
+    metrics.count('skipped', 'unchanged')
+    for key, counter in (('url', 'download_url'), ('size', 'expected_bytes'), ('etag', 'etag'),
+                         ('last_modified', 'last_modified'), ('digest', 'digest'), ('file_type', 'file_type'),
+                         ('new_version', 'new_version')):
+        metrics.count(counter, last_run[key])
+
+    return True
+
+
+def fetch_page(opener: 'urllib.request.OpenerDirector', url: str, user_agent: str) -> str:
+    """
+    Fetch the html/text of a page
+    :param opener: Opener to fetch with
+    :param url: Url of the page
+    :param user_agent: User agent to send
+    :return: The decoded page
+    """
+    import urllib.request
+
+    # Fetch the page, a retry or a hedged request fetches it again from the start with a request of its own
+    def fetch(page_opener: urllib.request.OpenerDirector) -> str:
+        # Create the request with custom User-Agent
+        req: urllib.request.Request = urllib.request.Request(url)
+        req.add_header('User-Agent', user_agent)
+        with open_request(page_opener, req) as response:
+            return response.read().decode()
+
+    return retry_call(lambda: hedged_call(fetch, opener, f'Page {url}'), f'Page {url}')
+
+
+def download_installer(opener: 'urllib.request.OpenerDirector',
+                       redirect_handler: 'urllib.request.HTTPRedirectHandler',
+                       download_url: str, download_folder: Path, checksum: Optional[str] = None,
+                       alternate_urls: list = ()) -> tuple:
+    """
+    Download the installer, trying any mirrors of the url first, the url itself and then the alternate urls
+    Transient errors are retried as set by the retry options, a download that breaks off starts over
+    In delta mode the download is first rebuilt from an older cached release, fetching only the changed blocks
+    With a cache directory, an unchanged download (304) is taken from the cache and new downloads are cached
+    The checksum is computed over the download stream as it is saved, a mirror with a mismatch falls back to the next
+    :param opener: Opener to download with
+    :param redirect_handler: Redirect handler of the opener
+    :param download_url: Url of the installer
+    :param download_folder: Directory to save the installer in
+    :param checksum: Expected checksum, algorithm:hex
+    :param alternate_urls: Other urls of the same installer to fall back to
+    :return: Path to the installer and 0, or None and the exit code if the download failed
+    """
+    import hashlib
+    import http.client
+    import urllib.error
+    import urllib.request
+
+    # Spread out downloads that start at the same time across a fleet
+    if options.start_jitter:
+        import random
+        start_delay: float = random.uniform(0, options.start_jitter)
+        logger.info(f'Waiting {start_delay:.1f}s before downloading')
+        time.sleep(start_delay)
+
+    cache_dir: Optional[Path] = Path(options.cache_dir) if options.cache_dir else None
+    cached_path, cached_meta = read_cache(cache_dir, download_url) if cache_dir else (None, {})
+    candidate_urls: list = [url for source_url in [download_url, *alternate_urls]
+                            for url in mirror_urls(source_url, options.mirrors or [])]
+    algorithm, _, expected_digest = checksum.partition(':') if checksum else (None, None, None)
+    # Without a checksum the download is still hashed for the history
+    digest_algorithm: Optional[str] = algorithm or ('sha256' if options.history_file else None)
+
+    # Only revalidate a cached copy that matches the checksum, the digest is recorded so it is only hashed once
+    if cached_path is not None and algorithm is not None:
+        if algorithm not in cached_meta:
+            cached_digest = hashlib.new(algorithm)
+            with metrics.phase('checksum'), open(cached_path, 'rb') as file:
+                while chunk := file.read(DOWNLOAD_CHUNK_SIZE):
+                    cached_digest.update(chunk)
+            cached_meta[algorithm] = cached_digest.hexdigest()
+            cached_path.with_name(f'{cached_path.name}.meta.json').write_text(json.dumps(cached_meta, indent=2))
+        if cached_meta[algorithm] != expected_digest:
+            logger.warning(f'Cached {cached_path} does not match the checksum, downloading again')
+            cached_path, cached_meta = None, {}
+
+    start_time: float = time.time()
+    downloaded: int = 0
+    installer_path: Optional[Path] = None
+    # Every attempt at every source counts towards the download timeout
+    download_timeout: Optional[float] = phase_timeout('download')
+    deadline: Optional[float] = time.monotonic() + download_timeout if download_timeout else None
+    try:
+        # Rebuild the download from the older release in the cache
+        if options.delta and cache_dir is not None:
+            from install_from_web_delta import delta_download
+            installer_path, delta_headers, downloaded = delta_download(opener, download_url, candidate_urls,
+                                                                       download_folder, cache_dir, checksum)
+            if installer_path is not None:
+                if algorithm is not None:
+                    logger.info(f'Checksum verified {algorithm}:{expected_digest}')
+                    metrics.count('checksum', f'{algorithm}:{expected_digest}')
+                metrics.count('etag', delta_headers.get('ETag'))
+                metrics.count('last_modified', delta_headers.get('Last-Modified'))
+                store_in_cache(cache_dir, download_url, installer_path, delta_headers,
+                               **({algorithm: expected_digest} if algorithm else {}))
+
+        for candidate_url in (candidate_urls if installer_path is None else []):
+            logger.info(f'Downloading {candidate_url} ...')
+            installer_file: str = get_filename(download_url)
+            redirect_handler.final_url = None
+
+            # Create a request for the file download, only send the file if it changed since it was cached
+            req_download: urllib.request.Request = urllib.request.Request(candidate_url)
+            req_download.add_header('User-Agent', options.user_agent)
+            if cached_path is not None and cached_meta.get('etag'):
+                req_download.add_header('If-None-Match', cached_meta['etag'])
+            if cached_path is not None and cached_meta.get('last_modified'):
+                req_download.add_header('If-Modified-Since', cached_meta['last_modified'])
+
+            def save(candidate_url: str = candidate_url, req_download: urllib.request.Request = req_download,
+                     installer_file: str = installer_file) -> tuple:
+                """
+                Download the file in chunks to keep memory flat on large installers, smaller when rate limited
+                :return: Path to the file, its digest (or None) and the response headers
+                """
+                nonlocal downloaded
+                with metrics.phase('download'), download_slot(candidate_url) as buckets, \
+                        open_request(opener, req_download) as download_response:
+                    # Get  file name from redirect if no extension from the link
+                    if Path(installer_file).suffix is None or Path(installer_file).suffix == '':
+                        installer_file = get_filename(redirect_handler.final_url or candidate_url)
+                    file_path: Path = download_folder.joinpath(installer_file)
+
+                    chunk_size: int = min([DOWNLOAD_CHUNK_SIZE] +
+                                          [max(int(bucket.rate) // 8, 16 * 1024) for bucket in buckets])
+                    file_digest = hashlib.new(digest_algorithm) if digest_algorithm else None
+                    received: int = 0
+                    with open(file_path, 'wb') as file:
+                        while chunk := download_response.read(chunk_size):
+                            file.write(chunk)
+                            received += len(chunk)
+                            downloaded += len(chunk)
+                            if file_digest is not None:
+                                file_digest.update(chunk)
+                            for bucket in buckets:
+                                bucket.consume(len(chunk))
+                            if deadline is not None and time.monotonic() > deadline:
+                                raise PhaseTimeout('download', download_timeout)
+
+                    # A connection closed early ends the reads without an error, never keep a truncated download
+                    expected_size: Optional[str] = download_response.headers.get('Content-Length')
+                    if expected_size and expected_size.isdigit() and received < int(expected_size):
+                        raise http.client.IncompleteRead(b'', int(expected_size) - received)
+                    logger.info(f'Saved to {installer_file}')
+                    logger.debug(f'Saved to {file_path}')
+
+                return file_path, file_digest, download_response.headers
+
+            try:
+                # Download the file
+                installer_path, digest, response_headers = retry_call(save, f'Download of {candidate_url}')
+
+                # Never unpack, install or cache a download that does not match
+                if algorithm is not None:
+                    if digest.hexdigest() != expected_digest:
+                        logger.error(f'{candidate_url} does not match the checksum, '
+                                     f'expected {algorithm}:{expected_digest} got {algorithm}:{digest.hexdigest()}')
+                        installer_path.unlink()
+                        installer_path = None
+                        if candidate_url == candidate_urls[-1]:
+                            metrics.count('checksum', 'mismatch')
+                            return None, 6
+                        logger.warning('Trying the next source')
+                        continue
+                    logger.info(f'Checksum verified {algorithm}:{expected_digest}')
+                    metrics.count('checksum', f'{algorithm}:{expected_digest}')
+
+                if digest is not None:
+                    metrics.count('digest', f'{digest.name}:{digest.hexdigest()}')
+                metrics.count('etag', response_headers.get('ETag'))
+                metrics.count('last_modified', response_headers.get('Last-Modified'))
+                if cache_dir is not None:
+                    store_in_cache(cache_dir, download_url, installer_path, response_headers,
+                                   **({digest.name: digest.hexdigest()} if digest is not None else {}))
+                break
+
+            except urllib.error.HTTPError as err:
+                if err.code == 304 and cached_path is not None:
+                    logger.info(f'Download unchanged, using cached {cached_path}')
+                    installer_path = download_folder.joinpath(cached_meta.get('file_name') or cached_path.name)
+                    link_or_copy(cached_path, installer_path)
+                    metrics.count('cache_hit', True)
+                    metrics.count('etag', cached_meta.get('etag'))
+                    metrics.count('last_modified', cached_meta.get('last_modified'))
+                    if algorithm is not None:
+                        logger.info(f'Checksum verified {algorithm}:{expected_digest} (cached)')
+                        metrics.count('checksum', f'{algorithm}:{expected_digest}')
+                        metrics.count('digest', f'{algorithm}:{expected_digest}')
+                    break
+                if candidate_url == candidate_urls[-1]:
+                    raise
+                logger.warning(f'Source {candidate_url} failed: {err}, trying the next source')
+
+            except (urllib.error.URLError, OSError) as err:
+                if candidate_url == candidate_urls[-1]:
+                    raise
+                logger.warning(f'Source {candidate_url} failed: {err}, trying the next source')
+
+    except Exception as err:
+        logger.critical(err)
+        if timed_out(err):
+            metrics.count('timeout', 'download')
+            return None, TIMEOUT_CODE
+        return None, 5
+    finally:
+        # Get the time to download (or fail)
+        end_time: float = time.time()
+        minutes, seconds = divmod((end_time - start_time), 60)
+        hours, minutes = divmod(minutes, 60)
+        logger.info(f'Run time: {hours:02.0f}:{minutes:02.0f}:{seconds:04.1f}')
+
+        download_time: float = metrics.phases.get('download', 0.0)
+        metrics.count('download_url', download_url)
+        metrics.count('download_bytes', downloaded)
+        metrics.count('download_mb_per_second',
+                      round(downloaded / download_time / 1024 ** 2, 3) if download_time else 0.0)
+        metrics.count('redirects', redirect_handler.redirects)
+
+    return installer_path, 0
+
+
+def parse_checksum(checksum: Any) -> str:
+    """
+    Parse an expected checksum, the algorithm prefix is optional as it can be told from the length
+    :param checksum: sha256/sha512 hex digest, optionally prefixed with the algorithm
+    :return: algorithm:hex
+
+    Example:
+        >>> parse_checksum('SHA256:E3B0C44298FC1C149AFBF4C8996FB92427AE41E4649B934CA495991B7852B855')
+        'sha256:e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+    """
+    algorithm, _, digest = str(checksum).strip().lower().rpartition(':')
+    if not re.fullmatch(r'[0-9a-f]+', digest) or len(digest) not in CHECKSUM_ALGORITHMS:
+        raise ValueError(f'invalid checksum "{checksum}", expected a sha256 or sha512 hex digest')
+
+    algorithm = algorithm.replace('-', '') or CHECKSUM_ALGORITHMS[len(digest)]
+    if algorithm != CHECKSUM_ALGORITHMS[len(digest)]:
+        raise ValueError(f'invalid checksum "{checksum}", a {algorithm} digest has the wrong length')
+
+    return f'{algorithm}:{digest}'
+
+
+def expected_checksum(opener: 'urllib.request.OpenerDirector', download_url: str) -> tuple:
+    """
+    Get the expected checksum of the download, given or found in the vendor checksum file
+    In the checksum file the digest is found by checksum_regex, on the line naming the download or as the only digest
+    :param opener: Opener to fetch the checksum file with
+    :param download_url: Url of the installer, {url} in the checksum url is replaced with it
+    :return: The checksum (None if there is none) and 0, or None and the exit code
+    """
+    if options.checksum:
+        return options.checksum, 0
+    if not options.checksum_url:
+        return None, 0
+
+    checksum_url: str = options.checksum_url.replace('{url}', download_url)
+    try:
+        with metrics.phase('checksum_fetch'):
+            checksums: str = fetch_page(opener, checksum_url, options.user_agent)
+    except Exception as err:
+        logger.error(f'Error fetching checksum file {checksum_url}: {err}')
+        return None, 5
+
+    digest_pattern: str = r'\b(?:[0-9a-fA-F]{128}|[0-9a-fA-F]{64})\b'
+    if options.checksum_regex:
+        matches: Optional[re.Match] = re.search(options.checksum_regex, checksums)
+        digests: list = [matches.group(1) if matches.re.groups else matches.group(0)] if matches else []
+    else:
+        file_name: str = get_filename(download_url)
+        digests: list = [digest for line in checksums.splitlines() if file_name and file_name in line
+                         for digest in re.findall(digest_pattern, line)] or re.findall(digest_pattern, checksums)
+
+    if len(digests) != 1:
+        logger.critical(f'Could not find one checksum for {download_url} in {checksum_url}, found {len(digests)}')
+        return None, 6
+    try:
+        return parse_checksum(digests[0]), 0
+    except ValueError as err:
+        logger.critical(err)
+        return None, 6
+
+
+def parse_mirrors(mirrors: Any) -> list:
+    """
+    Parse mirror rules from a config
+    :param mirrors: List of [match, replace] pairs or {"match": ..., "replace": ...} objects, match is a regex
+    :return: List of [match, replace] pairs
+    """
+    if not isinstance(mirrors, list):
+        raise TypeError('expected a list of [match, replace] rules')
+
+    rules: list = []
+    for rule in mirrors:
+        if isinstance(rule, dict) and set(rule) == {'match', 'replace'}:
+            rule = [rule['match'], rule['replace']]
+        if not isinstance(rule, list) or len(rule) != 2 or not all(isinstance(part, str) for part in rule):
+            raise ValueError(f'invalid mirror rule {rule}, expected [match, replace]')
+        try:
+            re.compile(rule[0])
+        except re.error as err:
+            raise ValueError(f'invalid mirror match "{rule[0]}": {err}')
+        rules.append(rule)
+
+    return rules
+
+
+def mirror_urls(url: str, mirrors: list) -> list:
+    """
+    Get the urls to try for a download, the url rewritten by each matching mirror rule first, then the url itself
+    :param url: Download url
+    :param mirrors: Mirror rules, [match, replace] pairs, match is a regex
+    :return: List of urls
+
+    Example:
+        >>> mirror_urls('https://www.blender.org/download/blender.dmg', [['^https?://', 'http://mirror:8080/']])
+        ['http://mirror:8080/www.blender.org/download/blender.dmg', 'https://www.blender.org/download/blender.dmg']
+    """
+    urls: list = []
+    for match, replace in mirrors:
+        if re.search(match, url):
+            mirror_url: str = re.sub(match, replace, url, count=1)
+            if mirror_url not in urls and mirror_url != url:
+                urls.append(mirror_url)
+
+    return urls + [url]
+
+
+def cache_key(url: str) -> Path:
+    """
+    Get where a download is kept in the artifact cache, relative to the cache directory
+    The <host>/<path> layout lets a cache be served as a mirror with the rule ['^https?://', 'http://mirror:port/']
+    :param url: Download url
+    :return: Relative path
+
+    Example:
+        >>> cache_key('https://dl.google.com/chrome/mac/universal/stable/GGRO/googlechrome.dmg')
+        PosixPath('dl.google.com/chrome/mac/universal/stable/GGRO/googlechrome.dmg')
+    """
+    import hashlib
+    from urllib.parse import unquote
+
+    parsed_url: urllib.parse.ParseResult = urlparse(url)
+    parts: list = [part for part in unquote(parsed_url.path).split('/') if part not in ('', '.', '..')]
+    if not parts or parsed_url.path.endswith('/'):
+        parts.append('index')
+    key: Path = Path(parsed_url.netloc.replace('..', ''), *parts)
+
+    # Keep downloads that only differ by their query apart
+    if parsed_url.query:
+        key = key.with_name(f'{key.name}@{hashlib.sha1(parsed_url.query.encode()).hexdigest()[:12]}')
+
+    return key
+
+
+def read_cache(cache_dir: Path, url: str) -> tuple:
+    """
+    Get a download from the artifact cache
+    :param cache_dir: Cache directory
+    :param url: Download url
+    :return: Path to the cached file and its metadata, or None and an empty dict
+    """
+    cached_path: Path = cache_dir.joinpath(cache_key(url))
+    meta_path: Path = cached_path.with_name(f'{cached_path.name}.meta.json')
+    if not cached_path.is_file() or not meta_path.is_file():
+        return None, {}
+
+    try:
+        return cached_path, json.loads(meta_path.read_text())
+    except (OSError, ValueError) as err:
+        logger.warning(f'Ignoring unreadable cache metadata {meta_path}: {err}')
+        return None, {}
+
+
+def store_in_cache(cache_dir: Path, url: str, file_path: Path, headers: Any, **meta: Any) -> Path:
+    """
+    Add a download to the artifact cache, replacing any older copy
+    :param cache_dir: Cache directory
+    :param url: Download url
+    :param file_path: The downloaded file
+    :param headers: Response headers of the download
+    :param meta: Extra metadata to record
+    :return: Path to the cached file
+    """
+    cached_path: Path = cache_dir.joinpath(cache_key(url))
+    meta_path: Path = cached_path.with_name(f'{cached_path.name}.meta.json')
+    try:
+        cached_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path: Path = cached_path.with_name(f'.{cached_path.name}.tmp')
+        temp_path.unlink(missing_ok=True)
+        link_or_copy(file_path, temp_path)
+        os.replace(temp_path, cached_path)
+
+        meta_path.write_text(json.dumps({
+            'url': url,
+            'file_name': file_path.name,
+            'size': cached_path.stat().st_size,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'fetched': time.time(),
+            **meta
+        }, indent=2))
+        logger.debug(f'Cached {url} at {cached_path}')
+    except OSError as err:
+        logger.warning(f'Unable to cache {url}: {err}')
+
+    return cached_path
+
+
+def link_or_copy(source: Path, destination: Path) -> None:
+    """
+    Hard link a file, copying it when the destination is on another volume
+    :param source: File to link
+    :param destination: Path of the link/copy
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        import shutil
+        shutil.copy2(source, destination)
+
+
+def parse_rate(rate: Any) -> float:
+    """
+    Parse a rate in bytes per second, with an optional K, M or G suffix (1024 based)
+    :param rate: Rate as a number or string
+    :return: Bytes per second
+
+    Example:
+        >>> parse_rate('2.5M')
+        2621440.0
+    """
+    matches: Optional[re.Match] = re.fullmatch(r'\s*([\d.]+)\s*([kmg]?)i?b?(?:/s)?\s*', str(rate), re.IGNORECASE)
+    if not matches:
+        raise ValueError(f'invalid rate "{rate}", use bytes per second with an optional K, M or G suffix')
+
+    return float(matches.group(1)) * 1024 ** ' kmg'.index(matches.group(2).lower() or ' ')
+
+
+def parse_size(size: Any) -> int:
+    """
+    Parse a size in bytes, with an optional K, M or G suffix (1024 based)
+    :param size: Size as a number or string
+    :return: Bytes
+
+    Example:
+        >>> parse_size('10M')
+        10485760
+    """
+    matches: Optional[re.Match] = re.fullmatch(r'\s*([\d.]+)\s*([kmg]?)i?b?\s*', str(size), re.IGNORECASE)
+    if not matches:
+        raise ValueError(f'invalid size "{size}", use bytes with an optional K, M or G suffix')
+
+    return int(float(matches.group(1)) * 1024 ** ' kmg'.index(matches.group(2).lower() or ' '))
+
+
+@functools.lru_cache(maxsize=None)
+def rate_limiter(host: str, rate: float) -> TokenBucket:
+    """
+    Get the token bucket shared by every download in the process for a host, '*' for the global limit
+    :param host: Host name, or '*'
+    :param rate: Bytes per second
+    :return: The shared token bucket
+    """
+    return TokenBucket(rate)
+
+
+@functools.lru_cache(maxsize=None)
+def host_download_slots(host: str, limit: int) -> threading.BoundedSemaphore:
+    """
+    Get the semaphore shared by every download in the process limiting concurrent downloads from a host
+    :param host: Host name
+    :param limit: Number of concurrent downloads
+    :return: The shared semaphore
+    """
+    return threading.BoundedSemaphore(limit)
+
+
+@contextlib.contextmanager
+def download_slot(url: str):
+    """
+    Wait for a free download slot on the host of the url, and yield the token buckets limiting the download
+    :param url: Download url
+    """
+    host: str = urlparse(url).hostname or ''
+    buckets: list = []
+    if options.max_rate:
+        buckets.append(rate_limiter('*', options.max_rate))
+    if options.host_rate:
+        buckets.append(rate_limiter(host, options.host_rate))
+
+    if not options.host_downloads:
+        yield buckets
+        return
+
+    slots: threading.BoundedSemaphore = host_download_slots(host, options.host_downloads)
+    if not slots.acquire(blocking=False):
+        logger.info(f'Waiting for one of {options.host_downloads} download slot(s) on {host}')
+        slots.acquire()
+    try:
+        yield buckets
+    finally:
+        slots.release()
+
+
+def retry_after_delay(err: 'urllib.error.HTTPError') -> Optional[float]:
+    """
+    Get how long the server asked to wait before retrying, from the Retry-After header of a 429 or 503
+    :param err: HTTP error from the request
+    :return: Seconds to wait, or None if the server did not ask
+    """
+    retry_after: Optional[str] = err.headers.get('Retry-After') if err.headers else None
+    if err.code not in (429, 503) or not retry_after:
+        return None
+
+    if retry_after.strip().isdigit():
+        return float(retry_after)
+
+    # Otherwise it is an HTTP date
+    from datetime import datetime, timezone
+    from email.utils import parsedate_to_datetime
+    try:
+        return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(err: Exception, attempt: int) -> Optional[float]:
+    """
+    Get how long to wait before trying a failed request again, exponential backoff with full jitter
+    The server's Retry-After is used when there is one, unless it is longer than max_retry_after
+    :param err: Error of the attempt
+    :param attempt: Number of the attempt that failed, from 1
+    :return: Seconds to wait, or None if the error is not worth retrying
+    """
+    import http.client
+    import random
+    import socket
+    import urllib.error
+
+    if isinstance(err, urllib.error.HTTPError):
+        if err.code not in (options.retry_statuses or RETRY_STATUSES):
+            return None
+        delay: Optional[float] = retry_after_delay(err)
+        if delay is not None:
+            return delay if delay <= options.max_retry_after else None
+    elif isinstance(err, urllib.error.URLError):
+        # Connection refused/reset, timeouts and DNS failures that may be temporary, not bad urls or certificates
+        if not isinstance(err.reason, (TimeoutError, ConnectionError)) and \
+                not (isinstance(err.reason, socket.gaierror) and err.reason.errno == socket.EAI_AGAIN):
+            return None
+    elif not isinstance(err, (TimeoutError, ConnectionError, http.client.IncompleteRead)):
+        return None
+
+    return random.uniform(0, min(options.retry_max_delay, options.retry_backoff * 2 ** (attempt - 1)))
+
+
+def retry_call(function, description: str) -> Any:
+    """
+    Call a function that makes a request, trying again on transient errors as set by the retry options
+    :param function: Function to call
+    :param description: What the request is, for the log
+    :return: What the function returns
+    """
+    attempts: int = max(options.retries, 0) + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            return function()
+        except Exception as err:
+            delay: Optional[float] = retry_delay(err, attempt)
+            if delay is None or attempt == attempts:
+                raise
+            logger.warning(f'{description} failed ({err}), attempt {attempt} of {attempts}, '
+                           f'trying again in {delay:.1f}s')
+            time.sleep(delay)
+
+
+def hedged_call(function, opener: 'urllib.request.OpenerDirector', description: str) -> Any:
+    """
+    Call a function that makes a small idempotent request (a page or HEAD), sending the same request again if the
+    first is slower than hedge_after seconds, the first to succeed is used
+    The hedged request has an opener of its own, so the two never share the state of a redirect handler
+    :param function: Function to call with the opener to request with
+    :param opener: Opener of the first request
+    :param description: What the request is, for the log
+    :return: What the function returns
+    """
+    if not options.hedge_after:
+        return function(opener)
+
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='hedge')
+    try:
+        pending: set = {executor.submit(contextvars.copy_context().run, function, opener)}
+        done, pending = wait(pending, timeout=options.hedge_after)
+        if not done:
+            logger.info(f'{description} is slower than {options.hedge_after}s, sending a hedged request')
+            hedge_opener, _ = system.opener()
+            pending.add(executor.submit(contextvars.copy_context().run, function, hedge_opener))
+
+        error: Optional[Exception] = None
+        while done or pending:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            done, pending = wait(pending, return_when=FIRST_COMPLETED) if pending else (set(), set())
+        raise error
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def open_url(opener: 'urllib.request.OpenerDirector', req: 'urllib.request.Request'):
+    """
+    Open a request, trying again on transient errors as set by the retry options
+    :param opener: Opener to request with
+    :param req: Request to open
+    :return: The response
+    """
+    return retry_call(lambda: open_request(opener, req), f'Request to {req.host}')
+
+
+def open_request(opener: 'urllib.request.OpenerDirector', req: 'urllib.request.Request'):
+    """
+    Open a request once, with the connect timeout and then the read timeout on its socket
+    urllib takes a single timeout, the read timeout is set on the socket of the response where it has one
+    :param opener: Opener to request with
+    :param req: Request to open
+    :return: The response
+    """
+    response = opener.open(req, timeout=phase_timeout('connect'))
+    with contextlib.suppress(AttributeError):
+        response.fp.raw._sock.settimeout(phase_timeout('read'))
+    return response
+
+
+def phase_timeout(phase: str) -> Optional[float]:
+    """
+    Get the timeout of a phase from the options
+    :param phase: Phase, as in PHASE_TIMEOUTS
+    :return: Seconds, or None for no timeout
+    """
+    return dict(options.timeouts or {}).get(phase, PHASE_TIMEOUTS[phase]) or None
+
+
+def timed_out(err: BaseException) -> bool:
+    """
+    Check if an error is a timeout, of a phase, a socket (wrapped in a URLError by urllib) or a command
+    :param err: The error
+    :return: True if it is a timeout
+    """
+    return isinstance(err, (PhaseTimeout, TimeoutError, subprocess.TimeoutExpired)) or \
+        isinstance(getattr(err, 'reason', None), TimeoutError)
+
+
+def parse_timeouts(timeouts: Any) -> dict:
+    """
+    Parse phase timeouts from a config
+    :param timeouts: Object of phase to seconds, 0 turns a timeout off
+    :return: Dictionary of phase to seconds
+    """
+    if not isinstance(timeouts, dict):
+        raise TypeError('expected an object of phase to seconds')
+
+    for phase, seconds in timeouts.items():
+        if phase not in PHASE_TIMEOUTS:
+            raise ValueError(f'unknown timeout "{phase}", expected one of {", ".join(PHASE_TIMEOUTS)}')
+        if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or seconds < 0:
+            raise ValueError(f'invalid timeout for {phase}: {seconds}, expected seconds')
+
+    return timeouts
+
+
+def parse_timeout(timeout: str) -> tuple:
+    """
+    Parse a phase timeout from the command line
+    :param timeout: PHASE=SECONDS
+    :return: The phase and seconds
+    """
+    phase, _, seconds = timeout.partition('=')
+    try:
+        return phase, parse_timeouts({phase: float(seconds)})[phase]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid timeout "{timeout}", expected PHASE=SECONDS, '
+                                         f'PHASE one of {", ".join(PHASE_TIMEOUTS)}')
+
+
+# Resolver steps by name, see resolver_step
+RESOLVER_STEPS: dict = {}
+
+
+def resolver_step(name: str):
+    """
+    Register a resolver step, resolver plugins (--resolver-plugin) use this to add their own
+    A step is called with the current values, its argument from the config and the page url, and returns the new values
+    The first step is given the page as its only value
+    :param name: Name of the step in a config
+    :return: Decorator
+
+    Example:
+        >>> @resolver_step('arm64_only')
+        ... def arm64_only(values: list, argument: Any, url: str) -> list:
+        ...     return [value for value in values if 'arm64' in value]
+    """
+    def register(function):
+        RESOLVER_STEPS[name] = function
+        return function
+
+    return register
+
+
+@resolver_step('find_all')
+def find_all_step(values: list, pattern: str, url: str) -> list:
+    """Every match of the regex in the values, group 1 if the regex has a group"""
+    compiled: re.Pattern = re.compile(pattern)
+    return [matches.group(1 if compiled.groups else 0) for value in values for matches in compiled.finditer(value)]
+
+
+@resolver_step('filter')
+def filter_step(values: list, pattern: str, url: str) -> list:
+    """The values the regex matches"""
+    return [value for value in values if re.search(pattern, value)]
+
+
+@resolver_step('exclude')
+def exclude_step(values: list, pattern: str, url: str) -> list:
+    """The values the regex does not match"""
+    return [value for value in values if not re.search(pattern, value)]
+
+
+@resolver_step('unique')
+def unique_step(values: list, argument: Any, url: str) -> list:
+    """The values without duplicates, in order"""
+    return list(dict.fromkeys(values))
+
+
+@resolver_step('sort')
+def sort_step(values: list, order: str, url: str) -> list:
+    """The values sorted by "version" (numbers compared as numbers, like sort -V) or "text", oldest first"""
+    return sorted(values) if order == 'text' else sorted(values, key=natural_sort_key)
+
+
+def natural_sort_key(value: str) -> list:
+    """
+    Sort key comparing the numbers in a string as numbers, like sort -V
+    :param value: String to sort
+    :return: Sort key
+
+    Example:
+        >>> sorted(['v9.10.1', 'v9.2.10', 'v9.9.0'], key=natural_sort_key)
+        ['v9.2.10', 'v9.9.0', 'v9.10.1']
+    """
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', value) if part]
+
+
+def version_key(value: str) -> list:
+    """
+    Sort key of a version, natural_sort_key with pre-releases (alpha, beta, rc, pre, dev) before their release
+    :param value: Version
+    :return: Sort key
+
+    Example:
+        >>> sorted(['1.0.0', '1.0.0-beta', '1.0.0.1', '1.0.0-rc1', '0.9'], key=version_key)
+        ['0.9', '1.0.0-beta', '1.0.0-rc1', '1.0.0', '1.0.0.1']
+    """
+    # The end of the version sorts after a pre-release label and before anything that continues it
+    return [(2, int(part), '') if part.isdigit() else
+            (0, 0, part) if re.search(r'(?<![a-z])(alpha|beta|rc|pre|dev)', part, re.IGNORECASE) else (3, 0, part)
+            for part in re.split(r'(\d+)', value) if part] + [(1, 0, '')]
+
+
+@resolver_step('pick')
+def pick_step(values: list, position: Any, url: str) -> list:
+    """The "first", "last" or nth (0 based, negative from the end) value"""
+    index: int = {'first': 0, 'last': -1}.get(position, position)
+    return values[index:index + 1 or None] if -len(values) <= index < len(values) else []
+
+
+@resolver_step('replace')
+def replace_step(values: list, rule: list, url: str) -> list:
+    """The values with the regex [match, replace] substituted"""
+    return [re.sub(rule[0], rule[1], value) for value in values]
+
+
+@resolver_step('template')
+def template_step(values: list, template: str, url: str) -> list:
+    """The template with each {} replaced by the value, like xargs -I {}"""
+    return [template.replace('{}', value) for value in values]
+
+
+def parse_resolve_steps(steps: Any) -> list:
+    """
+    Parse the resolver steps of a config, a json list of {step: argument} objects
+    :param steps: List of steps, or its json
+    :return: List of steps
+    """
+    if isinstance(steps, str):
+        steps = json.loads(steps)
+    if not isinstance(steps, list) or not steps:
+        raise TypeError('expected a list of {step: argument} objects')
+
+    for step in steps:
+        if not isinstance(step, dict) or len(step) != 1:
+            raise ValueError(f'invalid resolver step {step}, expected {{step: argument}}')
+        name, argument = next(iter(step.items()))
+        if name not in RESOLVER_STEPS:
+            raise ValueError(f'unknown resolver step "{name}", expected one of {", ".join(RESOLVER_STEPS)}')
+        if name in ('find_all', 'filter', 'exclude'):
+            re.compile(argument)
+        elif name == 'replace' and (not isinstance(argument, list) or len(argument) != 2):
+            raise ValueError('replace expects [match, replace]')
+        elif name == 'pick' and argument not in ('first', 'last') and not isinstance(argument, int):
+            raise ValueError('pick expects "first", "last" or a position')
+
+    return steps
+
+
+def load_resolver_plugin(path: Path) -> None:
+    """
+    Load a python file of resolver steps, resolver_step is available in it to register them
+    :param path: Path of the plugin
+    """
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(f'install_from_web_plugin_{path.stem}', path)
+    if spec is None:
+        raise ImportError(f'{path} is not a python file')
+    module = importlib.util.module_from_spec(spec)
+    module.resolver_step = resolver_step
+    spec.loader.exec_module(module)
 
-    # Register cleanup at exit
-    atexit.register(temp_folder.cleanup)
 
-    # Setup ssl verification for downloads
-    ssl_context: ssl.SSLContext = ssl.create_default_context()
-    ssl_context.load_verify_locations(export_system_root_certs())
-    ssl_context.load_default_certs()
+def run_resolver_steps(steps: list, url: str, html: str) -> list:
+    """
+    Run resolver steps in process on the page
+    :param steps: List of {step: argument}
+    :param url: Url of the page
+    :param html: Html/text of the page
+    :return: The values left after the last step
+    """
+    values: list = [html]
+    for step in steps:
+        name, argument = next(iter(step.items()))
+        values = [str(value) for value in RESOLVER_STEPS[name](values, argument, url)]
+        logger.debug(f'{name}: {len(values)} value(s) {values[:5]}')
 
-    # Create an opener with redirect handling and SSL context
-    redirect_handler: CustomRedirectHandler = CustomRedirectHandler()
-    opener: urllib.request.OpenerDirector = urllib.request.build_opener(
-        redirect_handler,
-        urllib.request.HTTPSHandler(context=ssl_context)
-    )
-    opener.addheaders = [
-        ('User-Agent', options.user_agent),
-        ('Sec-Fetch-Site', 'none'),
-        ('Sec-Fetch-Mode', 'navigate'),
-        ('Sec-Fetch-Dest', 'document'),
-        ('Sec-Fetch-User', '?1')
-    ]  # Ensure headers are preserved
+    return values
 
-    # If regex of code get the html/text
-    if any((options.regex, options.code)):
-        try:
-            # Create the request with custom User-Agent
-            req: urllib.request.Request = urllib.request.Request(options.url)
-            req.add_header('User-Agent', options.user_agent)
 
-            # Fetch the page
-            with opener.open(req) as response:
-                html: str = response.read().decode()
+def resolve_download_url(url: str, html: Optional[str], regex: Optional[str], code: Optional[str],
+                         steps: Optional[list] = None) -> tuple:
+    """
+    Find the download url in the page with the resolver steps, regex or code, or use the url as is
+    :param url: Url of the page, relative links are resolved against it
+    :param html: Html/text of the page
+    :param regex: Regex for the download url
+    :param code: Shell code the html is piped into, prints the download url
+    :param steps: Resolver steps run on the page, takes precedence over regex and code
+    :return: The download url and 0, or None and an exit code
+    """
+    # Resolver steps, run in process
+    if steps:
+        logger.info(f'Finding download in page "{url}" using: {len(steps)} resolver step(s) ...')
+        try:
+            values: list = run_resolver_steps(steps, url, html)
         except Exception as err:
-            logger.error(f'Error fetching page: {err}')
-            return 5
+            logger.error(f'Resolver step failed: {err}')
+            return None, 5
+
+        if not values:
+            logger.error('No matching download URL found.')
+            return None, 1
+        if len(values) > 1:
+            logger.debug(f'{len(values)} values left, using the first')
+        download_url: str = values[0].strip()
+        logger.info(f'Found download URL: {download_url}')
 
     # Regex for the term
-    if options.regex is not None:
-        logger.info(f'Finding download in page "{options.url}" using: "{options.regex}" ...')
+    elif regex is not None:
+        logger.info(f'Finding download in page "{url}" using: "{regex}" ...')
 
         # If regex is specified, use it to find the link
         try:
-            matches: Optional[re.Match] = re.search(options.regex, html)
+            matches: Optional[re.Match] = re.search(regex, html)
 
             # Find the link
             if matches:
@@ -182,21 +1852,21 @@ def main():
                 logger.info(f'Found download URL: {download_url}')
             else:
                 logger.error('No matching download URL found.')
-                return 1
+                return None, 1
 
         except Exception as err:
             logger.error(f'Error fetching page: {err}')
-            return 5
+            return None, 5
 
     # Pipe the html into the code
-    elif options.code is not None:
-        logger.info(f'Finding download in page "{options.url}" using: provided code ...')
+    elif code is not None:
+        logger.info(f'Finding download in page "{url}" using: provided code ...')
 
         # Processes code
         try:
             # Run the user-provided code as a shell command, with HTML piped in
-            process: subprocess.Popen = subprocess.Popen(
-                options.code,
+            process: subprocess.Popen = system.popen(
+                code,
                 shell=True,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
@@ -213,17 +1883,17 @@ def main():
                 logger.info(f'Found download URL: {download_url}')
             else:
                 logger.critical(f'Command failed. Error: {stderr.strip()}')
-                return 5
+                return None, 5
 
         except subprocess.CalledProcessError as err:
             logger.critical(f'Failed to run provided code. Error: {err.stderr.strip()}')
-            return 5
+            return None, 5
 
     else:
-        download_url: str = options.url
+        download_url: str = url
 
     # Ensure the URL has a full schema (http/https) and domain
-    parsed_base: urllib.parse.ParseResult = urlparse(options.url)
+    parsed_base: urllib.parse.ParseResult = urlparse(url)
     if not urlparse(download_url).scheme:
         if download_url.startswith('/'):
             # Absolute path (domain only)
@@ -233,171 +1903,63 @@ def main():
             download_url: str = f'{parsed_base.scheme}://{parsed_base.netloc}{parsed_base.path}/{download_url}'
         logger.info(f'Adjusted download URL: {download_url}')
 
-    # Download the install/app
-    parsed_json_url: urlparse = urlparse(download_url)
-    if not all([parsed_json_url.scheme, parsed_json_url.netloc]):
-        logger.critical(f'url "{download_url}" does not appear to be valid')
-        return 4
-
-    start_time: float = time.time()
-    try:
-        logger.info(f'Downloading {download_url} ...')
-        installer_file: str = get_filename(download_url)
-        installer_path: Path = Path(temp_folder.name).joinpath(installer_file)
-
-        # Create a request for the file download
-        req_download: urllib.request.Request = urllib.request.Request(download_url)
-        req_download.add_header('User-Agent', options.user_agent)
-
-        # Download the file
-        with opener.open(req_download) as download_response:
-            # Get  file name from redirect if no extension from the link
-            if Path(installer_file).suffix is None or Path(installer_file).suffix == '':
-                download_url: str = redirect_handler.final_url if redirect_handler.final_url else download_url
-                installer_file: str = get_filename(download_url)
-                installer_path: Path = Path(temp_folder.name).joinpath(installer_file)
-
-            # Save download
-            with open(installer_path, 'wb') as file:
-                file.write(download_response.read())
-                logger.info(f'Saved to {installer_file}')
-                logger.debug(f'Saved to {installer_path}')
-
-    except Exception as err:
-        logger.critical(err)
-        return 5
-    finally:
-        # Get the time to download (or fail)
-        end_time: float = time.time()
-        minutes, seconds = divmod((end_time - start_time), 60)
-        hours, minutes = divmod(minutes, 60)
-        logger.info(f'Run time: {hours:02.0f}:{minutes:02.0f}:{seconds:04.1f}')
-
-    # Get file type
-    if options.file_type is not None:
-        file_type: Optional[str] = options.file_type
-        logger.info(f'Using provided file type: {file_type}')
-    else:
-        logger.info('Getting file type from mime types')
-        mime_type, _ = mimetypes.guess_type(installer_file)
-
-        if not mime_type:
-            file_type: Optional[str] = None
-        elif 'x-apple-diskimage' in mime_type:
-            file_type: Optional[str] = 'dmg'
-        elif 'x-tar' in mime_type:
-            file_type: Optional[str] = 'tar.gz'
-        elif 'x-xar' in mime_type:
-            file_type: Optional[str] = 'pkg'
-        elif 'zip' in mime_type:
-            file_type: Optional[str] = 'zip'
-        else:
-            logger.warning(f'Unknown file type: {mime_type}')
-            file_type: Optional[str] = None
+    return download_url, 0
 
-    if file_type is None:
-        # Detect from signatures
-        logger.info('Getting file type from signature')
-        file_type: Optional[str] = detect_mime_type(installer_path)
 
-    if file_type is None and '.' in installer_file:
-        # Essentially the same as mimetype, but last ditch
-        file_type: Optional[str] = installer_file.split('.')[-1]
+def parse_json_path(path: str) -> list:
+    """
+    Parse a path into json, keys separated by dots, [n] for an index (negative from the end) and * or [*] for every item
+    :param path: Path
+    :return: List of keys and indexes
 
-    if file_type is None:
-        logger.critical(
-            'Unable to get file type from options, mime or extension, use -t, --dmg, --pkg, --tar, or --zip')
-        return 7
+    Example:
+        >>> parse_json_path('PCP[0].downloads.macM1.link')
+        ['PCP', 0, 'downloads', 'macM1', 'link']
+    """
+    steps: list = []
+    for index, key in re.findall(r'\[(\*|-?\d+)]|([^.\[\]]+)', path.strip().lstrip('$')):
+        steps.append(key if key else index if index == '*' else int(index))
 
-    logger.info(f'File type is: {file_type}')
+    return steps
 
-    # Unpack
-    if file_type.startswith('tar') or file_type.startswith('gz'):
-        try:
-            logger.info(f'Unpacking TAR {installer_path.stem} ...')
-            with tarfile.open(installer_path, 'r') as tar:
-                tar.extractall(path=unpack_path)
-            logger.info(f'TAR unpacked to {unpack_path}')
-        except tarfile.ReadError as err:
-            logger.critical(err)
-            return 8
 
-    elif file_type == 'zip':
+def parse_json_filter(filters: Any) -> dict:
+    """
+    Parse the json filters of a config, a field path to regex object or a list of [field, regex] pairs
+    :param filters: Filters
+    :return: Dict of field path to regex
+    """
+    if isinstance(filters, list) and all(isinstance(pair, (list, tuple)) and len(pair) == 2 for pair in filters):
+        filters = dict(filters)
+    if not isinstance(filters, dict):
+        raise TypeError('expected an object of field: regex')
+
+    for field, pattern in filters.items():
+        if not isinstance(pattern, str):
+            raise ValueError(f'filter of {field} must be a regex string')
         try:
-            logger.info(f'Unpacking ZIP {installer_path.stem} ...')
-            with zipfile.ZipFile(installer_path, 'r') as zip_ref:
-                for zip_info in zip_ref.infolist():
-                    extracted_path: Path = Path(unpack_path, zip_info.filename)
-
-                    # Detect if this should be a symlink
-                    if zip_info.external_attr >> 28 == 0xA:  # Symlink in POSIX (0xA)
-                        symlink_target: str = zip_ref.read(zip_info.filename).decode()
-                        logger.debug(f'Creating symlink {extracted_path} -> {symlink_target}')
-                        extracted_path.parent.mkdir(parents=True, exist_ok=True)
-                        os.symlink(symlink_target, extracted_path)
-                    else:
-                        zip_ref.extract(zip_info, unpack_path)
-                        # Apply permissions if this is an executable
-                        perm: int = zip_info.external_attr >> 16
-                        if perm:
-                            logger.debug(f'Setting permissions for {extracted_path}: {oct(perm)}')
-                            os.chmod(extracted_path, perm)
-            logger.info(f'ZIP unpacked to {unpack_path}')
-        except zipfile.BadZipFile as err:
-            logger.critical(f'Error extracting ZIP: {err}')
-            return 8
-
-    elif file_type == 'dmg':
-        mount_dmg(installer_path, unpack_path)
-
-    elif file_type == 'pkg':
-        install_pkg(installer_path, unpack_path)
-        return 0
-
-    # Get the installer/app
-    app_path: Path = find_app_path(unpack_path)
-    pkg_path: Path = find_app_path(unpack_path, '*.pkg', False)
-    if app_path is not None:
-        install_path: Path = options.app_install_path
-        logger.info(f'Copying /{app_path.name} to {install_path}')
-
-        # Get versions
-        old_version: str = get_app_version(install_path.joinpath(app_path.name))
-        new_version: str = get_app_version(app_path)
-        logger.info(f'Current version installed {old_version}')
-        logger.info(f'New version to install {new_version}')
-
-        # Compare versions
-        install: bool = options.reinstall
-        if not old_version:
-            logger.info('No current installation')
-            install: bool = True
-        elif not new_version:
-            logger.error('Cannot get the new app version')
-        elif version_parse(new_version) > version_parse(old_version):
-            logger.info(f'Version to install {new_version} is newer than installed {old_version}.')
-            install: bool = True
-        elif version_parse(new_version) < version_parse(old_version):
-            logger.info(f'Version to install {new_version} is older than installed {old_version}.')
-            if options.allow_downgrade:
-                install: bool = True
-        else:
-            logger.info('Both versions are identical.')
+            re.compile(pattern)
+        except re.error as err:
+            raise ValueError(f'invalid regex for {field}: {err}')
 
-        # Install app
-        if install:
-            logger.info('Installing!')
-            install_app(app_path, install_path)
+    return filters
 
-    elif pkg_path is not None:
-        logger.info(f'Installing {pkg_path} to {options.pkg_install_path}')
-        install_pkg(pkg_path, unpack_path)
-    else:
-        logger.critical('No app or pkg found in installer')
-        return 2
 
-    logger.info('Done')
-    return 0
+def is_newer_version(version: str, other_version: str, allow_downgrade: bool = False) -> bool:
+    """
+    Check if a version should replace another, comparing with version_parse
+    Versions version_parse cannot compare are compared with version_key, numbers like sort -V and pre-releases first
+    :param version: New version
+    :param other_version: Installed version
+    :param allow_downgrade: An older version also replaces it
+    :return: True if newer (or older with allow_downgrade)
+    """
+    try:
+        new_version, old_version = version_parse(version), version_parse(other_version)
+        return new_version > old_version or (allow_downgrade and new_version < old_version)
+    except TypeError:
+        new_key, old_key = version_key(version), version_key(other_version)
+        return new_key > old_key or (allow_downgrade and new_key < old_key)
 
 
 def is_app_running(app_name: str) -> (bool, Optional[str]):
@@ -408,7 +1970,7 @@ def is_app_running(app_name: str) -> (bool, Optional[str]):
     """
     try:
         # Run the 'ps aux' command to list all running processes
-        result: subprocess.CompletedProcess = subprocess.run(['ps', '-axo', 'pid comm'], capture_output=True, text=True)
+        result: subprocess.CompletedProcess = system.run(['ps', '-axo', 'pid comm'], capture_output=True, text=True)
 
         # Check if any line contains the app name
         for line in result.stdout.splitlines():
@@ -450,7 +2012,7 @@ def detect_mime_type(file_path: str) -> Optional[str]:
     """
     try:
         with open(file_path, 'rb') as file:
-            header: bytes = file.read(16)
+            header: bytes = file.read(512)
 
             # Detect file type by signature
             if header[0] == 0x50 and header[1] == 0x4B:  # ZIP file
@@ -465,9 +2027,9 @@ def detect_mime_type(file_path: str) -> Optional[str]:
                 if header[1] in (0x01, 0x5E, 0x9C, 0xDA, 0x20, 0x7D, 0xBB, 0xF9):
                     return 'dmg'
 
-            # Detect DMG (xy)
-            if header[0:6] == b'\xFD\x37\x7A\x58\x5A\x00':
-                return 'dmg'
+            # Detect compressed tar (gzip, bzip2, xz, zstd)
+            if detect_compression(file_path) is not None:
+                return 'tar'
 
             # Detect DMG (Apple Disk Image)
             if header[0:4] == b'plist' or header[0:4] == b'\x62\x70\x6C\x69':
@@ -477,9 +2039,7 @@ def detect_mime_type(file_path: str) -> Optional[str]:
             if header[0] == 0x1F:
                 if header[1] in (0x8B, 0x90, 0xA0):
                     return 'tar'
-            if header.startswith(b'\x42\x5A\x68'):  # BZip2 (BZh)
-                return 'tar'
-            if header.startswith(b'\x75\x73\x74\x61\x72'):  # Tar (ustar)
+            if header[257:262] == b'\x75\x73\x74\x61\x72':  # Tar (ustar)
                 return 'tar'
 
         logger.debug(f'Unknown file type. Header: {header.hex().upper()}')
@@ -493,6 +2053,114 @@ def detect_mime_type(file_path: str) -> Optional[str]:
         return None
 
 
+def detect_compression(file_path: Path) -> Optional[str]:
+    """
+    Detect the compression of a file from its signature
+    :param file_path: Path to the file
+    :return: gzip, bzip2, xz, zstd or None if not compressed (or unknown)
+    """
+    with open(file_path, 'rb') as file:
+        header: bytes = file.read(8)
+
+    for compression, (signature, _) in COMPRESSIONS.items():
+        if header.startswith(signature):
+            return compression
+
+    return None
+
+
+def decompression_backends(compression: str) -> list:
+    """
+    Get the available backends for a compression, fastest first
+    :param compression: gzip, bzip2, xz or zstd
+    :return: List of backend names, the tool names and/or "python"
+    """
+    import shutil
+
+    backends: list = []
+    for command in COMPRESSIONS[compression][1]:
+        if command[0] != 'python':
+            if shutil.which(command[0]):
+                backends.append(command[0])
+        elif compression != 'zstd':
+            backends.append('python')
+        else:
+            try:
+                from compression import zstd  # Python 3.14+
+                backends.append('python')
+            except ImportError:
+                pass
+
+    return backends
+
+
+@contextlib.contextmanager
+def open_decompressed(file_path: Path, compression: Optional[str], backend: str = 'auto'):
+    """
+    Open a file as a stream of its decompressed contents
+    System tools run as a subprocess streaming to a pipe, so decompression (multithreaded with pigz and xz -T0)
+    runs alongside the extraction reading it
+    :param file_path: Path to the file
+    :param compression: gzip, bzip2, xz, zstd or None for an uncompressed file
+    :param backend: auto (fastest available), system (any tool), python, or the name of a tool
+    :return: Readable binary stream
+    """
+    if compression is None:
+        with open(file_path, 'rb') as file:
+            yield file
+        return
+
+    backends: list = decompression_backends(compression)
+    if backend == 'system':
+        backends = [name for name in backends if name != 'python']
+    elif backend != 'auto':
+        backends = [name for name in backends if name == backend]
+    if not backends:
+        raise OSError(f'No {backend} backend available to decompress {compression}')
+
+    if backends[0] == 'python':
+        logger.info(f'Decompressing {compression} in python')
+        if compression == 'gzip':
+            import gzip
+            stream = gzip.open(file_path, 'rb')
+        elif compression == 'bzip2':
+            import bz2
+            stream = bz2.open(file_path, 'rb')
+        elif compression == 'xz':
+            import lzma
+            stream = lzma.open(file_path, 'rb')
+        else:
+            from compression import zstd
+            stream = zstd.open(file_path, 'rb')
+        with stream:
+            yield stream
+        return
+
+    import tempfile
+
+    command: list = next(command for command in COMPRESSIONS[compression][1] if command[0] == backends[0])
+    logger.info(f'Decompressing {compression} with {" ".join(command)}')
+    # stderr goes to a file, a pipe is not read while the extraction reads stdout and the tool would stall once it fills
+    with tempfile.TemporaryFile() as stderr_file:
+        process: subprocess.Popen = system.popen([*command, file_path], stdout=subprocess.PIPE, stderr=stderr_file)
+        try:
+            yield process.stdout
+            # Read what the extraction left, the end of archive padding, so the tool can finish
+            while process.stdout.read(DOWNLOAD_CHUNK_SIZE):
+                pass
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+
+        if process.returncode != 0:
+            # The end of stderr, where the tool says why it failed
+            stderr_file.seek(max(os.fstat(stderr_file.fileno()).st_size - 4096, 0))
+            raise OSError(f'{command[0]} failed: {stderr_file.read().decode(errors="replace").strip()}')
+
+
 def mount_dmg(dmg_path: Path, mount_point: Path):
     """
     Mounts a DMG file using hdiutil (macOS only).
@@ -508,20 +2176,25 @@ def mount_dmg(dmg_path: Path, mount_point: Path):
         ]
         logger.debug(' '.join(cmd))
 
-        subprocess.run(
+        system.run(
             cmd,
             check=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True
+            text=True,
+            timeout=phase_timeout('mount')
         )
         logger.info(f'DMG mounted at {mount_point}')
 
         # Register unmount at exit
-        atexit.register(lambda: unmount_dmg(mount_point))
+        at_job_exit(lambda: unmount_dmg(mount_point))
 
     except subprocess.CalledProcessError as err:
         logger.critical(f'Failed to mount DMG. Error: {err.stderr.strip()}')
+    except subprocess.TimeoutExpired as err:
+        # A half attached image is still detached at exit
+        at_job_exit(lambda: unmount_dmg(mount_point))
+        raise PhaseTimeout('mount', phase_timeout('mount')) from err
 
 
 def unmount_dmg(mount_point: Path):
@@ -533,7 +2206,7 @@ def unmount_dmg(mount_point: Path):
         logger.info(f'Unmounting DMG at {mount_point}')
         cmd: list[str] = ['/usr/bin/hdiutil', 'detach', mount_point.as_posix()]
         logger.debug(' '.join(cmd))
-        subprocess.run(
+        system.run(
             cmd,
             check=False,
             stdout=subprocess.PIPE,
@@ -567,6 +2240,37 @@ def find_app_path(install_files: Path, pattern: str = '*.app', directory: bool =
     return app_path
 
 
+def find_app_paths(install_files: Path, patterns: list) -> list:
+    """
+    Finds every app bundle matching the patterns within the install_files directory, apps inside other apps
+    (helpers, login items) and symlinks (the Applications link of a dmg) are skipped
+    :param install_files: Path to the directory to search in
+    :param patterns: Globs of bundle names, with or without .app, "*" for all
+    :return: Paths to the bundles, by name
+    """
+    import fnmatch
+
+    logger.info(f'Searching for {", ".join(patterns)} in {install_files} ...')
+
+    app_paths: dict = {}
+    folders: list = [install_files]
+    while folders:
+        for path in sorted(folders.pop().iterdir()):
+            if path.is_symlink() or not path.is_dir():
+                continue
+            if path.suffix != '.app':
+                folders.append(path)
+            elif any(fnmatch.fnmatch(path.name, pattern) or fnmatch.fnmatch(path.stem, pattern)
+                     for pattern in patterns):
+                if path.name in app_paths:
+                    logger.warning(f'Skipping {path}, {app_paths[path.name]} has the same name')
+                    continue
+                logger.info(f'Found {path.name}')
+                app_paths[path.name] = path
+
+    return [app_paths[name] for name in sorted(app_paths)]
+
+
 def get_app_version(app_path: Path) -> str:
     """
     Reads the CFBundleShortVersionString from the Info.plist file in a .app bundle.
@@ -579,6 +2283,7 @@ def get_app_version(app_path: Path) -> str:
         return None
 
     try:
+        import plistlib
         with plist_path.open('rb') as plist_file:
             plist_data: Any = plistlib.load(plist_file)
             version: Any = plist_data.get('CFBundleShortVersionString')
@@ -588,91 +2293,365 @@ def get_app_version(app_path: Path) -> str:
         return None
 
 
-def install_app(app_path: Path, install_path: Path):
+@functools.lru_cache
+def xattr_functions() -> tuple:
+    """
+    Get listxattr and removexattr functions that do not follow symlinks, from os on Linux and from libc through ctypes
+    on macOS, where os has none
+    :return: listxattr(path) returning the attribute names, and removexattr(path, name)
+    """
+    if hasattr(os, 'listxattr'):
+        return (lambda path: os.listxattr(path, follow_symlinks=False),
+                lambda path, name: os.removexattr(path, name, follow_symlinks=False))
+
+    import ctypes
+    import ctypes.util
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.listxattr.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_int)
+    libc.listxattr.restype = ctypes.c_ssize_t
+    libc.removexattr.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int)
+    libc.removexattr.restype = ctypes.c_int
+    xattr_nofollow: int = 0x0001
+
+    def checked(result: int, path: Any) -> int:
+        if result < 0:
+            error: int = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return result
+
+    def listxattr(path: Any) -> list:
+        encoded_path: bytes = os.fsencode(path)
+        size: int = checked(libc.listxattr(encoded_path, None, 0, xattr_nofollow), path)
+        if not size:
+            return []
+        buffer = ctypes.create_string_buffer(size)
+        size = checked(libc.listxattr(encoded_path, buffer, size, xattr_nofollow), path)
+        return [os.fsdecode(name) for name in buffer.raw[:size].split(b'\0') if name]
+
+    def removexattr(path: Any, name: str) -> None:
+        checked(libc.removexattr(os.fsencode(path), os.fsencode(name), xattr_nofollow), path)
+
+    return listxattr, removexattr
+
+
+class XattrStripper:
+    """
+    Remove an extended attribute from files on a small thread pool, each file is checked with listxattr first so the
+    ones without it cost a single call. A tree can be stripped as it is copied (copytree), or after (strip_tree)
+    """
+
+    def __init__(self, name: str, workers: int = 4, batch_size: int = 256) -> None:
+        """
+        Initialise the stripper
+        name: (str) Attribute to remove, com.apple.quarantine or a user.* attribute on Linux
+        workers: (int) Threads removing the attribute
+        batch_size: (int) Paths given to a thread at a time
+        """
+        self.name: str = name
+        self.workers: int = workers
+        self.batch_size: int = batch_size
+        self.listxattr, self.removexattr = xattr_functions()
+        self.checked: int = 0
+        self.stripped: int = 0
+        self.failed: int = 0
+        self.lock: threading.Lock = threading.Lock()
+        self.executor: Optional['concurrent.futures.ThreadPoolExecutor'] = None
+        self.futures: list = []
+        self.pending: list = []
+
+    def submit(self, path: Any) -> None:
+        """
+        Queue a path to strip, paths are handed to the threads in batches
+        :param path: Path of a file, directory or symlink
+        """
+        self.pending.append(path)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Hand the queued paths to a thread
+        """
+        if not self.pending:
+            return
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='xattr')
+        # Run in the context of the job, so the threads log with its logger
+        self.futures.append(self.executor.submit(contextvars.copy_context().run, self.strip, self.pending))
+        self.pending = []
+
+    def strip(self, paths: list) -> None:
+        """
+        Remove the attribute from paths that have it
+        :param paths: Paths to strip
+        """
+        checked: int = 0
+        stripped: int = 0
+        failed: int = 0
+        for path in paths:
+            try:
+                if self.name in self.listxattr(path):
+                    self.removexattr(path, self.name)
+                    stripped += 1
+                checked += 1
+            except OSError as err:
+                logger.debug(f'Unable to remove {self.name} from {path}: {err}')
+                failed += 1
+
+        with self.lock:
+            self.checked += checked
+            self.stripped += stripped
+            self.failed += failed
+
+    def copy(self, source: Any, destination: Any) -> Any:
+        """
+        Copy a file as shutil.copy2 and strip the copy, a copy_function for shutil.copytree
+        :param source: File to copy
+        :param destination: Path of the copy
+        :return: The destination
+        """
+        import shutil
+
+        copied = shutil.copy2(source, destination)
+        self.submit(copied)
+        return copied
+
+    def copytree(self, system: 'System', source: Path, destination: Path) -> None:
+        """
+        Copy a tree with system.copytree and strip the copy without walking it again, files as they are copied and
+        folders once the copy is done, as shutil.copytree copies the metadata of a folder after its contents
+        :param system: System to copy with
+        :param source: Tree to copy
+        :param destination: Path of the copy
+        """
+        folders: list = []
+
+        def note_folder(folder: str, names: list) -> list:
+            folders.append(destination.joinpath(os.path.relpath(folder, source)))
+            return []
+
+        system.copytree(source, destination, self.copy, note_folder)
+        for folder in folders:
+            self.submit(folder)
+
+    def strip_tree(self, root: Path) -> None:
+        """
+        Walk a tree with os.scandir and strip everything in it
+        :param root: Root of the tree, stripped too
+        """
+        self.submit(root)
+        folders: list = [root]
+        while folders:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    self.submit(entry.path)
+
+    def close(self) -> None:
+        """
+        Wait for the threads to finish, an error of a thread is raised once they all have
+        """
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+        futures, self.futures = self.futures, []
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+
+
+def install_bundle(app_path: Path, install_path: Path) -> dict:
+    """
+    Compare the version of an app with the installed one and install it when it is newer
+    :param app_path: Path to the .app directory to be installed
+    :param install_path: Path where the .app should be installed
+    :return: The installed_version, new_version and result (installed, current or failed) of the app
+    """
+    logger.info(f'Copying /{app_path.name} to {install_path}')
+
+    with metrics.phase('version_check'):
+        # Get versions
+        old_version: str = get_app_version(install_path.joinpath(app_path.name))
+        new_version: str = get_app_version(app_path)
+        logger.info(f'Current version installed {old_version}')
+        logger.info(f'New version to install {new_version}')
+
+        # Compare versions
+        install: bool = options.reinstall
+        if not old_version:
+            logger.info('No current installation')
+            install: bool = True
+        elif not new_version:
+            logger.error('Cannot get the new app version')
+        elif version_parse(new_version) > version_parse(old_version):
+            logger.info(f'Version to install {new_version} is newer than installed {old_version}.')
+            install: bool = True
+        elif version_parse(new_version) < version_parse(old_version):
+            logger.info(f'Version to install {new_version} is older than installed {old_version}.')
+            if options.allow_downgrade:
+                install: bool = True
+        else:
+            logger.info('Both versions are identical.')
+
+    # Install app
+    result: str = 'current'
+    if install:
+        logger.info('Installing!')
+        result = 'installed' if install_app(app_path, install_path) else 'failed'
+
+    return {'installed_version': old_version, 'new_version': new_version, 'result': result}
+
+
+def install_bundles(app_paths: list, install_path: Path) -> dict:
+    """
+    Install apps at the same time, each compared with its installed version
+    Each app is timed in metrics of its own, as their phases overlap, and the run times them together as bundles
+    :param app_paths: Paths to the .app directories to be installed
+    :param install_path: Path where the apps should be installed
+    :return: Dictionary of app name to the result of install_bundle, with the phases of the app
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    run_metrics: RunMetrics = metrics.get()
+
+    def run_bundle(app_path: Path) -> dict:
+        bundle_metrics: RunMetrics = RunMetrics(f'{run_metrics.name}/{app_path.name}')
+        metrics.set(bundle_metrics)
+        bundle: dict = install_bundle(app_path, install_path)
+        return {**bundle, 'phases': {phase: round(seconds, 6) for phase, seconds in bundle_metrics.phases.items()},
+                **bundle_metrics.counters}
+
+    with metrics.phase('bundles'), \
+            ThreadPoolExecutor(max_workers=min(len(app_paths), BUNDLE_WORKERS), thread_name_prefix='bundle') as executor:
+        futures: dict = {app_path.name: executor.submit(contextvars.copy_context().run, run_bundle, app_path)
+                         for app_path in app_paths}
+
+    return {name: future.result() for name, future in futures.items()}
+
+
+def install_app(app_path: Path, install_path: Path) -> bool:
     """
     Copies the .app directory to the install path.
     :param app_path: Path to the .app directory to be installed
     :param install_path: Path where the .app should be installed
+    :return: True if the app was copied
     """
     logger.info(f'Copying {app_path.name} to {install_path}')
     destination = install_path / app_path.name
+    installed: bool = False
+
+    # Strip the quarantine before launching, a copy in python is stripped as it is copied
+    stripper: Optional[XattrStripper] = XattrStripper(QUARANTINE_XATTR) if options.run else None
 
     try:
         logger.debug(f'Using copy method: {options.copy_method}')
+        with metrics.phase('copy'):
+            if options.copy_method == 'shutil':
+
+                if destination.exists():
+                    logger.info(f'Removing existing installation at {destination}')
+                    system.rmtree(destination)
+
+                if stripper is not None:
+                    stripper.copytree(system, app_path, destination)
+                else:
+                    system.copytree(app_path, destination)
+
+            elif options.copy_method == 'cp':
+                if destination.exists():
+                    logger.info(f'Removing existing installation at {destination}')
+                    system.rmtree(destination)
+
+                cmd: list = [
+                    'cp', '-rp',
+                    app_path.as_posix(),
+                    destination.as_posix()
+                ]
+                logger.debug(' '.join(cmd))
+
+                result: subprocess.CompletedProcess = system.run(cmd, text=True, stderr=subprocess.PIPE,
+                                                                  stdout=subprocess.PIPE,
+                                                                  timeout=phase_timeout('copy'), check=True)
+                logger.debug(result)
+
+            elif options.copy_method == 'rsync':
+                cmd: list = [
+                    'rsync', '-DgloprtLdEHW', '--delete',
+                    f'{app_path.as_posix()}/',
+                    destination.as_posix()
+                ]
+                logger.debug(' '.join(cmd))
+
+                result: subprocess.CompletedProcess = system.run(cmd, text=True, stderr=subprocess.PIPE,
+                                                                 stdout=subprocess.PIPE,
+                                                                 timeout=phase_timeout('copy'), check=True)
+                logger.debug(result)
+
+            else:  # ditto
+                if destination.exists():
+                    logger.info(f'Removing existing installation at {destination}')
+                    system.rmtree(destination)
+
+                cmd: list = [
+                    'ditto',
+                    app_path.as_posix(),
+                    destination.as_posix()
+                ]
+                logger.debug(' '.join(cmd))
 
-        if options.copy_method == 'shutil':
-
-            if destination.exists():
-                logger.info(f'Removing existing installation at {destination}')
-                shutil.rmtree(destination)
-
-            shutil.copytree(app_path, destination, copy_function=shutil.copy2, dirs_exist_ok=True)
-
-        elif options.copy_method == 'cp':
-            if destination.exists():
-                logger.info(f'Removing existing installation at {destination}')
-                shutil.rmtree(destination)
-
-            cmd: list = [
-                'cp', '-rp',
-                app_path.as_posix(),
-                destination.as_posix()
-            ]
-            logger.debug(' '.join(cmd))
-
-            result: subprocess.CompletedProcesss = subprocess.run(cmd, text=True, stderr=subprocess.PIPE,
-                                                                  stdout=subprocess.PIPE)
-            logger.debug(result)
-
-        elif options.copy_method == 'rsync':
-            cmd: list = [
-                'rsync', '-DgloprtLdEHW', '--delete',
-                f'{app_path.as_posix()}/',
-                destination.as_posix()
-            ]
-            logger.debug(' '.join(cmd))
-
-            result: subprocess.CompletedProcess = subprocess.run(cmd, text=True, stderr=subprocess.PIPE,
-                                                                 stdout=subprocess.PIPE)
-            logger.debug(result)
-
-        else:  # ditto
-            if destination.exists():
-                logger.info(f'Removing existing installation at {destination}')
-                shutil.rmtree(destination)
-
-            cmd: list = [
-                'ditto',
-                app_path.as_posix(),
-                destination.as_posix()
-            ]
-            logger.debug(' '.join(cmd))
-
-            result: subprocess.CompletedProcess = subprocess.run(cmd, text=True, stderr=subprocess.PIPE,
-                                                                 stdout=subprocess.PIPE)
-            logger.debug(result)
+                result: subprocess.CompletedProcess = system.run(cmd, text=True, stderr=subprocess.PIPE,
+                                                                 stdout=subprocess.PIPE,
+                                                                 timeout=phase_timeout('copy'), check=True)
+                logger.debug(result)
         logger.info('Installation complete.')
+        installed = True
+
+        if options.manifest_dir is not None:
+            from install_from_web_manifest import record_manifest
+            with metrics.phase('manifest'):
+                record_manifest(destination)
+    except subprocess.TimeoutExpired as err:
+        raise PhaseTimeout('copy', phase_timeout('copy')) from err
+    except subprocess.CalledProcessError as err:
+        # A failed copy is not installed, nor recorded in a manifest
+        logger.error(f'Installation failed: {err} {(err.stderr or "").strip()}')
     except Exception as err:
         logger.error(f'Installation failed: {err}')
 
     if options.run:
-        result: subprocess.CompletedProcess = subprocess.run(
-            ['xattr', '-dr', 'com.apple.quarantine', destination.as_posix()],
-            capture_output=True, text=True
-        )
+        start_time: float = time.perf_counter()
+        with metrics.phase('quarantine'):
+            # ditto, cp and rsync copy in another process, so their copy is walked once it is done
+            if options.copy_method != 'shutil':
+                try:
+                    stripper.strip_tree(destination)
+                except OSError as err:
+                    logger.warning(f'Failed to clear quarantine: {err}')
+            try:
+                stripper.close()
+            except Exception as err:
+                logger.warning(f'Failed to clear quarantine: {err}')
+        metrics.count('quarantine_checked', stripper.checked)
+        metrics.count('quarantine_stripped', stripper.stripped)
 
-        if result.returncode == 0:
-            logger.info(f'Cleared quarantine attribute for {destination}')
-        else:
-            logger.warning(f'Failed to clear quarantine: {result.stderr}')
+        if stripper.failed:
+            logger.warning(f'Failed to clear quarantine from {stripper.failed} files of {destination}')
+        logger.info(f'Cleared quarantine attribute from {stripper.stripped} of {stripper.checked} files of '
+                    f'{destination} in {time.perf_counter() - start_time:.3f}s')
 
-        result: subprocess.CompletedProcess = subprocess.run(['open', destination.as_posix()], check=True)
+        result: subprocess.CompletedProcess = system.run(['open', destination.as_posix()], check=True)
 
         if result.returncode == 0:
             logger.info(f'Launched {destination}')
         else:
             logger.error(f'Failed to launch {destination}. Error: {result.stderr}')
 
+    return installed
+
 
 def install_pkg(pkg_path: Path, unpack_path: Path):
     """
@@ -680,6 +2659,8 @@ def install_pkg(pkg_path: Path, unpack_path: Path):
     :param pkg_path: Path to the .pkg to be installed
     :param unpack_path: Path to the directory to be unpacked
     """
+    import xml.etree.ElementTree as ET
+
     logger.info(f'Unpacking PKG {pkg_path.name} ...')
     pkg_extract_path: Path = unpack_path.parent.joinpath('pkg_extract')
 
@@ -692,16 +2673,20 @@ def install_pkg(pkg_path: Path, unpack_path: Path):
     cmd: list = ['/usr/sbin/pkgutil', '--expand', pkg_path.as_posix(), pkg_extract_path.as_posix()]
     logger.debug(' '.join(cmd))
     try:
-        subprocess.run(
-            cmd,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        with metrics.phase('unpack'):
+            system.run(
+                cmd,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=phase_timeout('expand')
+            )
     except subprocess.CalledProcessError as err:
         logger.critical(f'Failed to mount DMG. Error: {err.stderr.strip()}')
         return 5
+    except subprocess.TimeoutExpired as err:
+        raise PhaseTimeout('expand', phase_timeout('expand')) from err
 
     logger.debug(f'PKG unpacked to {pkg_extract_path}')
 
@@ -709,44 +2694,98 @@ def install_pkg(pkg_path: Path, unpack_path: Path):
     distribution_file = pkg_extract_path.joinpath('Distribution')
     package_info_file = pkg_extract_path.joinpath('PackageInfo')
 
-    install: bool = options.reinstall
-    if distribution_file.exists():
-        logger.debug('Working from distribution pkg')
-        try:
-            # Parse the Distribution XML file
-            tree: ElementTree = ET.parse(distribution_file)
-            root = tree.getroot()
+    with metrics.phase('version_check'):
+        install: bool = options.reinstall
+        if distribution_file.exists():
+            logger.debug('Working from distribution pkg')
+            try:
+                # Parse the Distribution XML file
+                tree: ET.ElementTree = ET.parse(distribution_file)
+                root = tree.getroot()
+
+                # Iterate over all pkg-ref elements with a version attribute
+                for pkg_ref in root.findall('.//pkg-ref[@version]'):
+                    package_id = pkg_ref.get('packageIdentifier') or pkg_ref.get('id')
+                    version: tuple = version_parse(pkg_ref.get('version'))
+
+                    if not package_id:
+                        logger.warning('No package identifier found for this pkg-ref.')
+                        continue
+
+                    logger.info(f'Checking package: {package_id} (Version: {version})')
+
+                    # Check installed version using pkgutil
+                    result: subprocess.CompletedProcess = system.run(
+                        ['/usr/sbin/pkgutil', '--pkg-info', package_id],
+                        capture_output=True,
+                        text=True,
+                        check=False
+                    )
 
-            # Iterate over all pkg-ref elements with a version attribute
-            for pkg_ref in root.findall('.//pkg-ref[@version]'):
-                package_id = pkg_ref.get('packageIdentifier') or pkg_ref.get('id')
-                version: tuple = version_parse(pkg_ref.get('version'))
+                    installed_version: Optional[tuple] = None
+                    if result.returncode == 0:
+                        for line in result.stdout.splitlines():
+                            if line.startswith('version:'):
+                                installed_version: Optional[tuple] = version_parse(line)  # line.split(':')[1].strip()
+                                break
 
-                if not package_id:
-                    logger.warning('No package identifier found for this pkg-ref.')
-                    continue
+                    # Compare versions
+                    if not installed_version:
+                        logger.info(f'Package {package_id} is not installed.')
+                        install: bool = True
+                    elif version == installed_version:
+                        logger.info(f'Package {package_id} is already up to date (Version: {version}).')
+                    elif version > installed_version:
+                        logger.info(
+                            f'Package {package_id} has an update available: '
+                            f'Installed {installed_version} → Available {version}'
+                        )
+                        install: bool = True
+                    elif version < installed_version:
+                        logger.info(
+                            f'Package {package_id} is a downgrade: '
+                            f'Installed {installed_version} → Older {version}'
+                        )
+                        if options.allow_downgrade:
+                            install: bool = True
+            except ET.ParseError as e:
+                logger.error(f'Failed to parse distribution file: {e}')
+            except Exception as e:
+                logger.error(f'Unexpected error: {e}')
+
+        elif package_info_file.exists():
+            logger.debug('Working from flat pkg')
+
+            try:
+                # Parse the PackageInfo XML file
+                tree = ET.parse(package_info_file)
+                root = tree.getroot()
+
+                # Extract ID and Version from attributes
+                package_id: str = root.attrib.get('identifier')
+                version: str = root.attrib.get('version')
 
                 logger.info(f'Checking package: {package_id} (Version: {version})')
 
                 # Check installed version using pkgutil
-                result: subprocess.CompletedProcess = subprocess.run(
+                result: subprocess.CompletedProcess = system.run(
                     ['/usr/sbin/pkgutil', '--pkg-info', package_id],
                     capture_output=True,
                     text=True,
                     check=False
                 )
 
-                installed_version: Optional[tuple] = None
+                installed_version = None
                 if result.returncode == 0:
                     for line in result.stdout.splitlines():
                         if line.startswith('version:'):
-                            installed_version: Optional[tuple] = version_parse(line)  # line.split(':')[1].strip()
+                            installed_version = line.split(':')[1].strip()
                             break
 
                 # Compare versions
                 if not installed_version:
                     logger.info(f'Package {package_id} is not installed.')
-                    install: bool = True
+                    install = True
                 elif version == installed_version:
                     logger.info(f'Package {package_id} is already up to date (Version: {version}).')
                 elif version > installed_version:
@@ -754,89 +2793,40 @@ def install_pkg(pkg_path: Path, unpack_path: Path):
                         f'Package {package_id} has an update available: '
                         f'Installed {installed_version} → Available {version}'
                     )
-                    install: bool = True
+                    install = True
                 elif version < installed_version:
                     logger.info(
                         f'Package {package_id} is a downgrade: '
                         f'Installed {installed_version} → Older {version}'
                     )
                     if options.allow_downgrade:
-                        install: bool = True
-        except ET.ParseError as e:
-            logger.error(f'Failed to parse distribution file: {e}')
-        except Exception as e:
-            logger.error(f'Unexpected error: {e}')
+                        install = True
 
-    elif package_info_file.exists():
-        logger.debug('Working from flat pkg')
-
-        try:
-            # Parse the PackageInfo XML file
-            tree = ET.parse(package_info_file)
-            root = tree.getroot()
-
-            # Extract ID and Version from attributes
-            package_id: str = root.attrib.get('identifier')
-            version: str = root.attrib.get('version')
-
-            logger.info(f'Checking package: {package_id} (Version: {version})')
-
-            # Check installed version using pkgutil
-            result: subprocess.CompletedProcess = subprocess.run(
-                ['/usr/sbin/pkgutil', '--pkg-info', package_id],
-                capture_output=True,
-                text=True,
-                check=False
-            )
-
-            installed_version = None
-            if result.returncode == 0:
-                for line in result.stdout.splitlines():
-                    if line.startswith('version:'):
-                        installed_version = line.split(':')[1].strip()
-                        break
-
-            # Compare versions
-            if not installed_version:
-                logger.info(f'Package {package_id} is not installed.')
-                install = True
-            elif version == installed_version:
-                logger.info(f'Package {package_id} is already up to date (Version: {version}).')
-            elif version > installed_version:
-                logger.info(
-                    f'Package {package_id} has an update available: '
-                    f'Installed {installed_version} → Available {version}'
-                )
-                install = True
-            elif version < installed_version:
-                logger.info(
-                    f'Package {package_id} is a downgrade: '
-                    f'Installed {installed_version} → Older {version}'
-                )
-                if options.allow_downgrade:
-                    install = True
-
-        except ET.ParseError as e:
-            logger.error(f'Failed to parse PackageInfo file: {e}')
-        except Exception as e:
-            logger.error(f'Unexpected error: {e}')
+            except ET.ParseError as e:
+                logger.error(f'Failed to parse PackageInfo file: {e}')
+            except Exception as e:
+                logger.error(f'Unexpected error: {e}')
 
     if install:
         logger.info('Installing package...')
 
-        try:
-            cmd: list = ['sudo', '/usr/sbin/installer', '-pkg', pkg_path.as_posix(), '-target',
-                         options.pkg_install_path.as_posix()]
-            logger.debug(' '.join(cmd))
-            result: subprocess.CompletedProcess = subprocess.run(cmd, capture_output=True, text=True)
+        with metrics.phase('install'):
+            try:
+                cmd: list = ['sudo', '/usr/sbin/installer', '-pkg', pkg_path.as_posix(), '-target',
+                             options.pkg_install_path.as_posix()]
+                logger.debug(' '.join(cmd))
+                result: subprocess.CompletedProcess = system.run(cmd, capture_output=True, text=True,
+                                                                 timeout=phase_timeout('install'))
 
-            if result.returncode == 0:
-                logger.info('Installation completed successfully.')
-            else:
-                logger.error(f'Installation failed with code {result.returncode}:\n{result.stderr}')
+                if result.returncode == 0:
+                    logger.info('Installation completed successfully.')
+                else:
+                    logger.error(f'Installation failed with code {result.returncode}:\n{result.stderr}')
 
-        except Exception as err:
-            logger.error(f'Unexpected error during installation: {err}')
+            except subprocess.TimeoutExpired as err:
+                raise PhaseTimeout('install', phase_timeout('install')) from err
+            except Exception as err:
+                logger.error(f'Unexpected error during installation: {err}')
 
 
 def version_parse(version_string: str) -> tuple:
@@ -874,13 +2864,54 @@ def version_parse(version_string: str) -> tuple:
     return tuple(parsed_version)
 
 
+@functools.lru_cache(maxsize=None)
+def create_ssl_context() -> 'ssl.SSLContext':
+    """
+    Setup ssl verification for downloads, created once and shared by every run in the process, the daemon clears
+    the cache every SSL_CONTEXT_TTL seconds to pick up changed root certificates
+    :return: SSL context with the system root certificates
+    """
+    import ssl
+
+    ssl_context: ssl.SSLContext = ssl.create_default_context()
+    ssl_context.load_verify_locations(export_system_root_certs())
+    ssl_context.load_default_certs()
+
+    return ssl_context
+
+
+def create_opener(user_agent: Optional[str] = None) -> tuple:
+    """
+    Create an url opener with redirect handling, the system root certificates and browser like headers
+    :param user_agent: User agent to send, defaults to the one in the options
+    :return: The opener and its redirect handler
+    """
+    import urllib.request
+
+    ssl_context: ssl.SSLContext = create_ssl_context()
+    redirect_handler: urllib.request.HTTPRedirectHandler = redirect_handler_class()()
+    opener: urllib.request.OpenerDirector = urllib.request.build_opener(
+        redirect_handler,
+        urllib.request.HTTPSHandler(context=ssl_context)
+    )
+    opener.addheaders = [
+        ('User-Agent', user_agent or options.user_agent),
+        ('Sec-Fetch-Site', 'none'),
+        ('Sec-Fetch-Mode', 'navigate'),
+        ('Sec-Fetch-Dest', 'document'),
+        ('Sec-Fetch-User', '?1')
+    ]  # Ensure headers are preserved
+
+    return opener, redirect_handler
+
+
 def export_system_root_certs() -> str:
     """
     Exports macOS system root certificates to a PEM file.
     :return: The path where the PEM file will be.
     """
     cert: Path = Path('/tmp/certs.ca')
-    if cert.is_file():
+    if cert.is_file() and time.time() - cert.stat().st_mtime < SSL_CONTEXT_TTL:
         return cert.as_posix()
 
     try:
@@ -898,7 +2929,7 @@ def export_system_root_certs() -> str:
 
         # Execute the command
         logger.debug(' '.join(cmd))
-        subprocess.run(
+        system.run(
             cmd,
             check=True,
             stdout=subprocess.PIPE,
@@ -906,12 +2937,594 @@ def export_system_root_certs() -> str:
             text=True
         )
 
-    except subprocess.CalledProcessError as e:
-        logger.critical(f'Error exporting certificates: {e}')
+    except (subprocess.CalledProcessError, OSError) as e:
+        # A stale export from an earlier run is still used
+        if cert.is_file():
+            logger.warning(f'Error exporting certificates, using the last export: {e}')
+        else:
+            logger.critical(f'Error exporting certificates: {e}')
 
     return cert.as_posix()
 
 
+# Fields accepted in json configs and catalog entries, with their type or allowed values, [type] is a list of type
+CONFIG_SCHEMA: dict = {
+    'name': str,
+    'tags': [str],
+    'url': str,
+    'regex': str,
+    'resolve': parse_resolve_steps,
+    'json_path': str,
+    'json_filter': parse_json_filter,
+    'json_url': str,
+    'json_url_match': str,
+    'json_version': str,
+    'json_checksum': str,
+    'json_latest': bool,
+    'appcast': bool,
+    'appcast_channels': [str],
+    'code': str,
+    'file_type': ('pkg', 'tar', 'zip', 'dmg'),
+    'pkg_install_path': Path,
+    'app_install_path': Path,
+    'allow_downgrade': bool,
+    'reinstall': bool,
+    'run': bool,
+    'user_agent': str,
+    'blocking_app': str,
+    'blocking_file': str,
+    'required_file': str,
+    'blocking_app_insensitive': bool,
+    'app_name': str,
+    'bundles': [str],
+    'priority': int,
+    'log_level': int,
+    'verbosity': int,
+    'log_file': str,
+    'log_format': ('text', 'json'),
+    'log_max_size': parse_size,
+    'log_backups': int,
+    'metrics_file': str,
+    'prometheus_file': str,
+    'history_file': str,
+    'skip_unchanged': bool,
+    'interval': int,
+    'max_rate': parse_rate,
+    'host_rate': parse_rate,
+    'host_downloads': int,
+    'start_jitter': float,
+    'max_retry_after': int,
+    'retries': int,
+    'retry_backoff': float,
+    'retry_max_delay': float,
+    'retry_statuses': [int],
+    'hedge_after': float,
+    'alternate_urls': [str],
+    'timeouts': parse_timeouts,
+    'watchdog': float,
+    'mirrors': parse_mirrors,
+    'cache_dir': str,
+    'delta': bool,
+    'blockmap_url': str,
+    'manifest_dir': str,
+    'checksum': parse_checksum,
+    'checksum_url': str,
+    'checksum_regex': str,
+    'comment': str
+}
+
+
+def compile_schema(schema: dict) -> dict:
+    """
+    Compile the schema into one converter per field, so each config is checked in a single pass
+    A converter returns the value as the expected type or raises ValueError/TypeError
+    :param schema: Field names with their type, a list holding the type of each item, or a tuple of allowed values
+    :return: Field names with their converter
+    """
+
+    def to_bool(value: Any) -> bool:
+        # Special case for booleans (since bool("False") is True)
+        if isinstance(value, str):
+            value = value.lower()
+        return value in ('true', '1', 1, 'yes')
+
+    def to_list(value: Any) -> list:
+        if isinstance(value, str):
+            return [value]
+        if not isinstance(value, list):
+            raise TypeError('expected a list')
+        return value
+
+    def to_int(value: Any) -> int:
+        if isinstance(value, bool):
+            raise TypeError('expected a number')
+        return int(value)
+
+    def to_list_of(item_converter):
+        def convert(value: Any) -> list:
+            items: list = []
+            for index, item in enumerate(to_list(value)):
+                try:
+                    items.append(item_converter(item))
+                except (ValueError, TypeError) as err:
+                    raise type(err)(f'item {index} ({item!r}): {err}') from None
+            return items
+
+        return convert
+
+    def to_choice(choices: tuple):
+        def convert(value: Any) -> str:
+            if value not in choices:
+                raise ValueError(f'expected one of {", ".join(choices)}')
+            return value
+
+        return convert
+
+    def to_type(expected_type: type):
+        def convert(value: Any) -> Any:
+            if isinstance(value, (dict, list)):
+                raise TypeError(f'expected {expected_type.__name__}')
+            return expected_type(value)
+
+        return convert
+
+    def to_converter(expected: Any):
+        if isinstance(expected, list):
+            return to_list_of(to_converter(expected[0]))
+        if isinstance(expected, tuple):
+            return to_choice(expected)
+        if expected is bool:
+            return to_bool
+        if expected is list:
+            return to_list
+        if expected is int:
+            return to_int
+        if not isinstance(expected, type):
+            return expected
+        return to_type(expected)
+
+    return {field: to_converter(expected) for field, expected in schema.items()}
+
+
+CONFIG_CONVERTERS: dict = compile_schema(CONFIG_SCHEMA)
+
+
+@functools.lru_cache(maxsize=None)
+def option_names() -> frozenset:
+    """
+    Names of the command line options, a config can set those not in CONFIG_SCHEMA as they are
+    Built once, when first needed, as building the parser on import would slow down every start
+    :return: Option names
+    """
+    return frozenset(vars(default_options()))
+
+
+def validate_config(config: Any, strict: bool = False) -> tuple:
+    """
+    Validate and type cast a json config or catalog entry
+    Unknown fields, that are not an option either, are left out with a warning, or are errors when strict
+    :param config: Parsed json
+    :param strict: Unknown fields are errors
+    :return: The type cast config, a list of errors and a list of warnings
+
+    Example:
+        >>> validate_config({'url': 'https://example.com/app.dmg', 'retry_statuses': [503, True], 'tagz': ['a']})[1:]
+        (['retry_statuses ([503, True]): item 1 (True): expected a number'], ['tagz: unknown field, did you mean tags?'])
+        >>> validate_config({'url': 'https://example.com/app.dmg', 'tagz': ['a']}, strict=True)[1:]
+        (['tagz: unknown field, did you mean tags?'], [])
+    """
+    if not isinstance(config, dict):
+        return None, [f'expected an object, got {type(config).__name__}'], []
+
+    import difflib
+
+    errors: list = []
+    warnings: list = []
+    validated: dict = {}
+    for key, value in config.items():
+        converter = CONFIG_CONVERTERS.get(key)
+        # Option names that are not in the schema are passed to the job as is
+        if converter is None and key not in option_names():
+            suggestions: list = difflib.get_close_matches(key.lower(), [*CONFIG_CONVERTERS, *option_names()], n=1)
+            (errors if strict else warnings).append(f'{key}: unknown field' +
+                                                    (f', did you mean {suggestions[0]}?' if suggestions else ''))
+            continue
+        if value is None or converter is None:
+            validated[key] = value
+            continue
+        try:
+            validated[key] = converter(value)
+        except (ValueError, TypeError) as err:
+            errors.append(f'{key} ({value!r}): {err}')
+
+    if not validated.get('url'):
+        errors.append('url is a required field')
+
+    # Accept only code or regex, not both fields, code takes precedence
+    if validated.get('regex') and validated.get('code'):
+        validated['regex'] = None
+
+    return validated, errors, warnings
+
+
+def load_configs(config_files: list, strict: bool = False, strict_fields: bool = False) -> tuple:
+    """
+    Load and validate configs from json files and catalogs before anything runs
+    A file holding an object is a single config, a json array or a json lines file is a catalog of configs
+    :param config_files: Paths of the .json/.jsonl files
+    :param strict: Fail on any invalid entry rather than skipping it
+    :param strict_fields: Unknown fields make an entry invalid, rather than being logged and left out
+    :return: List of (title, config) and a list of errors
+    """
+    configs: list = []
+    errors: list = []
+
+    for config_file in config_files:
+        logger.debug(f'Loading file {config_file}')
+        try:
+            text: str = Path(config_file).read_text()
+        except OSError as err:
+            errors.append(f'{config_file}: {err}')
+            continue
+
+        try:
+            if config_file.suffix == '.jsonl':
+                entries: list = [json.loads(line) for line in text.splitlines() if line.strip()]
+            else:
+                entries: Any = json.loads(text)
+        except json.decoder.JSONDecodeError as err:
+            errors.append(f'{config_file}: error reading json file {err}')
+            continue
+
+        is_catalog: bool = isinstance(entries, list)
+        for index, entry in enumerate(entries if is_catalog else [entries]):
+            source: str = f'{config_file}[{index}]' if is_catalog else f'{config_file}'
+            config, config_errors, config_warnings = validate_config(entry, strict_fields)
+            errors.extend(f'{source}: {error}' for error in config_errors)
+            for warning in config_warnings:
+                logger.warning(f'Left out of {source}: {warning}')
+            if config_errors:
+                continue
+
+            title: str = str(config['name']) if config.get('name') else \
+                (get_filename(config['url']) if is_catalog else config_file.stem)
+            configs.append((title, config))
+
+    if strict and errors:
+        return [], errors
+
+    return configs, errors
+
+
+def select_configs(configs: list, names: Optional[list] = None, tags: Optional[list] = None) -> list:
+    """
+    Select configs by name (shell style patterns, any case) or tag
+    :param configs: List of (title, config)
+    :param names: Names or patterns to select
+    :param tags: Tags to select
+    :return: Selected list of (title, config)
+    """
+    import fnmatch
+
+    if not names and not tags:
+        return configs
+
+    selected: list = []
+    for title, config in configs:
+        by_name: bool = any(fnmatch.fnmatch(title.lower(), name.lower()) for name in names or [])
+        by_tag: bool = bool(set(tags or []).intersection(config.get('tags') or []))
+        if by_name or by_tag:
+            selected.append((title, config))
+
+    return selected
+
+
+def order_configs(configs: list, predictions: dict, order: str = 'predicted', workers: int = 1) -> list:
+    """
+    Order the configs of a batch, the highest priority first and then
+    predicted: longest first with several workers, so a long download does not start last and stretch the batch,
+    shortest first with one, so the quick no-op checks are done before the long downloads
+    name: by name
+    :param configs: List of (title, config)
+    :param predictions: Predicted seconds of each config, configs without one are taken as the average
+    :param order: predicted or name
+    :param workers: Configs run at the same time
+    :return: Ordered list of (title, config)
+    """
+    if order == 'name' or not predictions:
+        return sorted(configs, key=lambda item: (-item[1].get('priority', 0), item[0]))
+
+    average: float = sum(predictions.values()) / len(predictions)
+    direction: int = -1 if workers > 1 else 1
+    return sorted(configs, key=lambda item: (-item[1].get('priority', 0),
+                                             direction * predictions.get(item[0], average), item[0]))
+
+
+def batch_time(durations: list, workers: int = 1) -> float:
+    """
+    Get how long a batch takes when each config goes to the next free worker, in order
+    :param durations: Seconds of each config, in the order they are run
+    :param workers: Configs run at the same time
+    :return: Seconds until the last config ends
+    """
+    import heapq
+
+    free_at: list = [0.0] * max(workers, 1)
+    for seconds in durations:
+        heapq.heappush(free_at, heapq.heappop(free_at) + seconds)
+    return max(free_at)
+
+
+def write_metrics(run_metrics: RunMetrics, metrics_file: Path) -> None:
+    """
+    Append the metrics of a run to a json lines file
+    :param run_metrics: Metrics of the completed run
+    :param metrics_file: Path to the json lines file
+    """
+    try:
+        with open(metrics_file, 'a') as file:
+            file.write(json.dumps(run_metrics.as_dict(), default=str) + '\n')
+    except OSError as err:
+        logger.error(f'Unable to write metrics to {metrics_file}: {err}')
+
+
+def report_metrics(run_metrics: RunMetrics, reported_metrics: dict) -> None:
+    """
+    Output the metrics of a completed run to the configured destinations
+    :param run_metrics: Metrics of the completed run
+    :param reported_metrics: Latest metrics of each config in the batch, updated in place
+    """
+    logger.debug(f'Metrics: {run_metrics.as_dict()}')
+    reported_metrics[run_metrics.name] = run_metrics
+
+    if options.metrics_file is not None:
+        write_metrics(run_metrics, Path(options.metrics_file))
+    if options.prometheus_file is not None:
+        from install_from_web_report import write_prometheus
+        write_prometheus(list(reported_metrics.values()), Path(options.prometheus_file))
+    if options.history_file is not None:
+        from install_from_web_report import RunHistory
+        try:
+            RunHistory(Path(options.history_file)).record(run_metrics)
+        except Exception as err:
+            logger.error(f'Unable to record the run in {options.history_file}: {err}')
+
+
+def run_config(title: str, reported_metrics: dict) -> int:
+    """
+    Run the installer for the current options, recording metrics and profiling if requested
+    :param title: Name of the config
+    :param reported_metrics: Latest metrics of each config in the batch
+    :return: Exit code of the run
+    """
+    run_metrics: RunMetrics = RunMetrics(title)
+    metrics.set(run_metrics)
+    watchdog = Watchdog(run_metrics, system.get(), options.watchdog) if options.watchdog else contextlib.nullcontext()
+
+    try:
+        with watchdog:
+            if options.profile_dir is None:
+                return_code: int = main()
+            else:
+                from install_from_web_report import profile_run
+                with profile_run(title, Path(options.profile_dir), options.profile_subprocesses):
+                    return_code: int = main()
+    except Exception as err:
+        logger.critical(f'Install {title} failed: {err}', exc_info=logger.isEnabledFor(logging.DEBUG))
+        return_code: int = 1
+        if timed_out(err) and 'timeout' not in run_metrics.counters:
+            run_metrics.count('timeout', getattr(err, 'phase', None) or run_metrics.last_phase)
+
+    # A run that hit a timeout, or whose processes the watchdog killed, exits with the timeout code
+    if 'timeout' in run_metrics.counters:
+        return_code = TIMEOUT_CODE
+
+    run_metrics.finish(return_code)
+    report_metrics(run_metrics, reported_metrics)
+    return return_code
+
+
+class UpdateJob:
+    """
+    An install or update of one app, a config merged into the default options, to run with a Runner
+    """
+
+    def __init__(self, name: str, job_options: argparse.Namespace, job_system: Optional[System] = None) -> None:
+        """
+        Initialise the job
+        name: (str) Name of the job, used in the metrics and history
+        job_options: (argparse.Namespace) Options of the job
+        job_system: (System) Layers the job reaches the outside world through, the real ones by default
+        """
+        self.name: str = name
+        self.options: argparse.Namespace = job_options
+        self.system: System = job_system or System()
+
+    @classmethod
+    def from_config(cls, config: dict, defaults: Optional[dict] = None,
+                    job_system: Optional[System] = None) -> 'UpdateJob':
+        """
+        Create a job from a config, validated and merged into the command line defaults
+        :param config: Config as in a .json file or catalog entry
+        :param defaults: Options to merge the config into instead of the command line defaults
+        :param job_system: Layers the job reaches the outside world through
+        :return: The job
+
+        Example, not run as a doctest as it installs the app:
+            job = UpdateJob.from_config({'url': 'https://iterm2.com/downloads/stable/latest', 'app_name': 'iTerm.app'})
+            Runner().run(job)  # 0 when installed or current
+        """
+        # Unknown fields are errors, there is no log to warn in before the job runs
+        validated, errors, _ = validate_config(config, strict=True)
+        if errors:
+            raise ValueError(f'invalid config: {"; ".join(errors)}')
+
+        name: str = str(validated.get('name') or get_filename(validated['url']) or urlparse(validated['url']).netloc)
+        job_options: argparse.Namespace = argparse.Namespace(**{**vars(default_options()), **(defaults or {}),
+                                                                **validated})
+        return cls(name, job_options, job_system)
+
+
+class Runner:
+    """
+    Run jobs, each in its own context with its own options, logger, metrics and cleanups, so jobs can run at the
+    same time on threads. Bandwidth limits are shared by every job in the process
+    """
+
+    def __init__(self, workers: int = 1, reported_metrics: Optional[dict] = None) -> None:
+        """
+        Initialise the runner
+        workers: (int) Jobs to run at the same time in run_all
+        reported_metrics: (dict) Latest metrics of each job, shared with the caller
+        """
+        self.workers: int = workers
+        self.reported_metrics: dict = {} if reported_metrics is None else reported_metrics
+        self.results: dict = {}
+
+    def run(self, job: UpdateJob) -> int:
+        """
+        Run a job on the current thread, its metrics are kept in results
+        :param job: Job to run
+        :return: Exit code of the job
+        """
+        return contextvars.copy_context().run(self.run_in_context, job)
+
+    def run_in_context(self, job: UpdateJob) -> int:
+        """
+        Run a job in the current context, which it takes over
+        :param job: Job to run
+        :return: Exit code of the job
+        """
+        options.set(job.options)
+        system.set(job.system)
+        logger.set(create_logger() if self.workers <= 1 else create_logger(f'install_from_web.{job.name}'))
+        if logger.isEnabledFor(logging.DEBUG):
+            import pprint
+            logger.debug(pprint.pformat(job.options))
+
+        with contextlib.ExitStack() as cleanup:
+            job_cleanup.set(cleanup)
+            return_code: int = run_config(job.name, self.reported_metrics)
+        self.results[job.name] = metrics.get()
+
+        return return_code
+
+    def run_all(self, jobs: list) -> list:
+        """
+        Run jobs, up to workers at a time
+        :param jobs: List of UpdateJob
+        :return: Exit code of each job, in the order of the jobs
+        """
+        if self.workers <= 1:
+            return [self.run(job) for job in jobs]
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job') as executor:
+            return list(executor.map(self.run, jobs))
+
+
+def version_from_url(url: str) -> Optional[str]:
+    """
+    Guess the version from the file name of a download url
+    :param url: Download url
+    :return: The version, or None if there is no version in the file name
+
+    Example:
+        >>> version_from_url('https://iterm2.com/downloads/stable/iTerm2-3_5_14.zip')
+        '3.5.14'
+    """
+    file_name: str = get_filename(url)
+    matches: Optional[re.Match] = re.search(r'\d+(?:\.\d+)+', file_name) or re.search(r'\d+(?:_\d+)+', file_name)
+
+    return matches.group().replace('_', '.') if matches else None
+
+
+def installed_app_version(config_options: argparse.Namespace) -> Optional[str]:
+    """
+    Get the installed version of the app a config installs, from app_name or a blocking_app ending in .app
+    :param config_options: Options of the config
+    :return: The installed version, or None if unknown or not installed
+    """
+    app_name: Optional[str] = getattr(config_options, 'app_name', None)
+    if not app_name and (config_options.blocking_app or '').endswith('.app'):
+        app_name = config_options.blocking_app
+    if not app_name:
+        return None
+
+    app_path: Path = Path(config_options.app_install_path).joinpath(app_name)
+    if not app_path.joinpath('Contents', 'Info.plist').exists():
+        return None
+
+    return get_app_version(app_path)
+
+
+def head_request(opener: 'urllib.request.OpenerDirector', url: str, user_agent: str) -> dict:
+    """
+    Get the headers of a download without downloading it, with the connect and read timeouts of any request
+    Servers that refuse HEAD are asked for the first byte instead
+    :param opener: Opener to request with
+    :param url: Download url
+    :param user_agent: User agent to send
+    :return: Final url, size, etag and last modified of the download
+    """
+    import urllib.error
+    import urllib.request
+
+    def head(head_opener: urllib.request.OpenerDirector) -> dict:
+        req: urllib.request.Request = urllib.request.Request(url, method='HEAD')
+        req.add_header('User-Agent', user_agent)
+        try:
+            with open_request(head_opener, req) as response:
+                size: Optional[str] = response.headers.get('Content-Length')
+                final_url: str = response.geturl()
+                headers = response.headers
+        except urllib.error.HTTPError as err:
+            if err.code not in (403, 405, 501):
+                raise
+            req: urllib.request.Request = urllib.request.Request(url)
+            req.add_header('User-Agent', user_agent)
+            req.add_header('Range', 'bytes=0-0')
+            with open_request(head_opener, req) as response:
+                size: Optional[str] = (response.headers.get('Content-Range') or '/').split('/')[-1] or None
+                final_url: str = response.geturl()
+                headers = response.headers
+
+        return {
+            'url': final_url,
+            'size': int(size) if size and size.isdigit() else None,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified')
+        }
+
+    return retry_call(lambda: hedged_call(head, opener, f'HEAD {url}'), f'HEAD {url}')
+
+
+@functools.lru_cache(maxsize=None)
+def log_writer(log_file: Optional[str], log_format: str, max_bytes: int, backups: int) -> LogWriter:
+    """
+    Get the writer of the process for a log file, built once and shared by every logger writing to it
+    Handlers are built directly rather than with logging.config, which pulls in sockets, pickle and queues
+    :param log_file: Log file, or None for stderr only
+    :param log_format: Format of the log file, text or json (lines)
+    :param max_bytes: Size the log file is rotated at
+    :param backups: Rotated log files kept
+    :return: The writer
+    """
+    stderr_handler: logging.StreamHandler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setFormatter(ColourFormat(style='{', fmt='{message}'))
+    if log_file is None:
+        return LogWriter(stderr_handler)
+
+    from logging.handlers import RotatingFileHandler
+
+    file_handler: RotatingFileHandler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups,
+                                                            encoding='utf-8')
+    file_handler.setFormatter(JsonFormat() if log_format == 'json' else
+                              logging.Formatter(style='{', fmt='[{asctime}] [{levelname:8}] {message}'))
+    return LogWriter(stderr_handler, file_handler)
+
+
 def create_logger(name: str = __file__, levels: dict = {}) -> logging.Logger:
     # Create log level
     def make_log_level(level_name: str, level_int: int) -> None:
@@ -920,48 +3533,19 @@ def create_logger(name: str = __file__, levels: dict = {}) -> logging.Logger:
 
     new_logger = logging.getLogger(name)
 
-    logging_config: dict = {
-        'version': 1,
-        'disable_existing_loggers': True,
-        'formatters': {
-            'stderr': {
-                '()': ColourFormat,
-                'style': '{', 'format': '{message}',
-            },
-            'file': {
-                'style': '{', 'format': '[{asctime}] [{levelname:8}] {message}'
-            }
-        },
-        'handlers': {
-            'stderr': {
-                'class': 'logging.StreamHandler',
-                'formatter': 'stderr',
-                'stream': 'ext://sys.stderr',
-            },
-            'file': {
-                'class': 'logging.handlers.RotatingFileHandler',
-                'formatter': 'file',
-                'filename': options.log_file if options.log_file else '/dev/null',
-                'maxBytes': 1024 * 5
-                ,
-                'backupCount': 0
-
-            }
-        },
-        'loggers': {
-            name: {
-                'level': max(((5 - (options.verbosity if options.verbosity >= 0 else options.log_level)) * 10, 0)),
-                'handlers': [
-                    'stderr'
-                ]
-            }
-        }
-    }
-
-    if options.log_file is not None:
-        logging_config['loggers'][name]['handlers'].append('file')
+    # Only change the logger when the settings change, so a batch sets up logging once
+    level: int = max(((5 - (options.verbosity if options.verbosity >= 0 else options.log_level)) * 10, 0))
+    settings: tuple = (level, options.log_file and Path(options.log_file).as_posix(),
+                       options.log_format, options.log_max_size, options.log_backups)
+    if getattr(new_logger, 'settings', None) == settings:
+        return new_logger
+    new_logger.settings = settings
+    new_logger.setLevel(level)
 
-    logging.config.dictConfig(logging_config)
+    # Replace the writer of a previous config, writers are shared by the loggers of the process and left open
+    for handler in list(new_logger.handlers):
+        new_logger.removeHandler(handler)
+    new_logger.addHandler(log_writer(*settings[1:]))
 
     # Create custom levels
     for level in levels.items():
@@ -970,7 +3554,13 @@ def create_logger(name: str = __file__, levels: dict = {}) -> logging.Logger:
     return new_logger
 
 
-if __name__ == '__main__':
+@functools.lru_cache(maxsize=None)
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create the command line parser, its defaults are the defaults of every job
+    :return: The parser
+    """
+
     def valid_path(path):
         parent: Path = Path(path).parent
         if not parent.is_dir():
@@ -981,7 +3571,6 @@ if __name__ == '__main__':
             raise argparse.ArgumentTypeError(f'{path} is an invalid path')
         return Path(path)
 
-
     def parser_formatter(format_class, **kwargs):
         """
         Use a raw parser to use line breaks, etc
@@ -994,24 +3583,6 @@ if __name__ == '__main__':
         except TypeError:
             return format_class
 
-
-    # Detect if running as a PyInstaller bundled executable
-    if getattr(sys, 'frozen', False):
-        # Running as a PyInstaller bundled executable
-        executable_directory: Path = Path(sys.executable).parent
-        json_files: list = list(executable_directory.glob('*.json'))
-        base_path: Path = Path(sys._MEIPASS)
-        json_files.extend(list(base_path.glob('*.json')))
-
-    else:
-        # Running as a normal Python script
-        executable_directory: Path = Path(__file__).parent
-        json_files: list = list(executable_directory.glob('*.json'))
-
-    # When in an app, check the resources folder
-    if executable_directory.parent.joinpath('Resources').is_dir():
-        json_files.extend(list(executable_directory.parent.joinpath('Resources').glob('*.json')))
-
     # Create argument parser
     parser: argparse.ArgumentParser = argparse.ArgumentParser(
         description=__description__,
@@ -1025,9 +3596,13 @@ if __name__ == '__main__':
             '\t2. Nothing to install\n'
             '\t3. Invalid url\n'
             '\t4. Download error\n'
+            '\t6. Checksum mismatch\n'
             '\t7. Could not identify file type\n'
             '\t8. could not unpack archive\n'
             '\t9. errors in one or one runs\n'
+            '\t10. Invalid catalog\n'
+            '\t11. Timed out\n'
+            '\t12. App does not match its manifest\n'
         ),
         formatter_class=parser_formatter(argparse.RawTextHelpFormatter,
                                          indent_increment=4, max_help_position=12,
@@ -1037,9 +3612,34 @@ if __name__ == '__main__':
     basics_group = parser.add_argument_group('basic options')
     basics_group.add_argument('-u', '--url',
                               action='store', dest='url',
-                              required=len(json_files) == 0,
                               help='url to page/download')
 
+    # Use a catalog
+    catalog_group = parser.add_argument_group('catalog')
+    catalog_group.add_argument('--catalog', type=Path, default=None,
+                               action='store', dest='catalog',
+                               help='load all configs from one file, a json array or json lines (.jsonl)\n'
+                                    'every entry is validated before anything runs, used instead of the .json files')
+    catalog_group.add_argument('--strict', default=False,
+                               action='store_true', dest='strict',
+                               help='unknown fields make a config invalid, instead of being left out with a warning')
+    catalog_group.add_argument('--select', default=None,
+                               action='append', dest='select_names',
+                               help='only run configs with this name, patterns allowed, repeatable\n'
+                                    'Example: "JetBrains*"')
+    catalog_group.add_argument('--tag', default=None,
+                               action='append', dest='select_tags',
+                               help='only run configs with this tag, repeatable')
+    catalog_group.add_argument('--workers', type=int, default=1,
+                               action='store', dest='workers',
+                               help='configs to run at the same time\n'
+                                    'default: 1')
+    catalog_group.add_argument('--order', default='predicted', choices=('predicted', 'name'),
+                               action='store', dest='order',
+                               help='order of the configs after their priority, predicted uses the --history: '
+                                    'longest first with workers, shortest (no-op checks) first without\n'
+                                    'default: predicted')
+
     # Use a regex
     url_parser_group = basics_group.add_mutually_exclusive_group()
     url_parser_group.add_argument('-r', '--regex', default=None,
@@ -1048,6 +3648,13 @@ if __name__ == '__main__':
     url_parser_group.add_argument('-c', '--code', default=None,
                                   action='store', dest='code',
                                   help='pipe the html from --url into this code (optional)')
+    url_parser_group.add_argument('--resolve', type=json.loads, default=None,
+                                  action='store', dest='resolve',
+                                  help='json list of resolver steps run on the html from --url (optional)\n'
+                                       'Example: \'[{"find_all": "href=\\"([^\\"]+\\\\.dmg)"}, {"pick": "last"}]\'')
+    basics_group.add_argument('--resolver-plugin', type=Path, default=None,
+                              action='append', dest='resolver_plugins',
+                              help='python file registering more resolver steps with @resolver_step(name), repeatable')
 
     # Specify type to ensure proper run
     types_group = parser.add_argument_group('install type')
@@ -1078,6 +3685,11 @@ if __name__ == '__main__':
     dest_group.add_argument('--app-path', type=valid_path, default=Path('/Applications'),
                             action='store', dest='app_install_path',
                             help='specify the app install location \ndefault: /Applications')
+    dest_group.add_argument('--bundle', default=None, metavar='PATTERN',
+                            action='append', dest='bundles',
+                            help='install every app matching this name or glob, not just the first app found, '
+                                 'repeatable, "*" for all\n'
+                                 'Example: --bundle "Microsoft Word" --bundle "Microsoft Excel.app"')
 
     extended_group = parser.add_argument_group('extended options')
     # Allow downgrading
@@ -1101,6 +3713,171 @@ if __name__ == '__main__':
                                 action='store', dest='user_agent',
                                 help='custom user agent string')
 
+    # Bandwidth
+    bandwidth_group = parser.add_argument_group('bandwidth')
+    bandwidth_group.add_argument('--max-rate', type=parse_rate, default=None,
+                                 action='store', dest='max_rate',
+                                 help='limit all downloads in the process to this many bytes per second\n'
+                                      'Example: 500K, 10M')
+    bandwidth_group.add_argument('--host-rate', type=parse_rate, default=None,
+                                 action='store', dest='host_rate',
+                                 help='limit the downloads from each host to this many bytes per second')
+    bandwidth_group.add_argument('--host-downloads', type=int, default=None,
+                                 action='store', dest='host_downloads',
+                                 help='limit the number of concurrent downloads from each host')
+    bandwidth_group.add_argument('--start-jitter', type=float, default=0,
+                                 action='store', dest='start_jitter',
+                                 help='wait a random number of seconds, up to this, before downloading')
+    bandwidth_group.add_argument('--max-retry-after', type=int, default=300,
+                                 action='store', dest='max_retry_after',
+                                 help='longest Retry-After in seconds to wait for on a 429/503 before giving up\n'
+                                      'default: 300')
+
+    # Retries
+    retry_group = parser.add_argument_group('retries')
+    retry_group.add_argument('--retries', type=int, default=0,
+                             action='store', dest='retries',
+                             help='times to try a request again on a timeout, dropped connection or retryable status\n'
+                                  'default: 0')
+    retry_group.add_argument('--retry-backoff', type=float, default=1.0,
+                             action='store', dest='retry_backoff',
+                             help='seconds to back off after the first failure, doubled each attempt with full jitter\n'
+                                  'default: 1')
+    retry_group.add_argument('--retry-max-delay', type=float, default=30.0,
+                             action='store', dest='retry_max_delay',
+                             help='longest backoff in seconds between attempts\n'
+                                  'default: 30')
+    retry_group.add_argument('--retry-status', type=int, default=None,
+                             action='append', dest='retry_statuses',
+                             help='http status to retry, repeatable\n'
+                                  f'default: {" ".join(map(str, RETRY_STATUSES))}')
+    retry_group.add_argument('--hedge-after', type=float, default=None,
+                             action='store', dest='hedge_after',
+                             help='send a page or HEAD request again if it takes longer than this many seconds, '
+                                  'using whichever answers first')
+    retry_group.add_argument('--alternate-url', default=None,
+                             action='append', dest='alternate_urls',
+                             help='another url for the same download or page, tried when --url fails, repeatable')
+
+    # Timeouts
+    timeout_group = parser.add_argument_group('timeouts')
+    timeout_group.add_argument('--timeout', type=parse_timeout, default=None, metavar='PHASE=SECONDS',
+                               action='append', dest='timeouts',
+                               help='timeout of a phase, 0 for none, repeatable\n'
+                                    'connect and read (the longest wait for data) are per request, '
+                                    'download is every attempt\n'
+                                    'mount, expand, install and copy are the hdiutil, pkgutil, installer and copy '
+                                    'commands\n'
+                                    f'default: {" ".join(f"{phase}={seconds}" for phase, seconds in PHASE_TIMEOUTS.items())}')
+    timeout_group.add_argument('--watchdog', type=float, default=3600,
+                               action='store', dest='watchdog',
+                               help='seconds a phase without a timeout may run, a phase well past its limit has its '
+                                    'processes killed and is then stopped, 0 turns the watchdog off\n'
+                                    'default: 3600')
+
+    # Json release feeds
+    json_group = parser.add_argument_group('json release feed')
+    json_group.add_argument('--json-path', default=None,
+                            action='store', dest='json_path',
+                            help='read --url as a json release feed, streaming the releases at this path\n'
+                                 'Example: "PCP[*]", "[*]"')
+    json_group.add_argument('--json-filter', nargs=2, metavar=('FIELD', 'REGEX'), default=None,
+                            action='append', dest='json_filter',
+                            help='only use releases where the regex matches the field, repeatable\n'
+                                 'Example: --json-filter type release')
+    json_group.add_argument('--json-url', default=None,
+                            action='store', dest='json_url',
+                            help='field of the release with the download url, or a template of {field}\n'
+                                 'default: url')
+    json_group.add_argument('--json-url-match', default=None,
+                            action='store', dest='json_url_match',
+                            help='regex picking the download url when the field has more than one')
+    json_group.add_argument('--json-version', default=None,
+                            action='store', dest='json_version',
+                            help='field of the release with the version, skips the download when it is installed\n'
+                                 'default: version')
+    json_group.add_argument('--json-checksum', default=None,
+                            action='store', dest='json_checksum',
+                            help='field of the release with the checksum, or the url of a checksum file')
+    json_group.add_argument('--json-latest', default=False,
+                            action='store_true', dest='json_latest',
+                            help='use the release with the highest version, not the first that matches')
+
+    # Sparkle appcasts
+    appcast_group = parser.add_argument_group('appcast')
+    appcast_group.add_argument('--appcast', default=False,
+                               action='store_true', dest='appcast',
+                               help='read --url as a Sparkle appcast and use its newest item for this macOS\n'
+                                    'skips the download when the installed app is already that version')
+    appcast_group.add_argument('--appcast-channel', default=None,
+                               action='append', dest='appcast_channels',
+                               help='also use items in this Sparkle channel, repeatable\n'
+                                    'Example: beta')
+
+    # Checksums
+    checksum_group = parser.add_argument_group('checksum')
+    checksum_group.add_argument('--checksum', type=parse_checksum, default=None,
+                                action='store', dest='checksum',
+                                help='expected sha256 or sha512 hex digest of the download, checked as it downloads\n'
+                                     'Example: sha256:e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855')
+    checksum_group.add_argument('--checksum-url', default=None,
+                                action='store', dest='checksum_url',
+                                help='vendor checksum file to find the digest in, {url} is replaced by the download url\n'
+                                     'Example: "{url}.sha256"')
+    checksum_group.add_argument('--checksum-regex', default=None,
+                                action='store', dest='checksum_regex',
+                                help='regex to find the digest in the checksum file, group 1 if there is one\n'
+                                     'default: the digest on the line naming the download')
+
+    # Mirrors and cache
+    mirror_group = parser.add_argument_group('mirrors/cache')
+    mirror_group.add_argument('--mirror', nargs=2, metavar=('MATCH', 'REPLACE'), default=None,
+                              action='append', dest='mirrors',
+                              help='try the download url rewritten by this regex first, falls back to the url\n'
+                                   'Example: --mirror "^https?://" "http://mirror.lan:8080/"')
+    mirror_group.add_argument('--cache-dir', default=None,
+                              action='store', dest='cache_dir',
+                              help='keep downloads here and only download again when they change')
+    mirror_group.add_argument('--serve', default=None, metavar='[HOST:]PORT',
+                              action='store', dest='serve',
+                              help='serve --cache-dir as a caching mirror for other machines, from the --serve-allow hosts')
+    mirror_group.add_argument('--serve-allow', default=None, metavar='HOST',
+                              action='append', dest='serve_allow',
+                              help='host the mirror fetches downloads from, shell style patterns, repeatable\n'
+                                   'Example: "*.apple.com"')
+    mirror_group.add_argument('--serve-max-age', type=int, default=3600,
+                              action='store', dest='serve_max_age',
+                              help='seconds before the mirror checks the origin for a newer download\n'
+                                   'default: 3600')
+    mirror_group.add_argument('--delta', default=False,
+                              action='store_true', dest='delta',
+                              help='with --cache-dir, rebuild a download from the older release in the cache,\n'
+                                   'fetching only the blocks that changed, needs a block map from --blockmap-url '
+                                   'or a --serve mirror')
+    mirror_group.add_argument('--blockmap-url', default=None,
+                              action='store', dest='blockmap_url',
+                              help='url of the block map of the download, {url} is replaced with the download url\n'
+                                   'Example: "{url}.blockmap.json"')
+    mirror_group.add_argument('--make-blockmap', type=Path, default=None, metavar='FILE',
+                              action='store', dest='make_blockmap',
+                              help='write the block map of a file to FILE.blockmap.json, to publish with it, and exit')
+
+    # Manifests of installed apps
+    manifest_group = parser.add_argument_group('manifests')
+    manifest_group.add_argument('--manifest-dir', default=None,
+                                action='store', dest='manifest_dir',
+                                help='keep a manifest of each app installed in this folder, the size, mode, mtime '
+                                     'and hash of every file in the app')
+    verify_group = manifest_group.add_mutually_exclusive_group()
+    verify_group.add_argument('--verify', default=False,
+                              action='store_true', dest='verify',
+                              help='check the installed app against its manifest and report drift, nothing is '
+                                   'downloaded, only files whose stat changed are hashed')
+    verify_group.add_argument('--repair', default=False,
+                              action='store_true', dest='repair',
+                              help='as --verify, and copy the missing and changed files again from the cached download '
+                                   '(--cache-dir) the app was installed from')
+
     # blocking app/file
     extended_group.add_argument('-b', '--blocking-app', default=None,
                                 action='store', dest='blocking_app',
@@ -1136,110 +3913,255 @@ if __name__ == '__main__':
     logging_group.add_argument('--log', type=valid_path,
                                default=None,
                                action='store', dest='log_file',
-                               help='output log')
+                               help='output log, rotated at --log-max-size')
+    logging_group.add_argument('--log-format', default='text', choices=('text', 'json'),
+                               action='store', dest='log_format',
+                               help='format of the output log, json lines have the config and phase of each message\n'
+                                    'default: text')
+    logging_group.add_argument('--log-max-size', type=parse_size, default=LOG_MAX_SIZE,
+                               action='store', dest='log_max_size',
+                               help='size the output log is rotated at, with an optional K, M or G suffix\n'
+                                    'default: 10M')
+    logging_group.add_argument('--log-backups', type=int, default=LOG_BACKUPS,
+                               action='store', dest='log_backups',
+                               help='rotated output logs kept\n'
+                                    'default: 5')
+
+    # Metrics
+    logging_group.add_argument('--metrics', type=valid_path,
+                               default=None,
+                               action='store', dest='metrics_file',
+                               help='append per-phase timings and results of each run as json lines')
+    logging_group.add_argument('--prometheus', type=valid_path,
+                               default=None,
+                               action='store', dest='prometheus_file',
+                               help='write the metrics of the latest runs for the node exporter textfile collector\n'
+                                    'Example: /usr/local/var/node_exporter/install_from_web.prom')
+
+    # History
+    history_group = parser.add_argument_group('history')
+    history_group.add_argument('--history', type=valid_path,
+                               default=None,
+                               action='store', dest='history_file',
+                               help='record every run in this SQLite database\n'
+                                    'Example: /Library/Application Support/install_from_web/history.db')
+    history_group.add_argument('--skip-unchanged', default=False,
+                               action='store_true', dest='skip_unchanged',
+                               help='with --history, skip the download when the server reports the same download '
+                                    'as the last successful run')
+    history_group.add_argument('--history-report', default=None,
+                               choices=('runs', 'slowest', 'failures'),
+                               action='store', dest='history_report',
+                               help='print a report from --history and exit\n'
+                                    'runs: the latest runs, slowest: average time per download host, '
+                                    'failures: configs failing since their last success')
+    history_group.add_argument('--history-limit', type=int, default=20,
+                               action='store', dest='history_limit',
+                               help='most rows in a history report\ndefault: 20')
+
+    # Plan
+    extended_group.add_argument('--plan', default=False,
+                                action='store_true', dest='plan',
+                                help='check every config concurrently and print what would be installed or updated\n'
+                                     'nothing is downloaded or installed, set "app_name" in a config to compare versions')
+
+    # Daemon
+    daemon_group = parser.add_argument_group('daemon')
+    daemon_group.add_argument('--daemon', default=False,
+                              action='store_true', dest='daemon',
+                              help='stay resident and run each config on its interval, stop with SIGTERM')
+    daemon_group.add_argument('--interval', type=int, default=3600,
+                              action='store', dest='interval',
+                              help='seconds between runs of a config, "interval" in a config overrides it\n'
+                                   'default: 3600')
+    daemon_group.add_argument('--jitter', type=float, default=0.1,
+                              action='store', dest='jitter',
+                              help='fraction of the interval to randomise each run by\ndefault: 0.1')
+    daemon_group.add_argument('--max-backoff', type=int, default=86400,
+                              action='store', dest='max_backoff',
+                              help='failures double the interval, up to this many seconds\ndefault: 86400')
+    daemon_group.add_argument('--status-port', type=int, default=None,
+                              action='store', dest='status_port',
+                              help='serve the schedule and last results as json on 127.0.0.1:PORT')
+
+    # Profiling
+    profiling_group = parser.add_argument_group('profiling')
+    profiling_group.add_argument('--profile', type=Path,
+                                 default=None,
+                                 action='store', dest='profile_dir',
+                                 help='profile each run with cProfile and tracemalloc\n'
+                                      'writes <config>.pstats and a <config>.txt report to this directory, not with --workers')
+    profiling_group.add_argument('--profile-subprocesses', default=False,
+                                 action='store_true', dest='profile_subprocesses',
+                                 help='with --profile, report the time spent waiting on each external tool\n'
+                                      'Example: hdiutil, pkgutil, installer, ditto')
 
     # Hidden tests and experiments
     parser.add_argument('--copy-method', default='ditto',
                         choices=('shutil', 'ditto', 'cp', 'rsync'),
                         action='store', dest='copy_method',
                         help=argparse.SUPPRESS)
+    parser.add_argument('--decompressor', default='auto',
+                        action='store', dest='decompressor',
+                        help=argparse.SUPPRESS)
 
-    options = parser.parse_args()
-    base_options: argparse.Namespace = argparse.Namespace(**vars(options))
+    return parser
 
-    logger = create_logger()
-    logger.debug('Debug ON')
-    logger.debug(pprint.pformat(options))
 
-    # Override settings with json files
-    if len(json_files) > 0:
-        logger.debug(f'{len(json_files)} file(s) to process')
-        json_files.sort()
-        exit_code = 0
-        # Iterate through each JSON file and load it
-        for json_file in json_files:
-            logger.info(80 * '-')
-
-            # Load json file
-            logger.info(f'Loading file {json_file}')
-            try:
-                with open(json_file, 'r') as f:
-                    json_data = json.load(f)
-            except json.decoder.JSONDecodeError as err:
-                logger.critical(f'Error reading json file {err}')
-                continue
-            except PermissionError as err:
-                logger.critical(f'{err}')
-                continue
+def default_options() -> argparse.Namespace:
+    """
+    Get the default options of a job, as the command line gives them without arguments
+    :return: The options
+    """
+    return create_parser().parse_args([])
 
-            # Validate/parse fields
-            if json_data['url'] is None:
-                logger.critical(f'url is a required field in {json_file.stem}')
-                continue
 
-            # Accept only code or regex, not both fields
-            if 'regex' in json_data and 'code' in json_data:
-                json['regex'] = None
-
-            json_types = {
-                'name': str,
-                'url': str,
-                'regex': str,
-                'file_type': str,
-                'pkg_install_path': Path,
-                'app_install_path': Path,
-                'allow_downgrade': bool,
-                'reinstall': bool,
-                'run': bool,
-                'user_agent': str,
-                'blocking_app': str,
-                'blocking_file': str,
-                'blocking_app_insensitive': str,
-                'log_level': int,
-                'verbosity': int,
-                'log_file': str
-            }
-
-            # Correcting types in json_data (type casting)
-            for key, value in json_data.items():
-                if value is None:
-                    continue
-                expected_type = json_types.get(key)
-                if expected_type:
-                    try:
-                        # Special case for booleans (since bool("False") is True)
-                        if expected_type is bool:
-                            if isinstance(value, str):
-                                value = value.lower()
-                            json_data[key] = value in ('true', '1', 1, 'yes')
-                        else:
-                            json_data[key] = expected_type(value)
-                    except (ValueError, TypeError) as err:
-                        print(f'Warning: Unable to cast {key} ({value}) to {expected_type.__name__}. Error: {err}')
-
-            title = str(json_data['name']) if 'name' in json_data else json_file.stem
-            logger.info(title.center(80, '='))
-
-            #  Merge into default settings
-            logger.debug(pprint.pformat(json_data))
-            options: argparse.Namespace = argparse.Namespace(**vars(base_options))
-            vars(options).update(json_data)
-
-            # Recreate the logger now that we have all the options parsed
-            logger = create_logger()
-            logger.debug('Debug ON')
-            logger.debug(pprint.pformat(options))
-
-            # Run installer
-            return_code = main()
+if __name__ == '__main__':
+    # Detect if running as a PyInstaller bundled executable
+    if getattr(sys, 'frozen', False):
+        # Running as a PyInstaller bundled executable
+        executable_directory: Path = Path(sys.executable).parent
+        json_files: list = list(executable_directory.glob('*.json'))
+        base_path: Path = Path(sys._MEIPASS)
+        json_files.extend(list(base_path.glob('*.json')))
+
+    else:
+        # Running as a normal Python script
+        executable_directory: Path = Path(__file__).parent
+        json_files: list = list(executable_directory.glob('*.json'))
+
+    # When in an app, check the resources folder
+    if executable_directory.parent.joinpath('Resources').is_dir():
+        json_files.extend(list(executable_directory.parent.joinpath('Resources').glob('*.json')))
+
+    parser: argparse.ArgumentParser = create_parser()
+    options.set(parser.parse_args())
+    for plugin_path in options.resolver_plugins or []:
+        try:
+            load_resolver_plugin(plugin_path)
+        except Exception as err:
+            parser.error(f'unable to load resolver plugin {plugin_path}: {err}')
+    if options.resolve is not None:
+        try:
+            options.resolve = parse_resolve_steps(options.resolve)
+        except (ValueError, TypeError) as err:
+            parser.error(f'argument --resolve: {err}')
+    if options.json_filter is not None:
+        try:
+            options.json_filter = parse_json_filter(options.json_filter)
+        except (ValueError, TypeError) as err:
+            parser.error(f'argument --json-filter: {err}')
+    if options.profile_dir is not None and options.workers > 1:
+        parser.error('--profile cannot be used with --workers above 1, the profiler is process wide')
+    if options.catalog is not None:
+        json_files: list = [options.catalog]
+    if options.make_blockmap is not None:
+        from install_from_web_delta import make_blockmap
+        blockmap_path: Path = options.make_blockmap.with_name(f'{options.make_blockmap.name}.blockmap.json')
+        blockmap_path.write_text(json.dumps(make_blockmap(options.make_blockmap)))
+        print(blockmap_path)
+        sys.exit(0)
+    if options.serve is not None:
+        if options.cache_dir is None:
+            parser.error('--serve requires --cache-dir')
+        if not options.serve_allow:
+            parser.error('--serve requires --serve-allow, the hosts the mirror fetches from')
+        from install_from_web_serve import serve_cache
+        logger.set(create_logger())
+        sys.exit(serve_cache(options.serve, Path(options.cache_dir), options.serve_max_age, options.serve_allow))
+    if options.history_report is not None:
+        if options.history_file is None:
+            parser.error('--history-report requires --history')
+        from install_from_web_plan import print_table
+        from install_from_web_report import RunHistory
+        print_table(*RunHistory(options.history_file).report(options.history_report, options.history_limit))
+        sys.exit(0)
+    if options.url is None and len(json_files) == 0:
+        parser.error('the following arguments are required: -u/--url')
+    base_options: argparse.Namespace = argparse.Namespace(**vars(options.get()))
+
+    logger.set(create_logger())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Debug ON')
+
+    # Latest metrics of each config
+    reported_metrics: dict = {}
+    runner: Runner = Runner(reported_metrics=reported_metrics)
+
+    # Override settings with json files
+    if len(json_files) > 0:
+        # Load and validate every config up front, in one pass, before any network work
+        configs, errors = load_configs(sorted(json_files), strict=options.catalog is not None,
+                                       strict_fields=options.strict)
+        for error in errors:
+            logger.critical(f'Invalid config {error}')
+        if options.catalog is not None and errors:
+            sys.exit(10)
+
+        configs: list = select_configs(configs, options.select_names, options.select_tags)
+        logger.debug(f'{len(configs)} config(s) to process')
+        if options.plan:
+            import asyncio
+            from install_from_web_plan import plan_configs, print_plan
+            print_plan(asyncio.run(plan_configs([
+                (title, argparse.Namespace(**{**vars(base_options), **config})) for title, config in configs
+            ])))
+            sys.exit(9 if errors else 0)
+        if options.daemon:
+            from install_from_web_daemon import run_daemon
+            sys.exit(run_daemon(configs, base_options, reported_metrics))
+
+        # Order the batch by priority and how long each config took before
+        from install_from_web_report import RunHistory
+        predictions: dict = RunHistory(options.history_file).predictions([title for title, _ in configs]) \
+            if options.history_file is not None and configs else {}
+        configs: list = order_configs(configs, predictions, options.order, options.workers)
+        runner.workers = options.workers
+        batch_start: float = time.perf_counter()
+
+        #  Merge into default settings and run installer
+        exit_code = 9 if errors else 0
+        jobs: list = [UpdateJob(title, argparse.Namespace(**{**vars(base_options), **json_data}))
+                      for title, json_data in configs]
+        if options.workers > 1:
+            return_codes: list = runner.run_all(jobs)
+        else:
+            return_codes: list = []
+            for job in jobs:
+                logger.info(80 * '-')
+                logger.info(job.name.center(80, '='))
+                return_codes.append(runner.run(job))
+                logger.log(logging.WARNING if return_codes[-1] else logging.INFO,
+                           f'Install {job.name} exited with {return_codes[-1]}')
+
+        for job, return_code in zip(jobs, return_codes):
             if return_code > 0:
                 exit_code = 9
-                logger.warning(f'Install {title} exited with {return_code}')
-            else:
-                logger.info(f'Install {title} exited with {return_code}')
-            atexit._run_exitfuncs()
+                if options.workers > 1:
+                    logger.warning(f'Install {job.name} exited with {return_code}')
+            elif options.workers > 1:
+                logger.info(f'Install {job.name} exited with {return_code}')
 
         logger.info(80 * '-')
+        if predictions:
+            average: float = sum(predictions.values()) / len(predictions)
+            for job in jobs:
+                logger.debug(f'{job.name}: predicted {predictions.get(job.name, average):.1f}s, '
+                             f'took {runner.results[job.name].duration:.1f}s')
+            unknown: int = sum(job.name not in predictions for job in jobs)
+            logger.info(f'Batch took {time.perf_counter() - batch_start:.1f}s, predicted '
+                        f'{batch_time([predictions.get(job.name, average) for job in jobs], options.workers):.1f}s'
+                        + (f', {unknown} config(s) without history' if unknown else ''))
         sys.exit(exit_code)
+    elif options.plan:
+        import asyncio
+        from install_from_web_plan import plan_configs, print_plan
+        print_plan(asyncio.run(plan_configs([(get_filename(options.url) or urlparse(options.url).netloc,
+                                               base_options)])))
+        sys.exit(0)
+    elif options.daemon:
+        from install_from_web_daemon import run_daemon
+        sys.exit(run_daemon([(get_filename(options.url) or urlparse(options.url).netloc, {})],
+                            base_options, reported_metrics))
     else:
-        sys.exit(main())
+        sys.exit(runner.run(UpdateJob(get_filename(options.url) or urlparse(options.url).netloc, base_options)))
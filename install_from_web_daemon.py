@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    install_from_web_daemon.py:
+    Run the catalog on a schedule, with a status server, imported by install_from_web.py on first use
+    """
+
+import argparse
+import json
+import time
+from typing import Optional
+
+from install_from_web import SSL_CONTEXT_TTL, create_ssl_context, logger, Runner, UpdateJob
+from install_from_web_serve import context_http_server
+
+
+class ScheduledConfig:
+    """
+    A config in the daemon schedule, with the outcome of its last run
+    """
+
+    def __init__(self, title: str, config: dict, interval: int) -> None:
+        """
+        Initialise the scheduled config
+        title: (str) Name of the config
+        config: (dict) Options of the config
+        interval: (int) Seconds between runs
+        """
+        self.title: str = title
+        self.config: dict = config
+        self.interval: int = interval
+        self.next_run: float = time.time()
+        self.last_run: Optional[float] = None
+        self.last_result: Optional[int] = None
+        self.failures: int = 0
+        self.running: bool = False
+
+    def schedule(self, jitter: float, max_backoff: int, first: bool = False) -> None:
+        """
+        Set the next run, consecutive failures double the interval up to max_backoff
+        The first run is spread over the jitter window so a fleet does not start at once
+        :param jitter: Fraction of the interval to randomise by
+        :param max_backoff: Longest delay in seconds after failures
+        :param first: Schedule the first run
+        """
+        import random
+
+        if first:
+            delay: float = random.uniform(0, self.interval * jitter)
+        else:
+            delay: float = min(self.interval * 2 ** self.failures, max(max_backoff, self.interval))
+            delay *= 1 + random.uniform(-jitter, jitter)
+        self.next_run = time.time() + delay
+
+    def record(self, return_code: int) -> None:
+        """
+        Record the outcome of a run
+        :param return_code: Exit code of the run
+        """
+        self.last_run = time.time()
+        self.last_result = return_code
+        self.failures = self.failures + 1 if return_code else 0
+
+    def as_dict(self) -> dict:
+        """
+        Get the schedule as a dictionary
+        :return: Schedule ready for json
+        """
+
+        def iso(timestamp: Optional[float]) -> Optional[str]:
+            return time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(timestamp)) if timestamp else None
+
+        return {
+            'config': self.title,
+            'interval': self.interval,
+            'next_run': iso(self.next_run),
+            'last_run': iso(self.last_run),
+            'last_result': self.last_result,
+            'failures': self.failures,
+            'running': self.running
+        }
+
+
+def start_status_server(port: int, scheduled: list) -> 'http.server.ThreadingHTTPServer':
+    """
+    Serve the daemon schedule as json on localhost
+    :param port: Port to listen on
+    :param scheduled: List of ScheduledConfig
+    :return: The running server
+    """
+    import http.server
+    import threading
+
+    class StatusHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body: bytes = json.dumps([config.as_dict() for config in scheduled], indent=2).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            logger.debug(f'Status request: {format % args}')
+
+    server: http.server.ThreadingHTTPServer = context_http_server(('127.0.0.1', port), StatusHandler)
+    threading.Thread(target=server.serve_forever, name='status', daemon=True).start()
+    logger.info(f'Status available at http://127.0.0.1:{server.server_port}/')
+
+    return server
+
+
+def run_daemon(configs: list, base_options: argparse.Namespace, reported_metrics: dict) -> int:
+    """
+    Stay resident and run each config on its own interval until stopped with SIGTERM/SIGINT
+    The process keeps its imports, ssl context and certificates warm between runs
+    :param configs: List of (title, config)
+    :param base_options: Default options the configs are merged into
+    :param reported_metrics: Latest metrics of each config
+    :return: Exit code
+    """
+    import signal
+    import threading
+
+    runner: Runner = Runner(reported_metrics=reported_metrics)
+    stop: threading.Event = threading.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: stop.set())
+
+    scheduled: list = []
+    for title, config in configs:
+        scheduled_config: ScheduledConfig = ScheduledConfig(title, config, config.get('interval') or base_options.interval)
+        scheduled_config.schedule(base_options.jitter, base_options.max_backoff, first=True)
+        scheduled.append(scheduled_config)
+
+    server: Optional['http.server.ThreadingHTTPServer'] = None
+    if base_options.status_port is not None:
+        server = start_status_server(base_options.status_port, scheduled)
+
+    logger.info(f'Daemon started with {len(scheduled)} config(s)')
+    ssl_loaded: float = time.monotonic()
+    while scheduled and not stop.is_set():
+        due: ScheduledConfig = min(scheduled, key=lambda scheduled_config: scheduled_config.next_run)
+        logger.debug(f'Next run {due.title} in {max(due.next_run - time.time(), 0):.0f}s')
+        if stop.wait(max(due.next_run - time.time(), 0)):
+            break
+
+        if time.monotonic() - ssl_loaded > SSL_CONTEXT_TTL:
+            logger.debug('Reloading the ssl context and root certificates')
+            create_ssl_context.cache_clear()
+            ssl_loaded = time.monotonic()
+
+        logger.info(due.title.center(80, '='))
+        due.running = True
+        try:
+            #  Merge into default settings
+            return_code: int = runner.run(UpdateJob(due.title, argparse.Namespace(**{**vars(base_options),
+                                                                                     **due.config})))
+        finally:
+            due.running = False
+
+        due.record(return_code)
+        due.schedule(base_options.jitter, base_options.max_backoff)
+        logger.info(f'Install {due.title} exited with {return_code}, next run {due.as_dict()["next_run"]}')
+
+    if server is not None:
+        server.shutdown()
+    logger.info('Daemon stopped')
+
+    return 0
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    install_from_web_delta.py:
+    Delta downloads, rebuild a release from an older one in the cache and fetch only the blocks that changed, imported by install_from_web.py on first use
+    """
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional, Any
+
+from install_from_web import (
+    BLOCKMAP_BLOCK_SIZE, DELTA_MAX_RANGES, DELTA_MIN_REUSE, DELTA_ROLL_LIMIT, DELTA_ROLL_TIMEOUT, DOWNLOAD_CHUNK_SIZE,
+    cache_key, download_slot, fetch_page, get_filename, logger, metrics, open_url, options, read_cache
+)
+
+
+def make_blockmap(file_path: Path, block_size: int = BLOCKMAP_BLOCK_SIZE) -> dict:
+    """
+    Make the block map of a file for delta downloads
+    Each block has a weak checksum (adler32), which can be rolled to find it at any offset in an older release,
+    and a strong hash to confirm it
+    :param file_path: File to map
+    :param block_size: Size of the blocks
+    :return: The block map
+    """
+    import hashlib
+    import zlib
+
+    digest = hashlib.sha256()
+    blocks: list = []
+    with open(file_path, 'rb') as file:
+        while block := file.read(block_size):
+            digest.update(block)
+            blocks.append([zlib.adler32(block), hashlib.blake2b(block, digest_size=16).hexdigest()])
+
+    return {
+        'size': file_path.stat().st_size,
+        'block_size': block_size,
+        'sha256': digest.hexdigest(),
+        'blocks': blocks
+    }
+
+
+def cached_blockmap(cached_path: Path) -> dict:
+    """
+    Get the block map of a cached download, made once and kept next to it until the download changes
+    :param cached_path: Path to the cached file
+    :return: The block map
+    """
+    blockmap_path: Path = cached_path.with_name(f'{cached_path.name}.blockmap.json')
+    if blockmap_path.is_file() and blockmap_path.stat().st_mtime >= cached_path.stat().st_mtime:
+        try:
+            return json.loads(blockmap_path.read_text())
+        except (OSError, ValueError) as err:
+            logger.warning(f'Making the unreadable block map {blockmap_path} again: {err}')
+
+    blockmap: dict = make_blockmap(cached_path)
+    temp_path: Path = blockmap_path.with_name(f'.{blockmap_path.name}.tmp')
+    temp_path.write_text(json.dumps(blockmap))
+    os.replace(temp_path, blockmap_path)
+
+    return blockmap
+
+
+def delta_seed(cache_dir: Path, url: str) -> Optional[Path]:
+    """
+    Find the older release to rebuild a download from, the cached copy of the url, or else the newest download
+    cached from the same folder of the same host with the same extension
+    :param cache_dir: Cache directory
+    :param url: Download url
+    :return: Path to the older release, or None if there is none
+    """
+    cached_path, _ = read_cache(cache_dir, url)
+    if cached_path is not None:
+        return cached_path
+
+    folder: Path = cache_dir.joinpath(cache_key(url)).parent
+    suffix: str = Path(get_filename(url)).suffix
+    seeds: list = [path for path in folder.glob(f'*{suffix}')
+                   if path.is_file() and path.with_name(f'{path.name}.meta.json').is_file()]
+
+    return max(seeds, key=lambda path: path.stat().st_mtime, default=None)
+
+
+def match_blocks(seed_path: Path, blockmap: dict) -> dict:
+    """
+    Find the blocks of the new file in an older release, rsync style
+    The scan keeps in step with the last block found and after a match jumps a whole block. Blocks changed in place are
+    skipped by looking a few blocks ahead for the block expected in step, only when that fails, as bytes were added or
+    removed, is the adler32 of the window rolled a byte at a time and only windows in the block map are hashed.
+    Rolling is pure python, so it stops after DELTA_ROLL_LIMIT bytes or DELTA_ROLL_TIMEOUT seconds, or early on when
+    it is finding too little, and the rest of the seed is only checked in step
+    :param seed_path: Older release
+    :param blockmap: Block map of the new file
+    :return: Offset in the seed of each block found, by block index
+    """
+    import hashlib
+    import mmap
+    import zlib
+
+    block_size: int = blockmap['block_size']
+    modulus: int = 65521
+    weak_blocks: dict = {}
+    for index, (weak, strong) in enumerate(blockmap['blocks']):
+        # A short last block cannot be found with a full window
+        if (index + 1) * block_size <= blockmap['size']:
+            weak_blocks.setdefault(weak, []).append((index, strong))
+
+    matches: dict = {}
+    seed_size: int = seed_path.stat().st_size
+    if seed_size < block_size or not weak_blocks:
+        return matches
+
+    with open(seed_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as seed:
+
+        def match(offset: int, weak: Optional[int] = None) -> list:
+            window: bytes = seed[offset:offset + block_size]
+            candidates: Optional[list] = weak_blocks.get(zlib.adler32(window) if weak is None else weak)
+            if candidates is None:
+                return []
+            strong: str = hashlib.blake2b(window, digest_size=16).hexdigest()
+            found: list = [index for index, block_strong in candidates if block_strong == strong]
+            for index in found:
+                matches.setdefault(index, offset)
+            return found
+
+        last_offset: int = seed_size - block_size
+        lookahead: int = 8 * block_size
+        rolling: bool = True
+        rolled: int = 0
+        rolled_matches: int = 0
+        check_at: int = block_size
+        give_up_at: int = 64 * block_size
+        deadline: float = time.monotonic() + DELTA_ROLL_TIMEOUT
+        # Seed offset and the block of the new file expected there when in step
+        offset: int = 0
+        index: int = 0
+        while offset <= last_offset:
+            found: list = match(offset)
+            if found:
+                index = (index if index in found else found[0]) + 1
+                offset += block_size
+                continue
+
+            # Changed in place when the block expected in step is close, or anywhere once rolling has stopped
+            ahead: int = offset + block_size
+            ahead_index: int = index + 1
+            ahead_limit: int = min(offset + lookahead, last_offset) if rolling else last_offset
+            while ahead <= ahead_limit and ahead_index not in match(ahead):
+                ahead += block_size
+                ahead_index += 1
+            if ahead <= ahead_limit or not rolling:
+                offset, index = ahead + block_size, ahead_index + 1
+                continue
+
+            # Moved, roll the window on a byte at a time until it is found again
+            start: int = offset
+            weak: int = zlib.adler32(seed[offset:offset + block_size])
+            while True:
+                if offset >= last_offset:
+                    return matches
+                out_byte, in_byte = seed[offset], seed[offset + block_size]
+                a: int = ((weak & 0xffff) - out_byte + in_byte) % modulus
+                weak = ((((weak >> 16) - block_size * out_byte + a - 1) % modulus) << 16) | a
+                offset += 1
+                rolled += 1
+                if weak in weak_blocks and (found := match(offset, weak)):
+                    rolled_matches += 1
+                    index = found[0] + 1
+                    offset += block_size
+                    break
+
+                # Checked once a block, gives up when rolling is not finding enough of the blocks it rolls past
+                if rolled == check_at:
+                    check_at += block_size
+                    if rolled >= DELTA_ROLL_LIMIT or time.monotonic() > deadline or \
+                            (rolled >= give_up_at and rolled_matches * block_size < rolled * DELTA_MIN_REUSE):
+                        logger.debug(f'Stopped rolling for moved blocks after {rolled / 1024 ** 2:.1f} MB')
+                        rolling = False
+                        # Back in step with the last block found
+                        index -= (start - offset) // block_size
+                        offset = start - (start - offset) // block_size * block_size
+                        break
+
+    return matches
+
+
+def delta_ranges(missing: list, block_size: int, size: int, max_ranges: int = DELTA_MAX_RANGES) -> list:
+    """
+    Group the missing blocks into byte ranges to request, merging across the smallest gaps to keep the number of
+    requests down
+    :param missing: Sorted indexes of the missing blocks
+    :param block_size: Size of the blocks
+    :param size: Size of the file
+    :param max_ranges: Most ranges to return
+    :return: List of [start, end] byte ranges, end inclusive
+    """
+    ranges: list = []
+    for index in missing:
+        start: int = index * block_size
+        end: int = min(start + block_size, size) - 1
+        if ranges and ranges[-1][1] + 1 == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+
+    if len(ranges) > max_ranges:
+        gaps: list = sorted(range(len(ranges) - 1), key=lambda gap: ranges[gap + 1][0] - ranges[gap][1])
+        merge: set = set(gaps[:len(ranges) - max_ranges])
+        merged: list = [ranges[0]]
+        for gap, byte_range in enumerate(ranges[1:]):
+            if gap in merge:
+                merged[-1][1] = byte_range[1]
+            else:
+                merged.append(byte_range)
+        ranges = merged
+
+    return ranges
+
+
+def delta_download(opener: 'urllib.request.OpenerDirector', download_url: str, candidate_urls: list,
+                   download_folder: Path, cache_dir: Path, checksum: Optional[str]) -> tuple:
+    """
+    Rebuild the download from an older release in the cache, fetching only the blocks that changed with Range requests
+    The block map is taken from blockmap_url or from a mirror, which makes one for what it caches, the result is
+    verified against its size and digest and the expected checksum
+    :param opener: Opener to download with
+    :param download_url: Url of the installer
+    :param candidate_urls: Urls to download from, the first is used for the ranges
+    :param download_folder: Directory to save the installer in
+    :param cache_dir: Cache directory
+    :param checksum: Expected checksum, algorithm:hex
+    :return: Path to the installer, the response headers and the bytes fetched, or None, None and 0 to download it all
+    """
+    import hashlib
+    import urllib.request
+
+    seed_path: Optional[Path] = delta_seed(cache_dir, download_url)
+    if seed_path is None:
+        logger.info('No older release cached to rebuild the download from')
+        return None, None, 0
+
+    if options.blockmap_url:
+        blockmap_urls: list = [options.blockmap_url.replace('{url}', download_url)]
+    else:
+        blockmap_urls: list = [f'{url}.blockmap.json' for url in candidate_urls if url != download_url]
+    blockmap: Optional[dict] = None
+    for blockmap_url in blockmap_urls:
+        try:
+            blockmap = json.loads(fetch_page(opener, blockmap_url, options.user_agent))
+            break
+        except Exception as err:
+            logger.debug(f'No block map from {blockmap_url}: {err}')
+    if blockmap is None:
+        logger.info('No block map for the download, downloading it in full')
+        return None, None, 0
+
+    with metrics.phase('delta_match'):
+        matches: dict = match_blocks(seed_path, blockmap)
+    block_size: int = blockmap['block_size']
+    size: int = blockmap['size']
+    ranges: list = delta_ranges([index for index in range(len(blockmap['blocks'])) if index not in matches],
+                                block_size, size)
+    fetch_size: int = sum(end - start + 1 for start, end in ranges)
+    logger.info(f'Reusing {len(matches)} of {len(blockmap["blocks"])} blocks from {seed_path.name}, '
+                f'fetching {fetch_size / 1024 ** 2:.1f} of {size / 1024 ** 2:.1f} MB')
+    if not matches or len(matches) * block_size < size * DELTA_MIN_REUSE:
+        logger.info(f'Too little of {seed_path.name} to reuse, downloading it in full')
+        return None, None, 0
+    metrics.count('delta_reused_bytes', size - fetch_size)
+
+    algorithm, _, expected_digest = checksum.partition(':') if checksum else (None, None, None)
+    digests: dict = {name: hashlib.new(name) for name in {'sha256', algorithm or 'sha256'}}
+    installer_path: Path = download_folder.joinpath(get_filename(download_url) or seed_path.name)
+    source_url: str = candidate_urls[0]
+    headers: Any = None
+    fetched: int = 0
+    position: int = 0
+
+    def write(file: Any, data: bytes) -> None:
+        file.write(data)
+        for digest in digests.values():
+            digest.update(data)
+
+    try:
+        with metrics.phase('download'), open(seed_path, 'rb') as seed, open(installer_path, 'wb') as file:
+            for start, end in [*ranges, [size, size]]:
+                # Every block up to the next range is in the seed
+                for index in range(position // block_size, start // block_size):
+                    seed.seek(matches[index])
+                    write(file, seed.read(block_size))
+                if start == size:
+                    break
+
+                logger.debug(f'Fetching bytes {start}-{end} of {source_url}')
+                req: urllib.request.Request = urllib.request.Request(source_url)
+                req.add_header('User-Agent', options.user_agent)
+                req.add_header('Range', f'bytes={start}-{end}')
+                with download_slot(source_url) as buckets, open_url(opener, req) as response:
+                    content_range: str = response.headers.get('Content-Range') or ''
+                    if response.status != 206 or not content_range.startswith(f'bytes {start}-{end}/'):
+                        raise ValueError(f'the server did not send the range, {response.status} {content_range}')
+                    received: int = 0
+                    while chunk := response.read(DOWNLOAD_CHUNK_SIZE):
+                        write(file, chunk)
+                        received += len(chunk)
+                        for bucket in buckets:
+                            bucket.consume(len(chunk))
+                    if received != end - start + 1:
+                        raise ValueError(f'got {received} of {end - start + 1} bytes of the range')
+                    fetched += received
+                    headers = response.headers
+                position = end + 1
+    except Exception as err:
+        logger.warning(f'Unable to rebuild the download, downloading it in full: {err}')
+        installer_path.unlink(missing_ok=True)
+        return None, None, fetched
+
+    # The rebuilt file has to be exactly the new release
+    if installer_path.stat().st_size != size or digests['sha256'].hexdigest() != blockmap['sha256'] or \
+            (algorithm is not None and digests[algorithm].hexdigest() != expected_digest):
+        logger.warning('The rebuilt download does not match, downloading it in full')
+        installer_path.unlink()
+        return None, None, fetched
+
+    logger.info(f'Rebuilt {installer_path.name} fetching {fetched / 1024 ** 2:.1f} MB')
+    metrics.count('delta_fetched_bytes', fetched)
+    metrics.count('digest', f'sha256:{digests["sha256"].hexdigest()}')
+
+    return installer_path, headers, fetched
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    install_from_web_feeds.py:
+    Find the latest release in a json feed or a Sparkle appcast, imported by install_from_web.py on first use
+    """
+
+import argparse
+import collections
+import json
+import re
+from typing import Optional, Any
+
+from install_from_web import is_newer_version, logger, open_url, parse_json_path
+
+
+class JsonStream:
+    """
+    Pull parser over a json response, walks to a path and only decodes the values there
+    Everything else is skipped as it is read, so a large release index is never held in memory, only the last items
+    of an array are kept for a negative index, which is found at its end
+    """
+    SCALAR_END: re.Pattern = re.compile(r'[\s,\]}]')
+    STRUCTURE: re.Pattern = re.compile(r'["\[\]{}]')
+
+    def __init__(self, stream: Any, chunk_size: int = 64 * 1024):
+        import codecs
+
+        self.stream: Any = stream
+        self.chunk_size: int = chunk_size
+        self.decoder: codecs.IncrementalDecoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer: str = ''
+        self.pos: int = 0
+        self.eof: bool = False
+
+    def select(self, path: list):
+        """
+        Decode the values at a path, '*' is every item of an array or value of an object
+        :param path: Keys and indexes, see parse_json_path
+        :return: Generator of the values, stop it early to stop reading
+        """
+        yield from self._select(path)
+
+    def _select(self, path: list):
+        if not path:
+            yield self._value()
+            return
+
+        step, rest = path[0], path[1:]
+        char: str = self._peek()
+        if char not in ('{', '['):
+            self._skip()
+            return
+
+        close: str = '}' if char == '{' else ']'
+        last: Optional[collections.deque] = collections.deque(maxlen=-step) \
+            if char == '[' and isinstance(step, int) and step < 0 else None
+        self.pos += 1
+        index: int = 0
+        while self._peek() != close:
+            if index:
+                self._expect(',')
+            key: Any = index
+            if char == '{':
+                key = self._string()
+                self._expect(':')
+            if step == '*' or step == key:
+                yield from self._select(rest)
+            elif last is not None:
+                start: int = self.pos
+                self._skip()
+                last.append(self.buffer[start:self.pos])
+            else:
+                self._skip()
+            index += 1
+            self._compact()
+        self.pos += 1
+
+        if last is not None and len(last) == last.maxlen:
+            yield from json_values(json.loads(last[0]), rest)
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk: bytes = self.stream.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer += self.decoder.decode(chunk, final=self.eof)
+        return not self.eof
+
+    def _compact(self) -> None:
+        if self.pos > self.chunk_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+    def _peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise ValueError(f'invalid json, expected "{char}" got "{self._peek()}"')
+        self.pos += 1
+
+    def _string(self) -> str:
+        self._expect('"')
+        while True:
+            try:
+                value, self.pos = json.decoder.scanstring(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    def _skip(self) -> None:
+        char: str = self._peek()
+        if char == '"':
+            self._string()
+        elif char in ('{', '['):
+            depth: int = 0
+            while True:
+                matches: Optional[re.Match] = self.STRUCTURE.search(self.buffer, self.pos)
+                if matches is None:
+                    self.pos = len(self.buffer)
+                    if not self._fill():
+                        raise ValueError('invalid json, unexpected end')
+                elif matches.group() == '"':
+                    self.pos = matches.start()
+                    self._string()
+                else:
+                    self.pos = matches.end()
+                    depth += 1 if matches.group() in '[{' else -1
+                    if depth == 0:
+                        return
+        else:
+            while (matches := self.SCALAR_END.search(self.buffer, self.pos)) is None and self._fill():
+                pass
+            self.pos = matches.start() if matches else len(self.buffer)
+
+    def _value(self) -> Any:
+        self._peek()
+        start: int = self.pos
+        self._skip()
+        return json.loads(self.buffer[start:self.pos])
+
+
+def json_values(data: Any, path: list) -> list:
+    """
+    Get the values at a path in decoded json
+    :param data: Decoded json
+    :param path: Keys and indexes, see parse_json_path
+    :return: List of values, empty if the path does not exist
+    """
+    if not path:
+        return [data]
+
+    step, rest = path[0], path[1:]
+    if isinstance(data, dict):
+        children: list = list(data.values()) if step == '*' else [data[step]] if step in data else []
+    elif isinstance(data, list) and (step == '*' or isinstance(step, int)):
+        children: list = data if step == '*' else data[step:step + 1 or None]
+    else:
+        children: list = []
+
+    return [value for child in children for value in json_values(child, rest)]
+
+
+def json_text(value: Any) -> str:
+    """
+    A json value as text, strings as they are
+    :param value: Decoded json value
+    :return: Text
+    """
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def resolve_json_release(opener: 'urllib.request.OpenerDirector', url: str,
+                         config_options: argparse.Namespace) -> tuple:
+    """
+    Find the download in a json release feed, streaming it and stopping at the first match unless json_latest
+    Items at json_path are kept when every json_filter regex matches a value of its field, the download url is
+    json_url (a field, or a template of {field}), the version json_version and the checksum json_checksum
+    :param opener: Opener to fetch the feed with
+    :param url: Url of the feed
+    :param config_options: Options of the config
+    :return: The release (url, version, checksum) and 0, or None and an exit code
+    """
+    import urllib.request
+    from urllib.parse import urljoin
+
+    logger.info(f'Finding download in json "{url}" at "{config_options.json_path}" ...')
+    filters: list = [(parse_json_path(field), re.compile(pattern))
+                     for field, pattern in (config_options.json_filter or {}).items()]
+    url_field: str = config_options.json_url or 'url'
+    version_path: list = parse_json_path(config_options.json_version or 'version')
+    checksum_path: Optional[list] = parse_json_path(config_options.json_checksum) if config_options.json_checksum else None
+
+    def release_of(item: Any) -> Optional[dict]:
+        if not all(any(pattern.fullmatch(json_text(value)) for value in json_values(item, field))
+                   for field, pattern in filters):
+            return None
+
+        if '{' in url_field:
+            fields: dict = {name: json_values(item, parse_json_path(name)) for name in re.findall(r'{([^{}]+)}', url_field)}
+            if not all(fields.values()):
+                return None
+            urls: list = [re.sub(r'{([^{}]+)}', lambda matches: json_text(fields[matches.group(1)][0]), url_field)]
+        else:
+            urls: list = [json_text(value) for value in json_values(item, parse_json_path(url_field))]
+        if config_options.json_url_match:
+            urls = [item_url for item_url in urls if re.search(config_options.json_url_match, item_url)]
+        if not urls:
+            return None
+
+        versions: list = json_values(item, version_path)
+        checksums: list = json_values(item, checksum_path) if checksum_path else []
+        return {
+            'url': urljoin(url, urls[0]),
+            'version': json_text(versions[0]) if versions else None,
+            'checksum': json_text(checksums[0]) if checksums else None
+        }
+
+    req: urllib.request.Request = urllib.request.Request(url)
+    req.add_header('User-Agent', config_options.user_agent)
+    req.add_header('Accept', 'application/json')
+
+    release: Optional[dict] = None
+    try:
+        with open_url(opener, req) as response:
+            for item in JsonStream(response).select(parse_json_path(config_options.json_path)):
+                candidate: Optional[dict] = release_of(item)
+                if candidate is None:
+                    continue
+                if not config_options.json_latest:
+                    release = candidate
+                    break
+                if release is None or is_newer_version(candidate['version'] or '', release['version'] or ''):
+                    release = candidate
+    except Exception as err:
+        logger.error(f'Error reading json "{url}": {err}')
+        return None, 5
+
+    if release is None:
+        logger.error('No matching download URL found.')
+        return None, 1
+
+    logger.info(f'Found download URL: {release["url"]} version {release["version"]}')
+    return release, 0
+
+
+def resolve_appcast_release(opener: 'urllib.request.OpenerDirector', url: str,
+                            config_options: argparse.Namespace) -> tuple:
+    """
+    Find the newest download in a Sparkle appcast, parsed item by item as the feed is read
+    Items for a newer macOS than this one, in channels not asked for, or without an enclosure are skipped
+    :param opener: Opener to fetch the appcast with
+    :param url: Url of the appcast
+    :param config_options: Options of the config
+    :return: The release (url, version, checksum, size, signature) and 0, or None and an exit code
+    """
+    import platform
+    import urllib.request
+    import xml.etree.ElementTree as ET
+    from urllib.parse import urljoin
+
+    sparkle: str = '{http://www.andymatuschak.org/xml-namespaces/sparkle}'
+    os_version: Optional[str] = platform.mac_ver()[0] or None
+    channels: list = config_options.appcast_channels or []
+    logger.info(f'Finding download in appcast "{url}" ...')
+
+    def release_of(item: ET.Element) -> Optional[dict]:
+        enclosure: Optional[ET.Element] = item.find('enclosure')
+        if enclosure is None or not enclosure.get('url') or item.find(f'{sparkle}informationalUpdate') is not None:
+            return None
+
+        channel: Optional[str] = item.findtext(f'{sparkle}channel')
+        if channel and channel not in channels:
+            logger.debug(f'Skipping {enclosure.get("url")} in channel {channel}')
+            return None
+
+        minimum_os: Optional[str] = item.findtext(f'{sparkle}minimumSystemVersion')
+        maximum_os: Optional[str] = item.findtext(f'{sparkle}maximumSystemVersion')
+        if os_version and minimum_os and is_newer_version(minimum_os.strip(), os_version):
+            logger.debug(f'Skipping {enclosure.get("url")}, needs macOS {minimum_os}')
+            return None
+        if os_version and maximum_os and is_newer_version(os_version, maximum_os.strip()):
+            logger.debug(f'Skipping {enclosure.get("url")}, needs macOS {maximum_os} or older')
+            return None
+
+        version: Optional[str] = (enclosure.get(f'{sparkle}shortVersionString') or
+                                  item.findtext(f'{sparkle}shortVersionString') or
+                                  enclosure.get(f'{sparkle}version') or item.findtext(f'{sparkle}version'))
+        length: str = enclosure.get('length') or ''
+        return {
+            'url': urljoin(url, enclosure.get('url').strip()),
+            'version': version.strip() if version else None,
+            'checksum': None,
+            'size': int(length) if length.isdigit() and int(length) > 0 else None,
+            'signature': enclosure.get(f'{sparkle}edSignature') or enclosure.get(f'{sparkle}dsaSignature')
+        }
+
+    req: urllib.request.Request = urllib.request.Request(url)
+    req.add_header('User-Agent', config_options.user_agent)
+
+    release: Optional[dict] = None
+    try:
+        with open_url(opener, req) as response:
+            for _, element in ET.iterparse(response, events=('end',)):
+                if element.tag != 'item':
+                    continue
+                candidate: Optional[dict] = release_of(element)
+                element.clear()
+                if candidate is None:
+                    continue
+                if release is None or (candidate['version'] and
+                                       is_newer_version(candidate['version'], release['version'] or '0')):
+                    release = candidate
+    except Exception as err:
+        logger.error(f'Error reading appcast "{url}": {err}')
+        return None, 5
+
+    if release is None:
+        logger.error('No matching download URL found.')
+        return None, 1
+
+    logger.info(f'Found download URL: {release["url"]} version {release["version"]}')
+    if release['signature']:
+        logger.debug(f'Appcast signature {release["signature"]}')
+    return release, 0
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    install_from_web_manifest.py:
+    Record a manifest of each installed app, verify the app against it and repair it from the cached download, imported by install_from_web.py on first use
+    """
+
+import contextlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from install_from_web import (
+    MANIFEST_HASH, cache_key, detect_compression, find_app_path, get_app_version, logger, metrics, mount_dmg,
+    open_decompressed, options, system, unmount_dmg
+)
+
+
+def bundle_entries(bundle: Path):
+    """
+    Walk the files and symlinks of a bundle, without following symlinks
+    :param bundle: Path to the bundle
+    :return: Generator of (relative path, os.DirEntry)
+    """
+    folders: list = [bundle]
+    while folders:
+        folder: Path = folders.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(Path(entry.path))
+                else:
+                    yield Path(entry.path).relative_to(bundle).as_posix(), entry
+
+
+def entry_digest(path: Path) -> str:
+    """
+    Hash a file of a bundle for its manifest, a symlink is recorded by its target
+    :param path: Path to the file
+    :return: Hex digest, or link:<target>
+    """
+    import hashlib
+
+    if path.is_symlink():
+        return f'link:{os.readlink(path)}'
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, MANIFEST_HASH).hexdigest()
+
+
+def hash_entries(bundle: Path, paths: list) -> dict:
+    """
+    Hash files of a bundle on threads, hashlib releases the GIL on large reads
+    :param bundle: Path to the bundle
+    :param paths: Relative paths to hash
+    :return: Dictionary of relative path to digest
+    """
+    if len(paths) < 2:
+        return {path: entry_digest(bundle.joinpath(path)) for path in paths}
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix='hash') as executor:
+        return dict(zip(paths, executor.map(lambda path: entry_digest(bundle.joinpath(path)), paths)))
+
+
+def manifest_path(app_name: str) -> Path:
+    """
+    Get where the manifest of an installed app is kept
+    :param app_name: Name of the app bundle
+    :return: Path to the manifest
+    """
+    return Path(options.manifest_dir).joinpath(f'{app_name}.manifest.json')
+
+
+def record_manifest(bundle: Path) -> None:
+    """
+    Record the manifest of an installed bundle: the size, mode, mtime and hash of each file, and the cached download
+    it came from for repairs
+    :param bundle: Path to the installed bundle
+    """
+    download_url: Optional[str] = metrics.counters.get('download_url')
+    artifact: Optional[Path] = Path(options.cache_dir).joinpath(cache_key(download_url)) \
+        if options.cache_dir and download_url else None
+
+    try:
+        stats: dict = {path: entry.stat(follow_symlinks=False) for path, entry in bundle_entries(bundle)}
+        digests: dict = hash_entries(bundle, list(stats))
+        manifest: dict = {
+            'app': bundle.as_posix(),
+            'url': options.url,
+            'download_url': download_url,
+            'artifact': artifact.as_posix() if artifact is not None and artifact.is_file() else None,
+            'file_type': metrics.counters.get('file_type'),
+            'version': get_app_version(bundle),
+            'created': time.time(),
+            'hash': MANIFEST_HASH,
+            'files': {path: [stat.st_size, stat.st_mode, stat.st_mtime_ns, digests[path]]
+                      for path, stat in sorted(stats.items())}
+        }
+
+        path: Path = manifest_path(bundle.name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path: Path = path.with_name(f'.{path.name}.tmp')
+        temp_path.write_text(json.dumps(manifest, indent=1))
+        os.replace(temp_path, path)
+    except OSError as err:
+        logger.warning(f'Unable to record the manifest of {bundle}: {err}')
+        return
+
+    metrics.count('manifest_files', len(stats))
+    logger.info(f'Recorded manifest of {len(stats)} files at {path}')
+
+
+def find_manifest() -> Optional[Path]:
+    """
+    Find the manifest of the app a config installs, by app_name or a blocking_app ending in .app, or else by url
+    :return: Path to the manifest, or None if there is none
+    """
+    app_name: Optional[str] = getattr(options, 'app_name', None)
+    if not app_name and (options.blocking_app or '').endswith('.app'):
+        app_name = options.blocking_app
+    if app_name:
+        path: Path = manifest_path(app_name)
+        return path if path.is_file() else None
+
+    for path in Path(options.manifest_dir).glob('*.manifest.json'):
+        with contextlib.suppress(OSError, ValueError):
+            if json.loads(path.read_text()).get('url') == options.url:
+                return path
+    return None
+
+
+def verify_bundle(bundle: Path, manifest: dict) -> dict:
+    """
+    Check a bundle against its manifest, a file is only hashed when its stat does not match
+    :param bundle: Path to the bundle
+    :param manifest: Manifest of the bundle
+    :return: Relative paths that are missing, changed (content or mode) and extra, and the number hashed
+    """
+    files: dict = manifest['files']
+    seen: set = set()
+    suspect: dict = {}
+    extra: list = []
+
+    if bundle.is_dir():
+        for path, entry in bundle_entries(bundle):
+            seen.add(path)
+            if path not in files:
+                extra.append(path)
+                continue
+            stat: os.stat_result = entry.stat(follow_symlinks=False)
+            size, mode, mtime, _ = files[path]
+            if (stat.st_size, stat.st_mode, stat.st_mtime_ns) != (size, mode, mtime):
+                suspect[path] = stat
+
+    digests: dict = hash_entries(bundle, list(suspect))
+    changed: list = [path for path, stat in suspect.items()
+                     if digests[path] != files[path][3] or stat.st_mode != files[path][1]]
+
+    return {
+        'missing': sorted(set(files) - seen),
+        'changed': sorted(changed),
+        'extra': sorted(extra),
+        'hashed': len(suspect)
+    }
+
+
+@contextlib.contextmanager
+def artifact_bundle(manifest: dict, paths: list, folder: Path):
+    """
+    Get files of a bundle from the cached download it was installed from, only the files asked for are extracted
+    :param manifest: Manifest of the bundle
+    :param paths: Relative paths in the bundle
+    :param folder: Folder to extract into or mount at
+    :return: Path to the bundle in the download, with at least the files asked for
+    """
+    artifact: Path = Path(manifest['artifact'])
+    file_type: str = manifest['file_type'] or ''
+    bundle_name: str = Path(manifest['app']).name
+    wanted: set = set(paths)
+
+    def relative(name: str) -> Optional[tuple]:
+        # The bundle can be at any depth in an archive, Foo-1.2/Foo.app/Contents/...
+        before, marker, after = name.partition(f'{bundle_name}/')
+        if not marker or (before and not before.endswith('/')):
+            return None
+        return f'{before}{bundle_name}', after.rstrip('/')
+
+    if file_type == 'zip':
+        import zipfile
+
+        with zipfile.ZipFile(artifact) as zip_ref:
+            root: Optional[str] = None
+            for zip_info in zip_ref.infolist():
+                parts: Optional[tuple] = relative(zip_info.filename)
+                if parts is None or parts[1] not in wanted:
+                    continue
+                root = parts[0]
+                extracted_path: Path = folder.joinpath(zip_info.filename)
+                if zip_info.external_attr >> 28 == 0xA:
+                    extracted_path.parent.mkdir(parents=True, exist_ok=True)
+                    os.symlink(zip_ref.read(zip_info.filename).decode(), extracted_path)
+                else:
+                    zip_ref.extract(zip_info, folder)
+                    if zip_info.external_attr >> 16:
+                        os.chmod(extracted_path, zip_info.external_attr >> 16)
+        yield folder.joinpath(root or bundle_name)
+
+    elif file_type.startswith(('tar', 'tgz', 'gz', 'bz2', 'xz', 'zst')):
+        import tarfile
+
+        root: Optional[str] = None
+        with open_decompressed(artifact, detect_compression(artifact), options.decompressor) as stream, \
+                tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                parts: Optional[tuple] = relative(member.name)
+                if parts is not None and parts[1] in wanted and not member.isdir():
+                    root = parts[0]
+                    tar.extract(member, folder)
+        yield folder.joinpath(root or bundle_name)
+
+    elif file_type == 'dmg':
+        mount_point: Path = folder.joinpath('mount')
+        mount_point.mkdir()
+        mount_dmg(artifact, mount_point)
+        try:
+            yield find_app_path(mount_point) or mount_point.joinpath(bundle_name)
+        finally:
+            unmount_dmg(mount_point)
+
+    else:
+        raise ValueError(f'cannot repair from a {file_type or "unknown"} download, reinstall instead')
+
+
+def repair_bundle(bundle: Path, manifest: dict, paths: list) -> list:
+    """
+    Copy files of a bundle again from the cached download it was installed from, with their recorded mode and mtime
+    :param bundle: Path to the bundle
+    :param manifest: Manifest of the bundle
+    :param paths: Relative paths to repair
+    :return: Relative paths that could not be repaired
+    """
+    import shutil
+
+    files: dict = manifest['files']
+    with system.temp_dir() as temp_folder, artifact_bundle(manifest, paths, Path(temp_folder)) as source:
+        for path in paths:
+            source_path: Path = source.joinpath(path)
+            destination: Path = bundle.joinpath(path)
+            if not source_path.is_symlink() and not source_path.is_file():
+                logger.error(f'{path} is not in {manifest["artifact"]}')
+                continue
+
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            if destination.is_symlink() or destination.exists():
+                destination.unlink()
+            if source_path.is_symlink():
+                os.symlink(os.readlink(source_path), destination)
+            else:
+                shutil.copyfile(source_path, destination)
+                os.chmod(destination, files[path][1] & 0o7777)
+            os.utime(destination, ns=(files[path][2], files[path][2]), follow_symlinks=False)
+            logger.info(f'Repaired {path}')
+
+    digests: dict = hash_entries(bundle, [path for path in paths if bundle.joinpath(path).is_symlink() or
+                                          bundle.joinpath(path).is_file()])
+    return [path for path in paths if digests.get(path) != files[path][3]]
+
+
+def verify_app(repair: bool = False) -> int:
+    """
+    Check the installed app of the config against its manifest, and copy drifted files again from the cached download
+    :param repair: Repair the drifted files
+    :return: 0 if the app matches (or was repaired), otherwise the exit code
+    """
+    if options.manifest_dir is None:
+        logger.critical('Verifying needs the --manifest-dir the app was installed with')
+        return 12
+
+    path: Optional[Path] = find_manifest()
+    if path is None:
+        logger.error(f'No manifest of {options.url} in {options.manifest_dir}')
+        return 12
+
+    manifest: dict = json.loads(path.read_text())
+    bundle: Path = Path(manifest['app'])
+    with metrics.phase('verify'):
+        drift: dict = verify_bundle(bundle, manifest)
+    metrics.count('verified_files', len(manifest['files']))
+    metrics.count('hashed_files', drift['hashed'])
+    metrics.count('drifted_files', len(drift['missing']) + len(drift['changed']))
+
+    for kind in ('missing', 'changed', 'extra'):
+        for drifted in drift[kind]:
+            logger.warning(f'{kind.capitalize()}: {bundle.joinpath(drifted)}')
+    drifted: list = drift['missing'] + drift['changed']
+    if not drifted:
+        logger.info(f'{bundle} matches its manifest, {len(manifest["files"])} files, {drift["hashed"]} hashed')
+        return 0
+    logger.error(f'{bundle} has drifted from its manifest: {len(drift["missing"])} missing, '
+                 f'{len(drift["changed"])} changed')
+    if not repair:
+        return 12
+
+    if not manifest.get('artifact') or not Path(manifest['artifact']).is_file():
+        logger.critical(f'No cached download to repair {bundle} from, use --reinstall')
+        return 12
+
+    try:
+        with metrics.phase('repair'):
+            failed: list = repair_bundle(bundle, manifest, drifted)
+    except Exception as err:
+        logger.critical(f'Unable to repair {bundle}: {err}')
+        return 12
+
+    metrics.count('repaired_files', len(drifted) - len(failed))
+    if failed:
+        logger.critical(f'Unable to repair {len(failed)} files of {bundle}')
+        return 12
+    logger.info(f'Repaired {len(drifted)} files of {bundle}')
+    return 0
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    install_from_web_plan.py:
+    Plan a batch, what each config would do, without downloading or installing anything, imported by install_from_web.py on first use
+    """
+
+import argparse
+import contextvars
+from typing import Optional
+
+from install_from_web import (
+    fetch_page, head_request, installed_app_version, is_newer_version, logger, options, resolve_download_url, system,
+    version_from_url
+)
+from install_from_web_feeds import resolve_appcast_release, resolve_json_release
+
+
+def plan_config(title: str, config_options: argparse.Namespace) -> dict:
+    """
+    Work out what a run of a config would change, without downloading or installing anything
+    :param title: Name of the config
+    :param config_options: Options of the config
+    :return: The plan of the config
+    """
+    plan: dict = {'config': title, 'installed': None, 'available': None, 'size': None, 'url': None}
+    try:
+        opener, _ = system.opener(config_options.user_agent)
+        release: dict = {}
+        if config_options.appcast:
+            release, return_code = resolve_appcast_release(opener, config_options.url, config_options)
+            download_url: Optional[str] = release['url'] if release else None
+        elif config_options.json_path is not None:
+            release, return_code = resolve_json_release(opener, config_options.url, config_options)
+            download_url: Optional[str] = release['url'] if release else None
+        else:
+            html: Optional[str] = None
+            if any((config_options.resolve, config_options.regex, config_options.code)):
+                html = fetch_page(opener, config_options.url, config_options.user_agent)
+
+            download_url, return_code = resolve_download_url(config_options.url, html, config_options.regex,
+                                                             config_options.code, config_options.resolve)
+        if download_url is None:
+            return {**plan, 'status': f'error ({return_code})'}
+
+        head: dict = head_request(opener, download_url, config_options.user_agent)
+        plan.update(url=head['url'], size=head['size'] or (release or {}).get('size'))
+        plan['available'] = release.get('version') or version_from_url(head['url']) or version_from_url(download_url)
+        plan['installed'] = installed_app_version(config_options)
+    except Exception as err:
+        logger.error(f'Unable to plan {title}: {err}')
+        return {**plan, 'status': 'error'}
+
+    if plan['available'] is None:
+        status: str = 'unknown'
+    elif plan['installed'] is None:
+        status: str = 'install' if getattr(config_options, 'app_name', None) else 'unknown'
+    elif is_newer_version(plan['available'], plan['installed']):
+        status: str = 'update'
+    else:
+        status: str = 'current'
+
+    return {**plan, 'status': status}
+
+
+async def plan_configs(configs: list) -> list:
+    """
+    Plan every config concurrently, each config's blocking requests run on their own thread with its own options
+    :param configs: List of (title, options of the config)
+    :return: List of plans
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    def plan_in_context(title: str, config_options: argparse.Namespace) -> dict:
+        context: contextvars.Context = parent_context.copy()
+        context.run(options.set, config_options)
+        return context.run(plan_config, title, config_options)
+
+    parent_context: contextvars.Context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=min(max(len(configs), 1), 64), thread_name_prefix='plan') as executor:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        return await asyncio.gather(*(
+            loop.run_in_executor(executor, plan_in_context, title, config_options) for title, config_options in configs
+        ))
+
+
+def print_table(columns: list, rows: list) -> None:
+    """
+    Print rows as a table with a column for each value, None is shown as -
+    :param columns: Column names
+    :param rows: List of rows, each a list of values
+    """
+    rows = [['-' if value is None else str(value) for value in row] for row in rows]
+    widths: list = [max([len(column)] + [len(row[index]) for row in rows]) for index, column in enumerate(columns)]
+
+    print('  '.join(column.upper().ljust(width) for column, width in zip(columns, widths)).rstrip())
+    for row in rows:
+        print('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def print_plan(plans: list) -> None:
+    """
+    Print the plans as a table
+    :param plans: List of plans
+    """
+    print_table(['config', 'installed', 'available', 'size', 'status', 'url'], [[
+        plan['config'],
+        plan['installed'] or '-',
+        plan['available'] or '-',
+        f'{plan["size"] / 1024 ** 2:.1f} MB' if plan['size'] else '-',
+        plan['status'],
+        plan['url'] or '-'
+    ] for plan in plans])
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    install_from_web_report.py:
+    Keep the history of runs, report on it, export metrics to prometheus and profile runs, imported by install_from_web.py on first use
+    """
+
+import contextlib
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Any
+from urllib.parse import urlparse
+
+from install_from_web import logger, RunMetrics
+
+
+def write_prometheus(runs_metrics: list, prometheus_file: Path) -> None:
+    """
+    Write the metrics of the latest runs in the prometheus textfile collector format
+    The file is replaced atomically so the node exporter never reads a partial file
+    :param runs_metrics: List of RunMetrics, one per config
+    :param prometheus_file: Path to the .prom file
+    """
+
+    def label(value: Any) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    prefix: str = 'install_from_web'
+    gauges: dict = {
+        'phase_seconds': 'Time spent in each phase of the last run',
+        'run_seconds': 'Total time of the last run',
+        'result_code': 'Exit code of the last run',
+        'download_bytes': 'Bytes downloaded in the last run',
+        'download_bytes_per_second': 'Download throughput of the last run',
+        'redirects': 'Redirects followed in the last run',
+        'last_run_timestamp_seconds': 'Start time of the last run',
+    }
+    samples: dict = {name: [] for name in gauges}
+
+    for run_metrics in runs_metrics:
+        config: str = f'config="{label(run_metrics.name)}"'
+        for phase, seconds in run_metrics.phases.items():
+            samples['phase_seconds'].append(f'{{{config},phase="{label(phase)}"}} {seconds:.6f}')
+        failed: str = f',failed_phase="{label(run_metrics.failed_phase)}"' if run_metrics.failed_phase else ''
+        samples['result_code'].append(f'{{{config}{failed}}} {run_metrics.result_code}')
+        samples['run_seconds'].append(f'{{{config}}} {run_metrics.duration or 0:.6f}')
+        samples['last_run_timestamp_seconds'].append(f'{{{config}}} {run_metrics.started:.3f}')
+        if 'download_bytes' in run_metrics.counters:
+            mb_per_second: float = run_metrics.counters.get('download_mb_per_second', 0.0)
+            samples['download_bytes'].append(f'{{{config}}} {run_metrics.counters["download_bytes"]}')
+            samples['download_bytes_per_second'].append(f'{{{config}}} {mb_per_second * 1024 ** 2:.0f}')
+            samples['redirects'].append(f'{{{config}}} {run_metrics.counters.get("redirects", 0)}')
+
+    lines: list = []
+    for name, description in gauges.items():
+        if not samples[name]:
+            continue
+        lines.append(f'# HELP {prefix}_{name} {description}')
+        lines.append(f'# TYPE {prefix}_{name} gauge')
+        lines.extend(f'{prefix}_{name}{sample}' for sample in samples[name])
+
+    try:
+        temp_file: Path = prometheus_file.with_name(f'.{prometheus_file.name}.tmp')
+        temp_file.write_text('\n'.join(lines) + '\n')
+        os.replace(temp_file, prometheus_file)
+    except OSError as err:
+        logger.error(f'Unable to write prometheus metrics to {prometheus_file}: {err}')
+
+
+class RunHistory:
+    """
+    History of every run in a SQLite database, in WAL mode so concurrent workers and reports do not block each other
+    A connection is opened per call, so it can be used from any thread
+    """
+
+    SCHEMA_VERSION: int = 1
+
+    def __init__(self, path: Path) -> None:
+        """
+        Initialise the history, creating the database if needed
+        path: (Path) Path to the database
+        """
+        self.path: Path = path
+        with self.connect() as connection:
+            if connection.execute('PRAGMA user_version').fetchone()[0] < self.SCHEMA_VERSION:
+                connection.executescript(f"""
+                    CREATE TABLE IF NOT EXISTS runs (
+                        id INTEGER PRIMARY KEY,
+                        config TEXT NOT NULL,
+                        started REAL NOT NULL,
+                        duration REAL,
+                        result_code INTEGER,
+                        failed_phase TEXT,
+                        url TEXT,
+                        host TEXT,
+                        etag TEXT,
+                        last_modified TEXT,
+                        size INTEGER,
+                        digest TEXT,
+                        file_type TEXT,
+                        installed_version TEXT,
+                        new_version TEXT,
+                        phases TEXT,
+                        counters TEXT
+                    );
+                    CREATE INDEX IF NOT EXISTS runs_config_started ON runs (config, started);
+                    PRAGMA user_version = {self.SCHEMA_VERSION};
+                """)
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Open a connection for one transaction, committed on success and closed after
+        """
+        import sqlite3
+
+        connection: sqlite3.Connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def record(self, run_metrics: RunMetrics) -> None:
+        """
+        Record a completed run
+        :param run_metrics: Metrics of the run
+        """
+        counters: dict = run_metrics.counters
+        url: Optional[str] = counters.get('download_url')
+        with self.connect() as connection:
+            connection.execute(
+                'INSERT INTO runs (config, started, duration, result_code, failed_phase, url, host, etag, '
+                'last_modified, size, digest, file_type, installed_version, new_version, phases, counters) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_metrics.name, run_metrics.started, run_metrics.duration, run_metrics.result_code,
+                 run_metrics.failed_phase, url, urlparse(url).netloc if url else None, counters.get('etag'),
+                 counters.get('last_modified'), counters.get('download_bytes') or counters.get('expected_bytes'),
+                 counters.get('digest'),
+                 counters.get('file_type'), counters.get('installed_version'), counters.get('new_version'),
+                 json.dumps(run_metrics.phases), json.dumps(counters, default=str)))
+
+    def last_success(self, config: str) -> Optional[dict]:
+        """
+        Get the last run of a config that downloaded and succeeded
+        :param config: Name of the config
+        :return: The run, or None if there is none
+        """
+        with self.connect() as connection:
+            row = connection.execute(
+                'SELECT * FROM runs WHERE config = ? AND result_code = 0 AND url IS NOT NULL '
+                'ORDER BY started DESC LIMIT 1', (config,)).fetchone()
+
+        return dict(row) if row else None
+
+    def report(self, name: str, limit: int) -> tuple:
+        """
+        Query the history for a report
+        :param name: runs (the latest runs), slowest (average time per download host) or failures (failure streaks)
+        :param limit: Most rows to return
+        :return: Column names and rows
+        """
+        queries: dict = {
+            'runs': """
+                SELECT config, datetime(started, 'unixepoch', 'localtime') AS started, round(duration, 1) AS seconds,
+                       result_code, failed_phase, new_version AS version, url
+                FROM runs ORDER BY runs.started DESC LIMIT ?
+            """,
+            'slowest': """
+                SELECT host, count(*) AS runs, round(avg(duration), 1) AS avg_seconds,
+                       round(max(duration), 1) AS max_seconds,
+                       round(avg(json_extract(phases, '$.download')), 1) AS avg_download_seconds,
+                       round(sum(result_code != 0) * 100.0 / count(*)) AS failure_percent
+                FROM runs WHERE host IS NOT NULL GROUP BY host ORDER BY avg_seconds DESC LIMIT ?
+            """,
+            'failures': """
+                SELECT config, count(*) AS failures, datetime(min(started), 'unixepoch', 'localtime') AS since,
+                       group_concat(DISTINCT result_code) AS result_codes, max(failed_phase) AS failed_phase
+                FROM runs
+                WHERE result_code != 0 AND started > coalesce(
+                    (SELECT max(started) FROM runs AS succeeded
+                     WHERE succeeded.config = runs.config AND succeeded.result_code = 0), 0)
+                GROUP BY config ORDER BY failures DESC, since LIMIT ?
+            """
+        }
+        with self.connect() as connection:
+            cursor = connection.execute(queries[name], (limit,))
+            rows: list = cursor.fetchall()
+
+        return [column[0] for column in cursor.description], [list(row) for row in rows]
+
+    def predictions(self, configs: list, runs: int = 5) -> dict:
+        """
+        Predict how long configs take from their latest runs, the median so one slow mirror or outage does not count
+        :param configs: Names of the configs
+        :param runs: Latest runs of each config to take the median of
+        :return: Dictionary of config to seconds, configs that never ran are left out
+        """
+        import statistics
+
+        with self.connect() as connection:
+            rows: list = connection.execute(f"""
+                SELECT config, duration FROM (
+                    SELECT config, duration, row_number() OVER (PARTITION BY config ORDER BY started DESC) AS latest
+                    FROM runs WHERE duration IS NOT NULL AND config IN ({', '.join('?' * len(configs))})
+                ) WHERE latest <= ?
+            """, (*configs, runs)).fetchall()
+
+        durations: dict = {}
+        for row in rows:
+            durations.setdefault(row['config'], []).append(row['duration'])
+        return {config: statistics.median(seconds) for config, seconds in durations.items()}
+
+
+# Held by the job being profiled
+profile_lock: threading.Lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def profile_run(name: str, profile_dir: Path, sample_subprocesses: bool = False):
+    """
+    Profile the wrapped run with cProfile and tracemalloc, only imported and started when used
+    Writes <name>.pstats and a <name>.txt report of the peak memory, top allocations and slowest calls
+    :param name: Name of the config, used for the file names
+    :param profile_dir: Directory to write the profile to
+    :param sample_subprocesses: Record the wall time spent waiting on each external tool
+    """
+    import cProfile
+    import io
+    import pstats
+    import tracemalloc
+
+    # The profiler, tracemalloc and the communicate() patch are process wide, one job at a time is profiled
+    if not profile_lock.acquire(blocking=False):
+        logger.warning(f'Not profiling {name}, another job in the process is being profiled')
+        yield
+        return
+
+    file_name: str = re.sub(r'[^A-Za-z0-9._-]+', '_', name).strip('_') or 'install_from_web'
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    stats_path: Path = profile_dir.joinpath(f'{file_name}.pstats')
+    report_path: Path = profile_dir.joinpath(f'{file_name}.txt')
+
+    # Time spent in communicate(), which subprocess.run() uses for every call, grouped by tool
+    subprocess_times: dict = {}
+    original_communicate = subprocess.Popen.communicate
+
+    def timed_communicate(process: subprocess.Popen, *args, **kwargs):
+        args_list: list = [process.args] if isinstance(process.args, (str, bytes)) else list(process.args)
+        tool: str = Path(str(args_list[1] if args_list[0] == 'sudo' else args_list[0]).split()[0]).name
+        start_time: float = time.perf_counter()
+        try:
+            return original_communicate(process, *args, **kwargs)
+        finally:
+            calls, seconds = subprocess_times.get(tool, (0, 0.0))
+            subprocess_times[tool] = (calls + 1, seconds + time.perf_counter() - start_time)
+
+    if sample_subprocesses:
+        subprocess.Popen.communicate = timed_communicate
+
+    profiler: cProfile.Profile = cProfile.Profile()
+    tracemalloc.start()
+    start_time: float = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall_time: float = time.perf_counter() - start_time
+        snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        subprocess.Popen.communicate = original_communicate
+        profile_lock.release()
+
+        profiler.dump_stats(stats_path)
+        calls_report: io.StringIO = io.StringIO()
+        pstats.Stats(profiler, stream=calls_report).sort_stats('cumulative').print_stats(30)
+
+        report: list = [
+            f'Profile of {name}',
+            f'Wall time: {wall_time:.3f}s',
+            f'Peak traced memory: {peak / 1024 ** 2:.2f} MiB',
+            '',
+            'Top allocations:'
+        ]
+        report.extend(f'  {stat}' for stat in snapshot.statistics('lineno')[:25])
+        if sample_subprocesses:
+            report.extend(['', 'Subprocess wait time:'])
+            for tool, (calls, seconds) in sorted(subprocess_times.items(), key=lambda item: -item[1][1]):
+                report.append(f'  {tool:<20} {calls:>4} call(s) {seconds:>10.3f}s')
+        report.extend(['', 'Slowest calls (cumulative):', calls_report.getvalue()])
+
+        report_path.write_text('\n'.join(report))
+        logger.info(f'Profile written to {stats_path} and {report_path}')
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    install_from_web_serve.py:
+    Serve the download cache to other machines as a mirror, imported by install_from_web.py on first use
+    """
+
+import contextvars
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Any
+from urllib.parse import urlparse
+
+from install_from_web import (
+    DOWNLOAD_CHUNK_SIZE, cache_key, get_filename, logger, open_url, read_cache, store_in_cache, system
+)
+from install_from_web_delta import cached_blockmap
+
+
+def context_http_server(address: tuple, handler: type) -> 'http.server.ThreadingHTTPServer':
+    """
+    Create a threading http server whose request threads run in a copy of the current context, so the handlers see
+    the options and logger of the job that started it
+    :param address: (host, port) to listen on
+    :param handler: Request handler class
+    :return: The server
+    """
+    import http.server
+
+    class ContextThreadingHTTPServer(http.server.ThreadingHTTPServer):
+        context: contextvars.Context = contextvars.copy_context()
+
+        def process_request_thread(self, request: Any, client_address: tuple) -> None:
+            self.context.copy().run(super().process_request_thread, request, client_address)
+
+    return ContextThreadingHTTPServer(address, handler)
+
+
+def serve_cache(address: str, cache_dir: Path, max_age: int, allowed_hosts: list) -> int:
+    """
+    Serve the artifact cache as a mirror, fetching from the origin and caching on a miss
+    Requests are /<host>/<path>, matching the cache layout, and are fetched from https://<host>/<path>, only for hosts
+    in allowed_hosts, so the mirror is not a proxy to anywhere for whoever can reach it
+    Cached downloads older than max_age are revalidated with the origin, a stale copy is served if it is down
+    Byte ranges are served for delta downloads, and /<host>/<path>.blockmap.json is the block map of the download
+    :param address: [host:]port to listen on
+    :param cache_dir: Cache directory
+    :param max_age: Seconds before a cached download is revalidated
+    :param allowed_hosts: Host names, or shell style patterns, the mirror fetches from
+    :return: Exit code
+    """
+    import email.utils
+    import fnmatch
+    import http.server
+    import shutil
+    import tempfile
+    import urllib.error
+    import urllib.request
+
+    host, _, port = address.rpartition(':')
+    key_locks: dict = {}
+    key_locks_lock: threading.Lock = threading.Lock()
+
+    def refresh(origin_url: str, cached_path: Optional[Path], cached_meta: dict) -> tuple:
+        opener, _ = system.opener()
+        req: urllib.request.Request = urllib.request.Request(origin_url)
+        if cached_path is not None and cached_meta.get('etag'):
+            req.add_header('If-None-Match', cached_meta['etag'])
+        if cached_path is not None and cached_meta.get('last_modified'):
+            req.add_header('If-Modified-Since', cached_meta['last_modified'])
+
+        try:
+            with open_url(opener, req) as response, \
+                    tempfile.TemporaryDirectory(dir=cache_dir) as temp_dir:
+                file_path: Path = Path(temp_dir, get_filename(response.geturl()) or 'download')
+                with open(file_path, 'wb') as file:
+                    shutil.copyfileobj(response, file, DOWNLOAD_CHUNK_SIZE)
+                logger.info(f'Fetched {origin_url} from the origin')
+                store_in_cache(cache_dir, origin_url, file_path, response.headers)
+        except urllib.error.HTTPError as err:
+            if err.code != 304 or cached_path is None:
+                raise
+            logger.debug(f'{origin_url} is unchanged')
+            cached_meta['fetched'] = time.time()
+            cached_path.with_name(f'{cached_path.name}.meta.json').write_text(json.dumps(cached_meta, indent=2))
+
+        return read_cache(cache_dir, origin_url)
+
+    def not_modified_since(last_modified: Optional[str], if_modified_since: Optional[str]) -> bool:
+        if not last_modified or not if_modified_since:
+            return False
+        try:
+            return email.utils.parsedate_to_datetime(last_modified) <= \
+                email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    class MirrorHandler(http.server.BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            self.serve(head=True)
+
+        def do_GET(self):
+            self.serve()
+
+        def serve(self, head: bool = False):
+            blockmap: bool = self.path.endswith('.blockmap.json')
+            origin_url: str = f'https:/{self.path.removesuffix(".blockmap.json")}'
+            origin: urlparse = urlparse(origin_url)
+            if '@' in origin.netloc or not any(fnmatch.fnmatch((origin.hostname or '').lower(), pattern.lower())
+                                               for pattern in allowed_hosts):
+                self.send_error(403, f'{origin.netloc} is not a host this mirror serves')
+                return
+            with key_locks_lock:
+                key_lock: threading.Lock = key_locks.setdefault(cache_key(origin_url), threading.Lock())
+
+            # One origin fetch per download, other requests for it wait for the cache
+            with key_lock:
+                cached_path, cached_meta = read_cache(cache_dir, origin_url)
+                if cached_path is None or time.time() - cached_meta.get('fetched', 0) > max_age:
+                    try:
+                        cached_path, cached_meta = refresh(origin_url, cached_path, cached_meta)
+                    except Exception as err:
+                        if cached_path is None:
+                            logger.error(f'Unable to fetch {origin_url}: {err}')
+                            self.send_error(getattr(err, 'code', 502), str(err))
+                            return
+                        logger.warning(f'Serving stale {cached_path}, unable to revalidate: {err}')
+
+                if blockmap:
+                    body: bytes = json.dumps(cached_blockmap(cached_path)).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    if not head:
+                        self.wfile.write(body)
+                    return
+
+            etag: str = cached_meta.get('etag') or f'"{cached_meta.get("size")}-{int(cached_meta.get("fetched", 0))}"'
+            # If-Modified-Since is only used without If-None-Match
+            if self.headers.get('If-None-Match') == etag or self.headers.get('If-None-Match') is None and \
+                    not_modified_since(cached_meta.get('last_modified'), self.headers.get('If-Modified-Since')):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+            # A single byte range, unless If-Range names an older copy
+            size: int = cached_path.stat().st_size
+            start, end = 0, size - 1
+            byte_range: Optional[re.Match] = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range') or '')
+            if byte_range and any(byte_range.groups()) and self.headers.get('If-Range') in (None, etag):
+                if byte_range[1]:
+                    start = int(byte_range[1])
+                    end = min(int(byte_range[2]), size - 1) if byte_range[2] else size - 1
+                else:
+                    start = max(size - int(byte_range[2]), 0)
+                if start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            if cached_meta.get('last_modified'):
+                self.send_header('Last-Modified', cached_meta['last_modified'])
+            self.end_headers()
+            if not head:
+                with open(cached_path, 'rb') as file:
+                    file.seek(start)
+                    remaining: int = end - start + 1
+                    while remaining and (chunk := file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))):
+                        self.wfile.write(chunk)
+                        remaining -= len(chunk)
+
+        def log_message(self, format: str, *args) -> None:
+            logger.info(f'{self.address_string()} {format % args}')
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    server: http.server.ThreadingHTTPServer = context_http_server((host, int(port)), MirrorHandler)
+    logger.info(f'Serving {cache_dir} as a mirror on {host or "*"}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Mirror stopped')
+    finally:
+        server.server_close()
+
+    return 0
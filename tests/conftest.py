@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    conftest.py:
+    Shared by the tests, imported by them so they also run with python3 -m unittest discover -s tests
+    """
+
+import functools
+import importlib
+import sys
+from pathlib import Path
+
+SCRIPT_PATH: Path = Path(__file__).resolve().parent.parent.joinpath('install_from_web.py')
+
+
+@functools.lru_cache(maxsize=None)
+def load_installer():
+    """
+    Import install_from_web.py as a module, once, from its folder so the modules of its modes are found next to it
+    :return: The module
+    """
+    sys.path.insert(0, SCRIPT_PATH.parent.as_posix())
+
+    return importlib.import_module('install_from_web')
+
+
+def load_mode(name: str):
+    """
+    Import the module of a rarely used mode, install_from_web_<name>.py, with install_from_web.py
+    :param name: Name of the mode
+    :return: The module
+    """
+    load_installer()
+
+    return importlib.import_module(f'install_from_web_{name}')
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    test_delta.py:
+    Test match_blocks finds the blocks of a new release in an older one, in place and moved, and delta_ranges groups
+    the rest into byte ranges
+    """
+
+import logging
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from conftest import load_installer, load_mode
+
+BLOCK_SIZE: int = 64
+
+
+class MatchBlocksTest(unittest.TestCase):
+    installer = load_installer()
+    delta = load_mode('delta')
+
+    def setUp(self) -> None:
+        self.folder: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.logger: logging.Logger = logging.getLogger('test_delta')
+        self.token = self.installer.logger.set(self.logger)
+        # 20 blocks of random bytes, so blocks only match where they were copied from
+        self.old: bytes = random.Random(26).randbytes(20 * BLOCK_SIZE)
+
+    def tearDown(self) -> None:
+        self.installer.logger.reset(self.token)
+        self.folder.cleanup()
+
+    def match(self, seed: bytes, new: bytes) -> tuple:
+        """
+        Write both releases and match the new one against the seed
+        :param seed: Older release
+        :param new: New release
+        :return: Matches and the block map of the new release
+        """
+        seed_path: Path = Path(self.folder.name).joinpath('seed.bin')
+        new_path: Path = Path(self.folder.name).joinpath('new.bin')
+        seed_path.write_bytes(seed)
+        new_path.write_bytes(new)
+        blockmap: dict = self.delta.make_blockmap(new_path, BLOCK_SIZE)
+
+        return self.delta.match_blocks(seed_path, blockmap), blockmap
+
+    def rebuild(self, seed: bytes, new: bytes) -> bytes:
+        """
+        Rebuild the new release from the blocks found in the seed and the ranges of those missing
+        :param seed: Older release
+        :param new: New release, the source of the missing ranges
+        :return: The rebuilt release
+        """
+        matches, blockmap = self.match(seed, new)
+        rebuilt: bytearray = bytearray(blockmap['size'])
+        for index, offset in matches.items():
+            rebuilt[index * BLOCK_SIZE:(index + 1) * BLOCK_SIZE] = seed[offset:offset + BLOCK_SIZE]
+        missing: list = [index for index in range(len(blockmap['blocks'])) if index not in matches]
+        for start, end in self.delta.delta_ranges(missing, BLOCK_SIZE, blockmap['size']):
+            rebuilt[start:end + 1] = new[start:end + 1]
+
+        return bytes(rebuilt)
+
+    def test_blockmap(self) -> None:
+        new: bytes = self.old + b'tail'
+        _, blockmap = self.match(self.old, new)
+
+        self.assertEqual((blockmap['size'], blockmap['block_size'], len(blockmap['blocks'])),
+                         (len(new), BLOCK_SIZE, 21))
+
+    def test_identical(self) -> None:
+        matches, _ = self.match(self.old, self.old)
+
+        self.assertEqual(matches, {index: index * BLOCK_SIZE for index in range(20)})
+
+    def test_changed_in_place(self) -> None:
+        new: bytearray = bytearray(self.old)
+        new[5 * BLOCK_SIZE + 10] ^= 0xff
+        new[6 * BLOCK_SIZE] ^= 0xff
+        matches, _ = self.match(self.old, bytes(new))
+
+        self.assertEqual(matches, {index: index * BLOCK_SIZE for index in range(20) if index not in (5, 6)})
+
+    def test_moved_by_an_insertion(self) -> None:
+        new: bytes = self.old[:5 * BLOCK_SIZE] + b'0123456789' + self.old[5 * BLOCK_SIZE:]
+        matches, _ = self.match(self.old, new)
+
+        # Block 5 holds the insertion, the blocks after it start 10 bytes earlier in the seed
+        expected: dict = {index: index * BLOCK_SIZE for index in range(5)}
+        expected.update({index: index * BLOCK_SIZE - 10 for index in range(6, 20)})
+        self.assertEqual(matches, expected)
+        self.assertEqual(self.rebuild(self.old, new), new)
+
+    def test_moved_by_a_removal(self) -> None:
+        new: bytes = self.old[:3 * BLOCK_SIZE] + self.old[3 * BLOCK_SIZE + 7:]
+
+        self.assertEqual(self.rebuild(self.old, new), new)
+        matches, _ = self.match(self.old, new)
+        self.assertEqual(matches[10], 10 * BLOCK_SIZE + 7)
+
+    def test_short_last_block_is_not_matched(self) -> None:
+        new: bytes = self.old + b'tail'
+        matches, _ = self.match(new, new)
+
+        self.assertEqual(set(matches), set(range(20)))
+        self.assertEqual(self.rebuild(new, new), new)
+
+    def test_seed_smaller_than_a_block(self) -> None:
+        matches, _ = self.match(self.old[:BLOCK_SIZE - 1], self.old)
+
+        self.assertEqual(matches, {})
+
+
+class DeltaRangesTest(unittest.TestCase):
+    delta = load_mode('delta')
+
+    def test_merges_adjacent_blocks(self) -> None:
+        self.assertEqual(self.delta.delta_ranges([0, 1, 2, 5], 10, 100), [[0, 29], [50, 59]])
+
+    def test_clips_the_last_block(self) -> None:
+        self.assertEqual(self.delta.delta_ranges([8, 9], 10, 95), [[80, 94]])
+
+    def test_nothing_missing(self) -> None:
+        self.assertEqual(self.delta.delta_ranges([], 10, 100), [])
+
+    def test_merges_the_smallest_gaps(self) -> None:
+        # Gaps of 10, 20 and 30 bytes between the 4 ranges
+        missing: list = [0, 2, 3, 6, 10]
+        self.assertEqual(self.delta.delta_ranges(missing, 10, 200, max_ranges=4),
+                         [[0, 9], [20, 39], [60, 69], [100, 109]])
+        self.assertEqual(self.delta.delta_ranges(missing, 10, 200, max_ranges=3), [[0, 39], [60, 69], [100, 109]])
+        self.assertEqual(self.delta.delta_ranges(missing, 10, 200, max_ranges=2), [[0, 69], [100, 109]])
+        self.assertEqual(self.delta.delta_ranges(missing, 10, 200, max_ranges=1), [[0, 109]])
+
+
+if __name__ == '__main__':
+    unittest.main()
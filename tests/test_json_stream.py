@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    test_json_stream.py:
+    Test JsonStream selects the same values as decoded json, across chunk boundaries, and parse_json_path
+    """
+
+import io
+import json
+import unittest
+
+from conftest import load_installer, load_mode
+
+FEED: dict = {
+    'product': 'Bench',
+    'notes': 'brackets [ ] { } and "quotes" in strings, \\ escapes and ünïcödé',
+    'releases': [
+        {'version': f'1.{minor}', 'downloads': {'mac': {'link': f'https://example.com/Bench-1.{minor}.dmg'}},
+         'tags': ['stable'] if minor % 2 else ['beta', 'nightly'], 'size': minor * 1000, 'draft': minor == 3}
+        for minor in range(6)
+    ],
+    'empty': [],
+    'scalar': 7
+}
+
+
+class CountingStream(io.BytesIO):
+    """
+    Bytes stream that counts what was read from it
+    """
+
+    def __init__(self, data: bytes) -> None:
+        """
+        Initialise the stream
+        :param data: Contents
+        """
+        super().__init__(data)
+        self.bytes_read: int = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read and count
+        :param size: Most bytes to read
+        :return: The bytes
+        """
+        data: bytes = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class ParseJsonPathTest(unittest.TestCase):
+    installer = load_installer()
+
+    def test_keys_indexes_and_wildcards(self) -> None:
+        self.assertEqual(self.installer.parse_json_path('releases[0].downloads.mac.link'),
+                         ['releases', 0, 'downloads', 'mac', 'link'])
+        self.assertEqual(self.installer.parse_json_path('$.releases[*].version'), ['releases', '*', 'version'])
+        self.assertEqual(self.installer.parse_json_path('releases.*.version'), ['releases', '*', 'version'])
+        self.assertEqual(self.installer.parse_json_path(' [-1].assets[*] '), [-1, 'assets', '*'])
+        self.assertEqual(self.installer.parse_json_path(''), [])
+
+
+class JsonStreamTest(unittest.TestCase):
+    installer = load_installer()
+    feeds = load_mode('feeds')
+
+    def select(self, path: str, chunk_size: int = 7) -> list:
+        """
+        Stream the feed in small chunks and select a path
+        :param path: Path, as for parse_json_path
+        :param chunk_size: Bytes read at a time
+        :return: The values
+        """
+        stream: io.BytesIO = io.BytesIO(json.dumps(FEED, ensure_ascii=False).encode())
+        return list(self.feeds.JsonStream(stream, chunk_size).select(self.installer.parse_json_path(path)))
+
+    def test_matches_decoded_json(self) -> None:
+        for path in ('product', 'notes', 'releases[2].downloads.mac.link', 'releases[*].version',
+                     'releases[*].tags[*]', 'releases[*].downloads.*.link', 'releases[-1].version',
+                     'releases[-6].size', 'releases[*].tags[-1]', 'releases[1]', 'empty[*]', 'scalar'):
+            with self.subTest(path=path):
+                self.assertEqual(self.select(path),
+                                 self.feeds.json_values(FEED, self.installer.parse_json_path(path)))
+
+    def test_every_chunk_size(self) -> None:
+        expected: list = [release['downloads']['mac']['link'] for release in FEED['releases']]
+        for chunk_size in (1, 2, 3, 5, 64, 1 << 16):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.select('releases[*].downloads.mac.link', chunk_size), expected)
+
+    def test_negative_indexes(self) -> None:
+        self.assertEqual(self.select('releases[-1].version'), ['1.5'])
+        self.assertEqual(self.select('releases[-2].version'), ['1.4'])
+        self.assertEqual(self.select('releases[-2].tags[-2]'), ['beta'])
+        self.assertEqual(self.select('releases[-1].tags[-2]'), [])
+        self.assertEqual(self.select('releases[*].tags[-1]'), ['nightly', 'stable'] * 3)
+
+    def test_missing_paths_select_nothing(self) -> None:
+        for path in ('missing', 'releases[6].version', 'releases[-7].version', 'empty[-1]', 'scalar.key',
+                     'product[0]', 'releases.version'):
+            with self.subTest(path=path):
+                self.assertEqual(self.select(path), [])
+
+    def test_stops_reading_when_the_generator_is_closed(self) -> None:
+        releases: list = [{'version': str(index), 'notes': 'x' * 1000} for index in range(1000)]
+        stream: CountingStream = CountingStream(json.dumps({'releases': releases}).encode())
+        values = self.feeds.JsonStream(stream, chunk_size=4096).select(['releases', '*', 'version'])
+
+        self.assertEqual(next(values), '0')
+        values.close()
+        self.assertLess(stream.bytes_read, 3 * 4096)
+
+    def test_invalid_json(self) -> None:
+        for data in (b'{"releases": [{"version": "1.0"} {"version": "1.1"}]}', b'{"releases": [{"version": "1.0"'):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    list(self.feeds.JsonStream(io.BytesIO(data)).select(['releases', '*', 'version']))
+
+
+if __name__ == '__main__':
+    unittest.main()
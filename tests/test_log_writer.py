@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-25'
+__description__ = \
+    """
+    test_log_writer.py:
+    Test LogWriter writes every event, including those logged after it is closed
+    """
+
+import logging
+import unittest
+
+from conftest import load_installer
+
+
+class ListHandler(logging.Handler):
+    """
+    Keep the messages of the events it handles
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialise the handler
+        """
+        super().__init__()
+        self.messages: list = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        Keep the message of an event
+        :param record: The record
+        """
+        self.messages.append(record.getMessage())
+
+
+class LogWriterTest(unittest.TestCase):
+    installer = load_installer()
+
+    def setUp(self) -> None:
+        self.handler: ListHandler = ListHandler()
+        self.writer = self.installer.LogWriter(self.handler)
+        self.logger: logging.Logger = logging.getLogger('test_log_writer')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.writer)
+
+    def tearDown(self) -> None:
+        self.logger.removeHandler(self.writer)
+
+    def test_close_writes_queued_events(self) -> None:
+        for index in range(100):
+            self.logger.info('event %d', index)
+        self.writer.close()
+
+        self.assertEqual(self.handler.messages, [f'event {index}' for index in range(100)])
+
+    def test_events_after_close_are_written(self) -> None:
+        self.logger.info('before')
+        self.writer.close()
+        self.logger.info('after')
+
+        self.assertEqual(self.handler.messages, ['before', 'after'])
+        self.assertFalse(self.writer.thread.is_alive())
+
+    def test_events_after_close_without_a_thread_are_written(self) -> None:
+        self.writer.close()
+        self.logger.warning('at exit')
+
+        self.assertEqual(self.handler.messages, ['at exit'])
+        self.assertIsNone(self.writer.thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
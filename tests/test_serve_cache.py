@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    test_serve_cache.py:
+    Test serve_cache answers from the cache with byte ranges and conditional requests, and only for allowed hosts
+    """
+
+import contextvars
+import http.client
+import logging
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from conftest import load_installer, load_mode
+
+BODY: bytes = bytes(range(256)) * 4
+LAST_MODIFIED: str = 'Wed, 25 Jun 2025 12:00:00 GMT'
+
+
+class ServeCacheTest(unittest.TestCase):
+    installer = load_installer()
+    serve = load_mode('serve')
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.folder: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        cache_dir: Path = Path(cls.folder.name).joinpath('cache')
+        download: Path = Path(cls.folder.name).joinpath('Bench.dmg')
+        download.write_bytes(BODY)
+
+        cls.logger: logging.Logger = logging.getLogger('test_serve_cache')
+        cls.logger.addHandler(logging.NullHandler())
+        cls.logger.propagate = False
+        cls.token = cls.installer.logger.set(cls.logger)
+        cls.installer.store_in_cache(cache_dir, 'https://example.com/Bench.dmg', download,
+                                     {'ETag': '"v1"', 'Last-Modified': LAST_MODIFIED})
+        cls.installer.store_in_cache(cache_dir, 'https://example.com/Plain.dmg', download, {})
+
+        # Keep the server serve_cache makes, to stop it when done
+        servers: list = []
+        started: threading.Event = threading.Event()
+        context_http_server = cls.serve.context_http_server
+
+        def keep_server(*args):
+            servers.append(context_http_server(*args))
+            started.set()
+            return servers[-1]
+
+        patcher = mock.patch.object(cls.serve, 'context_http_server', keep_server)
+        patcher.start()
+        cls.thread: threading.Thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(cls.serve.serve_cache, '127.0.0.1:0', cache_dir, 3600, ['example.com', '*.example.org']),
+            daemon=True
+        )
+        cls.thread.start()
+        started.wait(10)
+        patcher.stop()
+        cls.server = servers[0]
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.thread.join(10)
+        cls.installer.logger.reset(cls.token)
+        cls.folder.cleanup()
+
+    def request(self, path: str, method: str = 'GET', **headers: str) -> tuple:
+        """
+        Make a request of the mirror
+        :param path: Request path
+        :param method: Request method
+        :param headers: Request headers, underscores for dashes
+        :return: Status, headers and body of the response
+        """
+        connection: http.client.HTTPConnection = http.client.HTTPConnection('127.0.0.1', self.server.server_port,
+                                                                           timeout=10)
+        try:
+            connection.request(method, path, headers={name.replace('_', '-'): value for name, value in headers.items()})
+            response: http.client.HTTPResponse = connection.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            connection.close()
+
+    def test_full_download(self) -> None:
+        status, headers, body = self.request('/example.com/Bench.dmg')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body, BODY)
+        self.assertEqual((headers['ETag'], headers['Last-Modified'], headers['Accept-Ranges']),
+                         ('"v1"', LAST_MODIFIED, 'bytes'))
+        self.assertEqual(headers['Content-Length'], str(len(BODY)))
+
+    def test_head(self) -> None:
+        status, headers, body = self.request('/example.com/Bench.dmg', 'HEAD')
+
+        self.assertEqual((status, body), (200, b''))
+        self.assertEqual(headers['Content-Length'], str(len(BODY)))
+
+    def test_byte_ranges(self) -> None:
+        size: int = len(BODY)
+        for byte_range, start, end in (('bytes=10-19', 10, 19), ('bytes=1000-', 1000, size - 1),
+                                       ('bytes=-24', size - 24, size - 1), ('bytes=1000-5000', 1000, size - 1),
+                                       ('bytes=-5000', 0, size - 1)):
+            with self.subTest(byte_range=byte_range):
+                status, headers, body = self.request('/example.com/Bench.dmg', Range=byte_range)
+                self.assertEqual(status, 206)
+                self.assertEqual(headers['Content-Range'], f'bytes {start}-{end}/{size}')
+                self.assertEqual(body, BODY[start:end + 1])
+
+    def test_unsatisfiable_range(self) -> None:
+        status, headers, body = self.request('/example.com/Bench.dmg', Range='bytes=2000-')
+
+        self.assertEqual((status, body), (416, b''))
+        self.assertEqual(headers['Content-Range'], f'bytes */{len(BODY)}')
+
+    def test_if_range(self) -> None:
+        status, _, body = self.request('/example.com/Bench.dmg', Range='bytes=0-9', If_Range='"v1"')
+        self.assertEqual((status, body), (206, BODY[:10]))
+
+        # A range of an older copy would not fit with this one, so all of it is sent
+        status, _, body = self.request('/example.com/Bench.dmg', Range='bytes=0-9', If_Range='"v0"')
+        self.assertEqual((status, body), (200, BODY))
+
+    def test_if_none_match(self) -> None:
+        status, headers, body = self.request('/example.com/Bench.dmg', If_None_Match='"v1"')
+        self.assertEqual((status, headers['ETag'], body), (304, '"v1"', b''))
+
+        status, _, body = self.request('/example.com/Bench.dmg', If_None_Match='"v0"')
+        self.assertEqual((status, body), (200, BODY))
+
+    def test_if_modified_since(self) -> None:
+        for since, expected in ((LAST_MODIFIED, 304), ('Thu, 26 Jun 2025 12:00:00 GMT', 304),
+                                ('Tue, 24 Jun 2025 12:00:00 GMT', 200), ('not a date', 200)):
+            with self.subTest(since=since):
+                self.assertEqual(self.request('/example.com/Bench.dmg', If_Modified_Since=since)[0], expected)
+
+        # If-None-Match is used over If-Modified-Since
+        status: int = self.request('/example.com/Bench.dmg', If_None_Match='"v0"', If_Modified_Since=LAST_MODIFIED)[0]
+        self.assertEqual(status, 200)
+
+    def test_etag_without_one_from_the_origin(self) -> None:
+        status, headers, body = self.request('/example.com/Plain.dmg')
+        self.assertEqual((status, body), (200, BODY))
+        self.assertRegex(headers['ETag'], rf'^"{len(BODY)}-\d+"$')
+        self.assertIsNone(headers['Last-Modified'])
+
+        self.assertEqual(self.request('/example.com/Plain.dmg', If_None_Match=headers['ETag'])[0], 304)
+
+    def test_only_allowed_hosts(self) -> None:
+        for path in ('/example.net/Bench.dmg', '/user@example.com/Bench.dmg', '/example.com.evil.net/Bench.dmg'):
+            with self.subTest(path=path):
+                self.assertEqual(self.request(path)[0], 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    test_token_bucket.py:
+    Test TokenBucket lets bursts through, sleeps off its debt and refills at its rate, on a fake clock
+    """
+
+import threading
+import unittest
+from unittest import mock
+
+from conftest import load_installer
+
+
+class FakeClock:
+    """
+    Clock that only moves when slept on or told to
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialise the clock at 1000 seconds
+        """
+        self.now: float = 1000.0
+        self.frozen: bool = False
+        self.sleeps: list = []
+        self.lock: threading.Lock = threading.Lock()
+
+    def monotonic(self) -> float:
+        """
+        :return: The time
+        """
+        with self.lock:
+            return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Record a sleep and move the clock on, unless frozen
+        :param seconds: Seconds to sleep
+        """
+        with self.lock:
+            self.sleeps.append(seconds)
+            if not self.frozen:
+                self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+    installer = load_installer()
+
+    def setUp(self) -> None:
+        self.clock: FakeClock = FakeClock()
+        patcher = mock.patch.multiple(self.installer.time, monotonic=self.clock.monotonic, sleep=self.clock.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_starts_full(self) -> None:
+        bucket = self.installer.TokenBucket(100, capacity=300)
+        bucket.consume(200)
+        bucket.consume(100)
+
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(bucket.tokens, 0)
+
+    def test_capacity_defaults_to_the_rate(self) -> None:
+        bucket = self.installer.TokenBucket(100)
+
+        self.assertEqual((bucket.capacity, bucket.tokens), (100, 100))
+
+    def test_sleeps_off_the_debt(self) -> None:
+        bucket = self.installer.TokenBucket(100)
+        bucket.consume(350)
+
+        self.assertEqual(self.clock.sleeps, [2.5])
+        # The debt is paid back by the sleep, so the next read waits only for itself
+        bucket.consume(50)
+        self.assertEqual(self.clock.sleeps, [2.5, 0.5])
+
+    def test_refills_at_the_rate_up_to_capacity(self) -> None:
+        bucket = self.installer.TokenBucket(100, capacity=200)
+        bucket.consume(200)
+        self.clock.now += 1.5
+        bucket.consume(150)
+        self.assertEqual(self.clock.sleeps, [])
+
+        # An idle bucket does not save up more than its capacity
+        self.clock.now += 60
+        bucket.consume(300)
+        self.assertEqual(self.clock.sleeps, [1.0])
+
+    def test_counts_every_consume_across_threads(self) -> None:
+        # Sleeps of threads overlap in real time, so the clock stands still and only the count is checked
+        self.clock.frozen = True
+        bucket = self.installer.TokenBucket(1000)
+        threads: list = [threading.Thread(target=lambda: [bucket.consume(100) for _ in range(10)])
+                         for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 8000 bytes from a full bucket of 1000, the last consume waits out all 7000 of the debt
+        self.assertEqual(bucket.tokens, -7000)
+        self.assertEqual(len(self.clock.sleeps), 70)
+        self.assertEqual(max(self.clock.sleeps), 7.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
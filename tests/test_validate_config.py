@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-26'
+__description__ = \
+    """
+    test_validate_config.py:
+    Test validate_config casts fields by the schema, reports errors and leaves out unknown fields, and load_configs
+    with single configs and catalogs
+    """
+
+import json
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+from conftest import load_installer
+
+URL: str = 'https://example.com/Bench.dmg'
+
+
+class ValidateConfigTest(unittest.TestCase):
+    installer = load_installer()
+
+    def test_casts_fields(self) -> None:
+        config, errors, warnings = self.installer.validate_config({
+            'url': URL, 'app_install_path': '/Applications', 'tags': 'daily', 'priority': '5', 'json_latest': 'yes',
+            'reinstall': 'False', 'retry_statuses': ['503', 429], 'file_type': 'dmg', 'comment': None
+        })
+
+        self.assertEqual((errors, warnings), ([], []))
+        self.assertEqual(config, {
+            'url': URL, 'app_install_path': Path('/Applications'), 'tags': ['daily'], 'priority': 5,
+            'json_latest': True, 'reinstall': False, 'retry_statuses': [503, 429], 'file_type': 'dmg',
+            'comment': None
+        })
+
+    def test_invalid_fields(self) -> None:
+        config, errors, warnings = self.installer.validate_config({
+            'url': URL, 'priority': 'high', 'retries': True, 'file_type': 'tar.gz', 'tags': {'a': 1},
+            'retry_statuses': [503, 'x'], 'name': ['Bench']
+        })
+
+        self.assertEqual(config, {'url': URL})
+        self.assertEqual(warnings, [])
+        self.assertEqual([error.split(' ')[0] for error in errors],
+                         ['priority', 'retries', 'file_type', 'tags', 'retry_statuses', 'name'])
+        self.assertIn('expected one of pkg, tar, zip, dmg', errors[2])
+        self.assertIn('item 1 (\'x\')', errors[4])
+
+    def test_unknown_fields(self) -> None:
+        config, errors, warnings = self.installer.validate_config({'url': URL, 'tagz': ['a'], 'colour': 'blue'})
+
+        self.assertEqual(config, {'url': URL})
+        self.assertEqual(errors, [])
+        self.assertEqual(warnings, ['tagz: unknown field, did you mean tags?', 'colour: unknown field'])
+
+        config, errors, warnings = self.installer.validate_config({'url': URL, 'tagz': ['a']}, strict=True)
+        self.assertEqual(errors, ['tagz: unknown field, did you mean tags?'])
+        self.assertEqual(warnings, [])
+
+    def test_option_names_pass_as_they_are(self) -> None:
+        config, errors, warnings = self.installer.validate_config(
+            {'url': URL, 'copy_method': 'shutil', 'order': 'priority'}, strict=True)
+
+        self.assertEqual((config, errors, warnings), ({'url': URL, 'copy_method': 'shutil', 'order': 'priority'},
+                                                      [], []))
+
+    def test_url_is_required(self) -> None:
+        for config in ({}, {'url': ''}, {'url': None, 'name': 'Bench'}):
+            with self.subTest(config=config):
+                self.assertIn('url is a required field', self.installer.validate_config(config)[1])
+
+    def test_code_takes_precedence_over_regex(self) -> None:
+        config, errors, _ = self.installer.validate_config({'url': URL, 'regex': 'Bench.*', 'code': 'print(1)'})
+
+        self.assertEqual(errors, [])
+        self.assertIsNone(config['regex'])
+        self.assertEqual(config['code'], 'print(1)')
+
+    def test_not_an_object(self) -> None:
+        for entry, name in (([URL], 'list'), (URL, 'str'), (None, 'NoneType')):
+            with self.subTest(entry=entry):
+                self.assertEqual(self.installer.validate_config(entry), (None, [f'expected an object, got {name}'], []))
+
+
+class LoadConfigsTest(unittest.TestCase):
+    installer = load_installer()
+
+    def setUp(self) -> None:
+        self.folder: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.logger: logging.Logger = logging.getLogger('test_validate_config')
+        self.token = self.installer.logger.set(self.logger)
+
+    def tearDown(self) -> None:
+        self.installer.logger.reset(self.token)
+        self.folder.cleanup()
+
+    def write(self, name: str, text: str) -> Path:
+        """
+        Write a config file
+        :param name: File name
+        :param text: Contents
+        :return: Path of the file
+        """
+        path: Path = Path(self.folder.name).joinpath(name)
+        path.write_text(text)
+        return path
+
+    def test_single_config_and_catalogs(self) -> None:
+        single: Path = self.write('Bench.json', json.dumps({'url': URL}))
+        catalog: Path = self.write('catalog.json', json.dumps([
+            {'url': 'https://example.com/Tool.zip'}, {'url': URL, 'name': 'Named'}
+        ]))
+        lines: Path = self.write('catalog.jsonl', '\n'.join([json.dumps({'url': 'https://example.com/Other.pkg'}),
+                                                             '', json.dumps({'url': URL, 'priority': '2'})]))
+        configs, errors = self.installer.load_configs([single, catalog, lines])
+
+        self.assertEqual(errors, [])
+        self.assertEqual([title for title, _ in configs], ['Bench', 'Tool.zip', 'Named', 'Other.pkg', 'Bench.dmg'])
+        self.assertEqual(configs[-1][1]['priority'], 2)
+
+    def test_invalid_entries(self) -> None:
+        catalog: Path = self.write('catalog.json', json.dumps([{'url': URL}, {'name': 'No url'}, 'text']))
+        broken: Path = self.write('broken.json', '{"url": ')
+        missing: Path = Path(self.folder.name).joinpath('missing.json')
+
+        configs, errors = self.installer.load_configs([catalog, broken, missing])
+        self.assertEqual(len(configs), 1)
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(errors[0].startswith(f'{catalog}[1]: '))
+        self.assertTrue(errors[1].startswith(f'{catalog}[2]: '))
+
+        # Strict loads nothing when any entry is invalid
+        self.assertEqual(self.installer.load_configs([catalog], strict=True)[0], [])
+
+    def test_unknown_fields(self) -> None:
+        catalog: Path = self.write('catalog.json', json.dumps([{'url': URL, 'tagz': ['a']}]))
+
+        with self.assertLogs(self.logger, logging.WARNING) as logs:
+            configs, errors = self.installer.load_configs([catalog])
+        self.assertEqual((configs, errors), ([('Bench.dmg', {'url': URL})], []))
+        self.assertEqual(logs.records[0].getMessage(),
+                         f'Left out of {catalog}[0]: tagz: unknown field, did you mean tags?')
+
+        configs, errors = self.installer.load_configs([catalog], strict_fields=True)
+        self.assertEqual((configs, errors), ([], [f'{catalog}[0]: tagz: unknown field, did you mean tags?']))
+
+
+if __name__ == '__main__':
+    unittest.main()
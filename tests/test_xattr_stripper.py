@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+__author__ = 'thedzy'
+__copyright__ = 'Copyright 2025, thedzy'
+__license__ = 'GPL'
+__version__ = '1.0'
+__maintainer__ = 'thedzy'
+__email__ = 'thedzy@hotmail.com'
+__status__ = 'Development'
+__date__ = '2025-06-25'
+__description__ = \
+    """
+    test_xattr_stripper.py:
+    Test XattrStripper on Linux with a user.* attribute standing in for com.apple.quarantine
+    """
+
+import errno
+import logging
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from conftest import load_installer
+
+ATTRIBUTE: str = 'user.install_from_web.test'
+
+
+def user_xattrs_supported(folder: str) -> bool:
+    """
+    Check the filesystem of a folder takes user.* attributes
+    :param folder: Folder to check
+    :return: True if supported
+    """
+    if not hasattr(os, 'setxattr'):
+        return False
+    with tempfile.NamedTemporaryFile(dir=folder) as file:
+        try:
+            os.setxattr(file.name, ATTRIBUTE, b'1')
+        except OSError:
+            return False
+    return True
+
+
+@unittest.skipUnless(user_xattrs_supported(tempfile.gettempdir()), 'user.* extended attributes are not supported')
+class XattrStripperTest(unittest.TestCase):
+    installer = load_installer()
+
+    def setUp(self) -> None:
+        self.folder: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.root: Path = Path(self.folder.name).joinpath('Bench.app')
+        self.logger: logging.Logger = logging.getLogger('test_xattr_stripper')
+        self.logger.setLevel(logging.DEBUG)
+        self.token = self.installer.logger.set(self.logger)
+
+        # 13 paths: the bundle, 4 folders, 7 files and a symlink, the files and folders carry the attribute
+        self.tagged: list = []
+        for folder in ('Contents', 'Contents/MacOS', 'Contents/Resources', 'Contents/Resources/en.lproj'):
+            self.root.joinpath(folder).mkdir(parents=True)
+        for file in ('Contents/Info.plist', 'Contents/MacOS/Bench', 'Contents/Resources/a.bin',
+                     'Contents/Resources/b.bin', 'Contents/Resources/c.bin', 'Contents/Resources/en.lproj/a.strings',
+                     'Contents/Resources/en.lproj/b.strings'):
+            self.root.joinpath(file).write_bytes(b'bench')
+        self.root.joinpath('Contents/Resources/latest.bin').symlink_to('a.bin')
+        for path in [self.root, *self.root.rglob('*')]:
+            if not path.is_symlink():
+                os.setxattr(path, ATTRIBUTE, b'1')
+                self.tagged.append(path)
+
+    def tearDown(self) -> None:
+        self.installer.logger.reset(self.token)
+        self.folder.cleanup()
+
+    def test_strip_tree(self) -> None:
+        stripper = self.installer.XattrStripper(ATTRIBUTE, batch_size=4)
+        stripper.strip_tree(self.root)
+        stripper.close()
+
+        self.assertEqual((stripper.checked, stripper.stripped, stripper.failed), (13, 12, 0))
+        for path in self.tagged:
+            self.assertNotIn(ATTRIBUTE, os.listxattr(path))
+
+    def test_copy(self) -> None:
+        stripper = self.installer.XattrStripper(ATTRIBUTE, batch_size=4)
+        destination: Path = Path(self.folder.name).joinpath('Applications', 'Bench.app')
+        stripper.copytree(self.installer.System(), self.root, destination)
+        stripper.close()
+
+        # Every path of the copy once, the symlink is copied as the file it points to
+        self.assertEqual((stripper.checked, stripper.stripped, stripper.failed), (13, 13, 0))
+        for path in [destination, *destination.rglob('*')]:
+            if not path.is_symlink():
+                self.assertNotIn(ATTRIBUTE, os.listxattr(path))
+
+    def test_failures_are_counted_and_logged(self) -> None:
+        stripper = self.installer.XattrStripper(ATTRIBUTE, batch_size=4)
+        remove = stripper.removexattr
+
+        def removexattr(path, name) -> None:
+            if str(path).endswith('.bin'):
+                raise PermissionError(errno.EPERM, os.strerror(errno.EPERM), path)
+            remove(path, name)
+
+        stripper.removexattr = removexattr
+        with self.assertLogs(self.logger, logging.DEBUG) as logs:
+            stripper.strip_tree(self.root)
+            stripper.close()
+
+        self.assertEqual((stripper.checked, stripper.stripped, stripper.failed), (10, 9, 3))
+        self.assertEqual(sum('Unable to remove' in line for line in logs.output), 3)
+
+    def test_close_raises_thread_errors(self) -> None:
+        stripper = self.installer.XattrStripper(ATTRIBUTE, batch_size=4)
+
+        def removexattr(path, name) -> None:
+            raise RuntimeError(f'unexpected error for {path}')
+
+        stripper.removexattr = removexattr
+        stripper.strip_tree(self.root)
+        with self.assertRaises(RuntimeError):
+            stripper.close()
+
+
+if __name__ == '__main__':
+    unittest.main()